@@ -3,12 +3,13 @@ import os
 import re
 
 import sentry_sdk
-from flask import Flask, make_response, render_template
+from flask import Flask, jsonify, make_response, render_template
 from flask_cors import CORS
 from sentry_sdk.integrations.flask import FlaskIntegration
 
-from findthatpostcode import blueprints, commands, db
+from findthatpostcode import blueprints, cache, commands, db, jobs
 from findthatpostcode.controllers.areas import area_types_count
+from findthatpostcode.controllers.points import start_polygon_index
 from findthatpostcode.metadata import (
     AREA_TYPES,
     KEY_AREA_TYPES,
@@ -51,6 +52,35 @@ def create_app(test_config=None):
         S3_SECRET_KEY=os.environ.get("S3_SECRET_KEY"),
         S3_BUCKET=os.environ.get("S3_BUCKET", "geo-boundaries"),
         ETHICAL_ADS_PUBLISHER=os.environ.get("ETHICAL_ADS_PUBLISHER"),
+        AREA_CACHE_SIZE=int(os.environ.get("AREA_CACHE_SIZE", 20000)),
+        AREA_CACHE_TTL=int(os.environ.get("AREA_CACHE_TTL", 86400)),
+        RESPONSE_CACHE_SIZE=int(os.environ.get("RESPONSE_CACHE_SIZE", 5000)),
+        RESPONSE_CACHE_TTL=int(os.environ.get("RESPONSE_CACHE_TTL", 86400)),
+        RESPONSE_CACHE_DB=os.environ.get("RESPONSE_CACHE_DB"),
+        BOUNDARY_CACHE_DIR=os.environ.get("BOUNDARY_CACHE_DIR"),
+        BOUNDARY_CACHE_SIZE=int(os.environ.get("BOUNDARY_CACHE_SIZE", 1024**3)),
+        BOUNDARY_MEMORY_CACHE_SIZE=int(
+            os.environ.get("BOUNDARY_MEMORY_CACHE_SIZE", 64 * 1024**2)
+        ),
+        BOUNDARY_MEMORY_CACHE_ITEMS=int(
+            os.environ.get("BOUNDARY_MEMORY_CACHE_ITEMS", 10000)
+        ),
+        HTTP_CACHE_MAX_AGE=int(os.environ.get("HTTP_CACHE_MAX_AGE", 604800)),
+        POSTCODE_INDEX_PATH=os.environ.get(
+            "POSTCODE_INDEX_PATH", os.path.join(app.instance_path, "postcodes.grid")
+        ),
+        POLYGON_INDEX_AREATYPES=[
+            a.strip()
+            for a in os.environ.get("POLYGON_INDEX_AREATYPES", "").split(",")
+            if a.strip()
+        ],
+        CSV_WORKERS=int(os.environ.get("CSV_WORKERS", 4)),
+        CSV_JOBS_DIR=os.environ.get(
+            "CSV_JOBS_DIR", os.path.join(app.instance_path, "csv_jobs")
+        ),
+        CSV_JOB_WORKERS=int(os.environ.get("CSV_JOB_WORKERS", 2)),
+        CSV_JOB_TTL=int(os.environ.get("CSV_JOB_TTL", 86400)),
+        CSV_JOB_TIMEOUT=int(os.environ.get("CSV_JOB_TIMEOUT", 3600)),
     )
 
     if test_config is None:
@@ -67,6 +97,8 @@ def create_app(test_config=None):
         pass
 
     db.init_app(app)
+    cache.init_app(app)
+    jobs.init_app(app)
     commands.init_app(app)
     CORS(app)
 
@@ -105,6 +137,19 @@ def create_app(test_config=None):
     def about():
         return render_template("about.html.j2")
 
+    @app.route("/version")
+    @app.route("/version.json")
+    def version():
+        release = db.get_data_release(db.get_db())
+        return jsonify(
+            {
+                "version": release.get("version"),
+                "updated": release.get("updated"),
+                "datasets": release.get("datasets", {}),
+            }
+        )
+
     blueprints.init_app(app)
+    start_polygon_index(app)
 
     return app
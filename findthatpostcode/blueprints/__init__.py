@@ -7,6 +7,7 @@ from findthatpostcode.blueprints import (
     postcodes,
     reconcile,
     search,
+    tiles,
     tools,
 )
 
@@ -21,3 +22,4 @@ def init_app(app):
     app.register_blueprint(places.bp)
     app.register_blueprint(search.bp)
     app.register_blueprint(tools.bp)
+    app.register_blueprint(tiles.bp)
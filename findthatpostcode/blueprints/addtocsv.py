@@ -1,18 +1,34 @@
 import codecs
 import os
+import shutil
 import tempfile
 
-from flask import Blueprint, make_response, render_template, request
+from flask import (
+    Blueprint,
+    abort,
+    current_app,
+    jsonify,
+    render_template,
+    request,
+    send_file,
+    stream_with_context,
+    url_for,
+)
 
-from findthatpostcode.blueprints.process_csv import process_csv
+from findthatpostcode.blueprints.process_csv import expand_fields, iter_csv
 from findthatpostcode.controllers.areas import area_types_count
 from findthatpostcode.db import get_db
+from findthatpostcode.jobs import FINISHED, csv_jobs
 from findthatpostcode.metadata import (
     BASIC_UPLOAD_FIELDS,
     DEFAULT_UPLOAD_FIELDS,
     STATS_FIELDS,
 )
 
+# uploads bigger than this are copied to a file on disk rather than memory
+# while the output is streamed back
+UPLOAD_SPOOL_SIZE = 1024**2
+
 bp = Blueprint("addtocsv", __name__, url_prefix="/addtocsv")
 
 
@@ -28,51 +44,120 @@ def addtocsv():
     )
 
 
-@bp.route("/", strict_slashes=False, methods=["POST"])
-def return_csv():
+def get_upload():
+    """
+    The uploaded file, and the options for `iter_csv` chosen in the form
+
+    Rows are looked up by postcode, or by the nearest postcode to the
+    coordinates in `lat_column` and `lon_column` or in `easting_column`
+    and `northing_column` if they are given.
+    """
     upload = request.files.get("csvfile")
-    column_name = request.form.get("column_name", "postcode")
+    if upload is None:
+        abort(400, description="No file uploaded")
+    _, ext = os.path.splitext(upload.filename)
+    if ext not in [".csv"]:
+        abort(400, description="File extension not allowed.")
     fields = request.form.getlist("fields")
     if not fields:
         fields = DEFAULT_UPLOAD_FIELDS
+    options = {
+        "postcode_field": request.form.get("column_name", "postcode"),
+        "fields": expand_fields(fields),
+        "point_fields": None,
+        "osgb": False,
+    }
+    if request.form.get("lat_column") and request.form.get("lon_column"):
+        options["point_fields"] = [
+            request.form["lat_column"],
+            request.form["lon_column"],
+        ]
+    elif request.form.get("easting_column") and request.form.get("northing_column"):
+        options["point_fields"] = [
+            request.form["easting_column"],
+            request.form["northing_column"],
+        ]
+        options["osgb"] = True
+    return upload, options
 
-    if "latlng" in fields:
-        fields.append("lat")
-        fields.append("long")
-        fields.remove("latlng")
 
-    if "estnrth" in fields:
-        fields.append("oseast1m")
-        fields.append("osnrth1m")
-        fields.remove("estnrth")
+@bp.route("/", strict_slashes=False, methods=["POST"])
+def return_csv():
+    upload, options = get_upload()
 
-    if "lep" in fields:
-        fields.append("lep1")
-        fields.append("lep2")
-        fields.remove("lep")
+    # the upload is closed at the end of the request, so it's copied to a
+    # file that lasts until the output has been streamed back
+    spool = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_SIZE)
+    shutil.copyfileobj(upload.stream, spool)
+    spool.seek(0)
 
-    if "lep_name" in fields:
-        fields.append("lep1_name")
-        fields.append("lep2_name")
-        fields.remove("lep_name")
+    def generate():
+        with spool:
+            yield from iter_csv(
+                codecs.iterdecode(spool, "utf-8"),
+                get_db(),
+                workers=current_app.config["CSV_WORKERS"],
+                **options,
+            )
+
+    response = current_app.response_class(
+        stream_with_context(generate()),
+        mimetype="text/csv",
+    )
+    response.headers["Content-Disposition"] = 'attachment; filename="{}"'.format(
+        upload.filename
+    )
+    return response
 
-    _, ext = os.path.splitext(upload.filename)
-    if ext not in [".csv"]:
-        return "File extension not allowed."
-
-    with tempfile.SpooledTemporaryFile(mode="w+", newline="") as output:
-        process_csv(
-            codecs.iterdecode(upload.stream, "utf-8"),
-            output,
-            get_db(),
-            column_name,
-            fields,
-        )
-        output.seek(0)
 
-        response = make_response(output.read())
-        response.headers["Content-Type"] = "text/csv"
-        response.headers["Content-Disposition"] = 'attachment; filename="{}"'.format(
-            upload.filename
+def job_result(job):
+    links = {"self": url_for("addtocsv.get_job", job_id=job["id"], _external=True)}
+    if job["status"] == FINISHED:
+        links["download"] = url_for(
+            "addtocsv.download_job", job_id=job["id"], _external=True
         )
-        return response
+    return {"data": job, "links": links}
+
+
+@bp.route("/jobs", methods=["POST"])
+def create_job():
+    """
+    Add postcode data to a CSV file in the background
+
+    Use this rather than the /addtocsv upload for files that would take too
+    long to process within one request. The response links to the status of
+    the job, which has a download link once the job has finished.
+    """
+    upload, options = get_upload()
+    job = csv_jobs.create(
+        current_app._get_current_object(),
+        upload.stream,
+        upload.filename,
+        options,
+    )
+    result = job_result(job)
+    response = jsonify(result)
+    response.status_code = 202
+    response.headers["Location"] = result["links"]["self"]
+    return response
+
+
+@bp.route("/jobs/<job_id>")
+def get_job(job_id):
+    job = csv_jobs.get(job_id)
+    if job is None:
+        abort(404, description="Job not found")
+    return jsonify(job_result(job))
+
+
+@bp.route("/jobs/<job_id>/download")
+def download_job(job_id):
+    job = csv_jobs.get(job_id)
+    if job is None or job["status"] != FINISHED:
+        abort(404, description="Job not found or not finished")
+    return send_file(
+        csv_jobs.output_path(job_id),
+        mimetype="text/csv",
+        as_attachment=True,
+        download_name=job["filename"],
+    )
@@ -1,10 +1,12 @@
 import csv
 import io
+import json
 import re
 
 from flask import (
     Blueprint,
     abort,
+    current_app,
     jsonify,
     make_response,
     redirect,
@@ -13,9 +15,27 @@ from flask import (
     url_for,
 )
 
-from findthatpostcode.blueprints.utils import return_result
-from findthatpostcode.controllers.areas import Area, get_all_areas
-from findthatpostcode.db import get_db
+from findthatpostcode.blueprints.utils import (
+    add_server_timing,
+    cache_response,
+    conditional_response,
+    get_boundary_detail,
+    get_include,
+    return_result,
+)
+from findthatpostcode.controllers.areas import (
+    Area,
+    get_all_areas,
+    get_area_boundaries,
+)
+from findthatpostcode.cache import MISSING, boundary_cache
+from findthatpostcode.db import get_boundaries_version, get_data_version, get_db
+from findthatpostcode.formats import to_flatgeobuf, to_topojson
+
+BOUNDARY_MIMETYPES = {
+    "topojson": "application/json",
+    "fgb": "application/flatgeobuf",
+}
 
 bp = Blueprint("areas", __name__, url_prefix="/areas")
 
@@ -55,65 +75,97 @@ def areas_csv(areas, filename):
     return output
 
 
-@bp.route("/<areacodes>.geojson")
-def get_area_boundary(areacodes):
-    es = get_db()
-    areacodes = areacodes.split("+")
-    features = []
-    for areacode in areacodes:
-        result = Area.get_from_es(areacode, es, boundary=True, examples_count=0)
-        status, r = result.geoJSON()
-        if status == 200:
-            features.extend(r.get("features"))
-    if status != 200:
-        return abort(make_response(jsonify(message=r), status))
-    return jsonify({"type": "FeatureCollection", "features": features})
-
-
-@bp.route("/<areacode>/children/<areatype>.geojson")
-def get_area_children_boundary(areacode, areatype):
+@bp.route("/<areacodes>.fgb", defaults={"filetype": "fgb"})
+@bp.route("/<areacodes>.topojson", defaults={"filetype": "topojson"})
+@bp.route("/<areacodes>.geojson", defaults={"filetype": "geojson"})
+@conditional_response
+def get_area_boundary(areacodes, filetype="geojson"):
+    return boundaries_response(areacodes.split("+"), get_db(), filetype)
+
+
+@bp.route("/<areacode>/children/<areatype>.fgb", defaults={"filetype": "fgb"})
+@bp.route("/<areacode>/children/<areatype>.topojson", defaults={"filetype": "topojson"})
+@bp.route("/<areacode>/children/<areatype>.geojson", defaults={"filetype": "geojson"})
+@conditional_response
+def get_area_children_boundary(areacode, areatype, filetype="geojson"):
     es = get_db()
-    area = Area.get_from_es(areacode, es, boundary=False, examples_count=0)
+    area = Area.get_from_es(areacode, es, examples_count=0, include=["children"])
+    children = (area.relationships["children"] or {}).get(areatype, [])
+    return boundaries_response([c.id for c in children], es, filetype)
+
+
+def boundaries_response(areacodes, es, filetype="geojson"):
+    """
+    Return the boundaries of a list of areas as GeoJSON, TopoJSON or FlatGeobuf
+
+    Any areas without a boundary are listed as errors, unless none of the
+    boundaries could be found. TopoJSON and FlatGeobuf files are cached
+    after they are first created.
+    """
+    detail = get_boundary_detail()
+    # the cache is kept until the boundaries change, but the files also
+    # include the areas' details so they're keyed on the data version too
+    key = json.dumps([filetype, areacodes, detail, get_data_version(es)])
+    if filetype != "geojson":
+        boundary_cache.set_version(get_boundaries_version(es))
+        cached = boundary_cache.get(key)
+        if cached is not MISSING and cached is not None:
+            return current_app.response_class(
+                cached, mimetype=BOUNDARY_MIMETYPES[filetype]
+            )
+
+    areas, errors = get_area_boundaries(areacodes, es, detail=detail)
+    if not areas:
+        return abort(make_response(jsonify(message=errors or "no areas found"), 404))
     features = []
-    errors = {}
-    for child_area in area.relationships["children"][areatype]:
-        result = Area.get_from_es(child_area.id, es, boundary=True, examples_count=0)
-        status, r = result.geoJSON()
-        if status == 200:
-            features.extend(r.get("features"))
-        else:
-            errors[child_area.id] = r
-    if not features:
-        return abort(make_response(jsonify(message=errors), status))
-    return jsonify({"type": "FeatureCollection", "features": features})
+    for area in areas:
+        status, r = area.geoJSON()
+        features.extend(r.get("features"))
+
+    if filetype == "geojson":
+        result = {"type": "FeatureCollection", "features": features}
+        if errors:
+            result["errors"] = errors
+        return jsonify(result)
+
+    if filetype == "topojson":
+        result = to_topojson(features)
+        if errors:
+            result["errors"] = errors
+        content = current_app.json.dumps(result).encode("utf8")
+    else:
+        content = to_flatgeobuf(
+            features, metadata={"errors": errors} if errors else None
+        )
+    boundary_cache.set(key, content)
+    return current_app.response_class(content, mimetype=BOUNDARY_MIMETYPES[filetype])
 
 
 @bp.route("/<areacode>")
 @bp.route("/<areacode>.<filetype>")
+@conditional_response
+@cache_response("areacode", Area.parse_id)
 def get_area(areacode, filetype="json"):
+    # .geojson files are handled by get_area_boundary
     result = Area.get_from_es(
         areacode,
         get_db(),
-        boundary=(filetype == "geojson"),
-        examples_count=(0 if filetype == "geojson" else 5),
+        include=(get_include() if filetype == "json" else None),
     )
 
-    if filetype == "geojson":
-        status, r = result.geoJSON()
-        if status != 200:
-            return abort(make_response(jsonify(message=r), status))
-        return jsonify(r)
-
-    return return_result(
-        result,
-        filetype,
-        "area.html.j2",
-        child=request.values.get("child"),
-        example_postcode_json=[
-            p.attributes.get("location")
-            for p in result.relationships["example_postcodes"]
-            if p.attributes.get("location")
-        ],
+    return add_server_timing(
+        return_result(
+            result,
+            filetype,
+            "area.html.j2",
+            child=request.values.get("child"),
+            example_postcode_json=[
+                p.attributes.get("location")
+                for p in result.relationships["example_postcodes"] or []
+                if p.attributes.get("location")
+            ],
+        ),
+        result.timings,
     )
 
 
@@ -1,7 +1,7 @@
 from flask import Blueprint, render_template, request, url_for
 
 from findthatpostcode.blueprints.areas import areas_csv
-from findthatpostcode.blueprints.utils import return_result
+from findthatpostcode.blueprints.utils import conditional_response, return_result
 from findthatpostcode.controllers.areas import Areatype, area_types_count, get_all_areas
 from findthatpostcode.controllers.controller import Pagination
 from findthatpostcode.db import get_db
@@ -17,6 +17,7 @@ def all():
 
 @bp.route("/<areacode>")
 @bp.route("/<areacode>.<filetype>")
+@conditional_response
 def get_areatype(areacode, filetype="json"):
     if filetype == "csv":
         areas = get_all_areas(get_db(), areatypes=[areacode.strip().lower()])
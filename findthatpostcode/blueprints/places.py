@@ -1,6 +1,12 @@
-from flask import Blueprint, jsonify, redirect, request, url_for
-
-from findthatpostcode.blueprints.utils import return_result
+from flask import Blueprint, abort, jsonify, redirect, request, url_for
+
+from findthatpostcode.blueprints.utils import (
+    cache_response,
+    conditional_response,
+    get_include,
+    return_result,
+)
+from findthatpostcode.controllers.controller import in_uk_bbox, nearest_search
 from findthatpostcode.controllers.places import Place
 from findthatpostcode.db import get_db
 
@@ -19,19 +25,15 @@ def point_redirect():
 @bp.route("/nearest/<lat>,<lon>")
 @bp.route("/nearest/<lat>,<lon>.<filetype>")
 def nearest(lat, lon, filetype="json"):
-    es = get_db()
-    query = {
-        "query": {"match_all": {}},
-        "sort": [
-            {"_geo_distance": {"location": {"lat": lat, "lon": lon}, "unit": "m"}}
-        ],
-    }
-
-    data = es.search(
-        index="geo_placename",
-        body=query,
-        ignore=[404],
+    if not in_uk_bbox(lat, lon):
+        abort(400, description="Point is outside the UK")
+    data = nearest_search(
+        get_db(),
+        "geo_placename",
+        lat,
+        lon,
         size=10,
+        ignore=[404],
         _source_excludes=[],
     )
     return jsonify(data)
@@ -39,6 +41,9 @@ def nearest(lat, lon, filetype="json"):
 
 @bp.route("/<areacode>")
 @bp.route("/<areacode>.<filetype>")
+@conditional_response
+@cache_response("areacode", Place.parse_id)
 def get_place(areacode, filetype="json"):
-    result = Place.get_from_es(areacode, get_db())
+    include = get_include() if filetype == "json" else None
+    result = Place.get_from_es(areacode, get_db(), include=include)
     return return_result(result, filetype, "place.html.j2")
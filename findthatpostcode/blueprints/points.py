@@ -1,9 +1,46 @@
-from flask import Blueprint, redirect, request, url_for
+import csv
+import io
+import json
+import math
+from itertools import islice
 
-from findthatpostcode.blueprints.utils import return_result
-from findthatpostcode.controllers.points import Point
+from flask import (
+    Blueprint,
+    abort,
+    current_app,
+    jsonify,
+    redirect,
+    request,
+    stream_with_context,
+    url_for,
+)
+
+from findthatpostcode.blueprints.postcodes import check_properties, get_postcodes_bulk
+from findthatpostcode.blueprints.utils import (
+    conditional_response,
+    get_include,
+    return_result,
+)
+from findthatpostcode.controllers.controller import in_uk_bbox
+from findthatpostcode.controllers.points import (
+    Point,
+    get_areas_containing,
+    get_nearest_postcodes,
+    get_polygon_index,
+)
 from findthatpostcode.db import get_db
 
+# maximum number of points in a single request for containing areas
+AREAS_LIMIT = 50000
+
+# maximum number of points in a bulk request returning JSON (NDJSON responses
+# are streamed so have no limit)
+BULK_LIMIT = 50000
+BULK_CHUNK_SIZE = 5000
+
+LAT_FIELDS = ("lat", "latitude")
+LON_FIELDS = ("lon", "long", "lng", "longitude")
+
 bp = Blueprint("points", __name__, url_prefix="/points")
 
 
@@ -17,6 +54,7 @@ def point_redirect():
 
 
 @bp.route("/<latlon>")
+@conditional_response
 def get(latlon):
     filetype = "json"
     if latlon.endswith(".json"):
@@ -26,10 +64,11 @@ def get(latlon):
         filetype = "html"
     lat, lon = latlon.split(",")
     es = get_db()
-    result = Point.get_from_es((float(lat), float(lon)), es)
+    include = get_include() if filetype == "json" else None
+    result = Point.get_from_es((float(lat), float(lon)), es, include=include)
     errors = result.get_errors()
     if errors:
-        return_result(result, filetype, "postcode.html.j2")
+        return return_result(result, filetype, "postcode.html.j2")
     if filetype == "html":
         return return_result(
             result.relationships["nearest_postcode"],
@@ -39,3 +78,214 @@ def get(latlon):
             stats=result.relationships["nearest_postcode"].get_stats(),
         )
     return return_result(result, filetype, "postcode.html.j2")
+
+
+@bp.route("/bulk", methods=["POST"])
+@bp.route("/bulk.<filetype>", methods=["POST"])
+def bulk(filetype="json"):
+    """
+    Find the nearest postcode to each of a list of points
+
+    Points can be sent as JSON (`{"points": [[lat, lon], ...], "properties":
+    [...]}`), as a CSV file with latitude and longitude columns or as
+    newline-delimited JSON. Each result has the nearest postcode, the
+    distance to it and the requested postcode fields. Points more than
+    `Point.max_distance` from a postcode are flagged as outside the UK.
+    Points outside the UK's bounding box aren't looked up at all. Results
+    are returned as JSON, or streamed as newline-delimited JSON if the
+    filetype is `ndjson`.
+    """
+    if filetype not in ("json", "ndjson"):
+        abort(404)
+
+    fields = request.args.getlist("properties")
+    if request.mimetype == "text/csv":
+        points = read_csv_points(request.stream)
+    elif request.mimetype in ("application/x-ndjson", "application/jsonl"):
+        points = read_ndjson_points(request.stream)
+    else:
+        data = request.get_json(silent=True) or {}
+        if isinstance(data, dict):
+            fields = data.get("properties", fields)
+            data = data.get("points")
+        if not isinstance(data, list) or not data:
+            abort(400, description="No points provided")
+        points = (parse_point(p) for p in data)
+    fields = check_properties(fields)
+
+    if filetype == "ndjson":
+        return current_app.response_class(
+            stream_with_context(
+                json.dumps(r, default=str) + "\n"
+                for r in get_points_bulk(points, fields)
+            ),
+            mimetype="application/x-ndjson",
+        )
+
+    # the points are counted before any are looked up
+    points = list(islice(points, BULK_LIMIT + 1))
+    if len(points) > BULK_LIMIT:
+        abort(
+            400,
+            description=(
+                "A maximum of {:,.0f} points can be looked up at once, "
+                "use /points/bulk.ndjson for more"
+            ).format(BULK_LIMIT),
+        )
+    results = list(get_points_bulk(points, fields))
+    return jsonify({"data": results})
+
+
+def parse_point(point):
+    """
+    A (lat, lon) tuple from a [lat, lon] list or a dict, or None if invalid
+
+    NaN and infinite values are invalid, as they can't be looked up or
+    returned in JSON.
+    """
+    try:
+        if isinstance(point, dict):
+            lat = next(point[k] for k in LAT_FIELDS if point.get(k) not in (None, ""))
+            lon = next(point[k] for k in LON_FIELDS if point.get(k) not in (None, ""))
+        else:
+            lat, lon = point
+        lat, lon = float(lat), float(lon)
+    except (StopIteration, TypeError, ValueError):
+        return None
+    if not (math.isfinite(lat) and math.isfinite(lon)):
+        return None
+    return (lat, lon)
+
+
+def read_csv_points(stream):
+    reader = csv.DictReader(io.TextIOWrapper(stream, encoding="utf-8-sig"))
+    for row in reader:
+        yield parse_point({k.strip().lower(): v for k, v in row.items() if k})
+
+
+def read_ndjson_points(stream):
+    for line in stream:
+        if not line.strip():
+            continue
+        try:
+            yield parse_point(json.loads(line))
+        except ValueError:
+            yield None
+
+
+def get_points_bulk(points, fields):
+    """
+    Find the nearest postcodes for an iterable of points, in chunks
+
+    Each chunk of points is looked up at once, and the postcodes found are
+    fetched with `get_postcodes_bulk`. Results are yielded in the same order
+    as the points.
+    """
+    es = get_db()
+    points = iter(points)
+    while True:
+        chunk = list(islice(points, BULK_CHUNK_SIZE))
+        if not chunk:
+            return
+        in_uk = [bool(p) and in_uk_bbox(*p) for p in chunk]
+        nearest = iter(
+            get_nearest_postcodes(
+                [p for p, uk in zip(chunk, in_uk) if uk],
+                es,
+                max_distance=Point.max_distance,
+            )
+        )
+        found = [next(nearest) if uk else (None, None) for uk in in_uk]
+
+        postcode_ids = [postcode for postcode, _ in found if postcode]
+        postcodes = {
+            r["id"]: r
+            for r in get_postcodes_bulk(list(dict.fromkeys(postcode_ids)), fields)
+            if r["found"]
+        }
+
+        for point, uk, (postcode, distance) in zip(chunk, in_uk, found):
+            if point is None:
+                yield {"query": None, "found": False, "error": "invalid_point"}
+                continue
+            result = {
+                "query": {"lat": point[0], "lon": point[1]},
+                "found": False,
+                "postcode": postcode,
+                "distance": distance,
+                # no postcode within Point.max_distance
+                "outside_uk": not postcode,
+            }
+            if result["outside_uk"]:
+                result["error"] = "point_outside_uk"
+            elif postcode in postcodes:
+                result["found"] = True
+                result.update(
+                    {
+                        k: v
+                        for k, v in postcodes[postcode].items()
+                        if k not in ("query", "id", "found")
+                    }
+                )
+            yield result
+
+
+@bp.route("/<latlon>/areas")
+@bp.route("/<latlon>/areas.json")
+@conditional_response
+def get_areas(latlon):
+    """
+    The areas whose boundaries contain a point
+    """
+    try:
+        lat, lon = (float(i) for i in latlon.split(","))
+    except ValueError:
+        abort(400, description="Point should be given as lat,lon")
+    index = polygon_index_or_404()
+    result = get_areas_containing([(lat, lon)], index, get_db())[0]
+    return jsonify({"data": {"lat": lat, "lon": lon, "found": bool(result), **result}})
+
+
+@bp.route("/areas", methods=["POST"])
+@bp.route("/areas.json", methods=["POST"])
+def bulk_areas():
+    """
+    The areas containing each of a list of points
+
+    Points are sent as JSON, either as a list of [lat, lon] pairs or as an
+    object with a `points` member.
+    """
+    data = request.get_json(silent=True) or {}
+    if isinstance(data, dict):
+        data = data.get("points")
+    if not isinstance(data, list) or not data:
+        abort(400, description="No points provided")
+    if len(data) > AREAS_LIMIT:
+        abort(
+            400,
+            description="A maximum of {:,.0f} points can be looked up at once".format(
+                AREAS_LIMIT
+            ),
+        )
+    try:
+        points = [(float(p[0]), float(p[1])) for p in data]
+    except (TypeError, ValueError, IndexError):
+        abort(400, description="Points should be given as [lat, lon] pairs")
+
+    index = polygon_index_or_404()
+    results = get_areas_containing(points, index, get_db())
+    return jsonify(
+        {
+            "data": [
+                {"lat": lat, "lon": lon, "found": bool(result), **result}
+                for (lat, lon), result in zip(points, results)
+            ]
+        }
+    )
+
+
+def polygon_index_or_404():
+    index = get_polygon_index()
+    if index is None:
+        abort(404, description="Point-in-polygon lookups are not enabled")
+    return index
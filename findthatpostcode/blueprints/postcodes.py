@@ -1,8 +1,25 @@
+import json
+import re
+
 from dictlib import dig_get
 from elasticsearch.helpers import scan
-from flask import Blueprint, abort, jsonify, redirect, request, url_for
+from flask import (
+    Blueprint,
+    abort,
+    current_app,
+    jsonify,
+    redirect,
+    request,
+    url_for,
+)
 
-from findthatpostcode.blueprints.utils import return_result
+from findthatpostcode.blueprints.utils import (
+    cache_response,
+    conditional_response,
+    get_include,
+    return_result,
+)
+from findthatpostcode.controllers.areas import AREA_CODE_REGEX, get_area_sources
 from findthatpostcode.controllers.postcodes import Postcode
 from findthatpostcode.db import get_db
 from findthatpostcode.metadata import (
@@ -12,6 +29,9 @@ from findthatpostcode.metadata import (
     STATS_FIELDS,
 )
 
+BULK_LIMIT = 5000
+BULK_CHUNK_SIZE = 500
+
 bp = Blueprint("postcodes", __name__, url_prefix="/postcodes")
 
 
@@ -25,9 +45,12 @@ def postcode_redirect():
 
 @bp.route("/<postcode>")
 @bp.route("/<postcode>.<filetype>")
+@conditional_response
+@cache_response("postcode", Postcode.parse_id)
 def get_postcode(postcode, filetype="json"):
     es = get_db()
-    result = Postcode.get_from_es(postcode, es)
+    include = get_include() if filetype == "json" else None
+    result = Postcode.get_from_es(postcode, es, include=include)
     return return_result(result, filetype, "postcode.html.j2", stats=result.get_stats())
 
 
@@ -45,47 +68,162 @@ def multi_hash():
     return jsonify({"data": get_postcode_by_hash(hashes, fields)})
 
 
-def get_postcode_by_hash(hashes: str | list[str], fields: list[str]):
+@bp.route("/bulk", methods=["POST"])
+@bp.route("/bulk.<filetype>", methods=["POST"])
+def bulk(filetype="json"):
+    """
+    Look up a list of postcodes in one request
+
+    Postcodes and properties can be sent as a JSON object
+    (`{"postcodes": [...], "properties": [...]}`) or as form values. The
+    result is returned as JSON, or as newline-delimited JSON if the filetype
+    is `ndjson`.
+    """
+    if filetype not in ("json", "ndjson"):
+        abort(404)
+    data = request.get_json(silent=True) or {}
+    if isinstance(data, list):
+        data = {"postcodes": data}
+    postcodes = data.get("postcodes", request.values.getlist("postcodes"))
+    fields = check_properties(
+        data.get("properties", request.values.getlist("properties"))
+    )
+    if not isinstance(postcodes, list) or not postcodes:
+        abort(400, description="No postcodes provided")
+    if len(postcodes) > BULK_LIMIT:
+        abort(
+            400,
+            description="A maximum of {:,.0f} postcodes can be looked up at once".format(
+                BULK_LIMIT
+            ),
+        )
+
+    results = get_postcodes_bulk(postcodes, fields)
+    if filetype == "ndjson":
+        return current_app.response_class(
+            (json.dumps(r, default=str) + "\n" for r in results),
+            mimetype="application/x-ndjson",
+        )
+    return jsonify({"data": results})
+
+
+def check_properties(fields):
+    """
+    The properties asked for in a bulk request, which must be a list of strings
+    """
+    if fields is None:
+        return []
+    if not isinstance(fields, list) or not all(isinstance(f, str) for f in fields):
+        abort(400, description="Properties should be a list of field names")
+    return fields
+
+
+def get_postcodes_bulk(postcodes: list[str], fields: list[str]):
+    """
+    Fetch a list of postcodes using chunked mget requests
+
+    Area names and statistics are fetched once for the whole list. If no
+    fields are given then every field is returned, along with the names of
+    all the areas.
+    """
     es = get_db()
+    ids = [Postcode.parse_id(p) if isinstance(p, str) else None for p in postcodes]
 
-    if not isinstance(hashes, list):
-        hashes = [hashes]
+    name_fields, stats, stats_fields = get_extra_fields(fields)
+    source_params = {}
+    if fields:
+        source_params["_source_includes"] = fields + name_fields + stats_fields
 
-    query = []
-    for hash_ in hashes:
-        if len(hash_) < 3:
-            abort(400, description="Hash length must be at least 3 characters")
-        query.append(
+    sources = {}
+    to_fetch = list(dict.fromkeys(i for i in ids if i))
+    for start in range(0, len(to_fetch), BULK_CHUNK_SIZE):
+        result = es.mget(
+            index=Postcode.es_index,
+            body={"ids": to_fetch[start : start + BULK_CHUNK_SIZE]},
+            **source_params,
+        )
+        for r in result.get("docs", []):
+            if r.get("found"):
+                r["_source"].pop("nearest_places", None)
+                sources[r["_id"]] = r["_source"]
+
+    if not fields:
+        name_fields = list(
+            dict.fromkeys(
+                k
+                for source in sources.values()
+                for k, v in source.items()
+                if isinstance(v, str) and re.match(AREA_CODE_REGEX, v)
+            )
+        )
+    extra = get_names_and_stats(list(sources.values()), name_fields, stats, es)
+
+    results = []
+    for query, id_ in zip(postcodes, ids):
+        source = sources.get(id_)
+        if source is None:
+            results.append({"query": query, "id": id_, "found": False})
+            continue
+        results.append(
             {
-                "prefix": {
-                    "hash": hash_,
-                },
+                "query": query,
+                "id": id_,
+                "found": True,
+                **source,
+                **extra(source),
             }
         )
+    return results
+
 
+def get_extra_fields(fields: list[str]):
+    """
+    Work out the name and statistics fields requested in a list of fields
+
+    Returns the codes needed for names, the statistics requested and the
+    area codes needed for those statistics.
+    """
     name_fields = [i.replace("_name", "") for i in fields if i.endswith("_name")]
     stats_fields = []
     stats = [field for field in STATS_FIELDS if field.id in fields]
-    if stats:
-        for field in stats:
-            if field.area not in stats_fields:
-                stats_fields.append(field.area)
+    for field in stats:
+        if field.area not in stats_fields:
+            stats_fields.append(field.area)
+    return name_fields, stats, stats_fields
 
-    results = list(
-        scan(
-            es,
-            index="geo_postcode",
-            query={"query": {"bool": {"should": query}}},
-            _source_includes=fields + name_fields + stats_fields,
-        )
-    )
-    areas = scan(
-        es,
-        index="geo_area",
-        query={"query": {"terms": {"type": name_fields}}},
-        _source_includes=["name"],
-    )
-    areanames = {i["_id"]: i["_source"].get("name") for i in areas}
+
+def get_names_and_stats(sources: list[dict], name_fields: list[str], stats, es):
+    """
+    Fetch the area names and statistics for a list of postcode records
+
+    Returns a function that gives the names and statistics for a record.
+    """
+    area_codes = [
+        source.get(i)
+        for source in sources
+        for i in name_fields
+        if isinstance(source.get(i), str) and re.match(AREA_CODE_REGEX, source.get(i))
+    ]
+    areanames = {
+        code: area.get("name")
+        for code, area in get_area_sources(area_codes, es, fields=["name"]).items()
+        if area
+    }
+
+    lsoas = {}
+    if stats:
+        lsoas_to_get = set()
+        for source in sources:
+            for field in stats:
+                if source.get(field.area):
+                    lsoas_to_get.add(source.get(field.area))
+        lsoas = {
+            code: area
+            for code, area in get_area_sources(
+                lsoas_to_get, es, fields=[i.location for i in stats]
+            ).items()
+            if area
+        }
 
     def get_names(data):
         names = {}
@@ -103,39 +241,56 @@ def get_postcode_by_hash(hashes: str | list[str], fields: list[str]):
                 names[f"{i}_name"] = areanames.get(data.get(i))
         return names
 
-    def get_stats(data, lsoas):
+    def get_stats(data):
         result = {}
         for field in stats:
             lsoa_code = data.get(field.area)
-            if not lsoa_code or not stats or lsoa_code not in lsoas:
+            if not lsoa_code or lsoa_code not in lsoas:
                 continue
             result[field.id] = dig_get(lsoas[lsoa_code], field.location)
         return result
 
-    if results:
-        lsoas = {}
-        if stats:
-            lsoas_to_get = set()
-            for r in results:
-                for i in stats_fields:
-                    if r.get("_source", {}).get(i):
-                        lsoas_to_get.add(r.get("_source", {}).get(i))
-            lsoas = {
-                i["_id"]: i["_source"]
-                for i in scan(
-                    es,
-                    index="geo_area",
-                    query={"query": {"terms": {"_id": list(lsoas_to_get)}}},
-                    _source_includes=[i.location for i in stats],
-                )
+    return lambda data: {**get_names(data), **get_stats(data)}
+
+
+def get_postcode_by_hash(hashes: str | list[str], fields: list[str]):
+    es = get_db()
+
+    if not isinstance(hashes, list):
+        hashes = [hashes]
+
+    query = []
+    for hash_ in hashes:
+        if len(hash_) < 3:
+            abort(400, description="Hash length must be at least 3 characters")
+        query.append(
+            {
+                "prefix": {
+                    "hash": hash_,
+                },
             }
+        )
+
+    name_fields, stats, stats_fields = get_extra_fields(fields)
 
+    results = list(
+        scan(
+            es,
+            index="geo_postcode",
+            query={"query": {"bool": {"should": query}}},
+            _source_includes=fields + name_fields + stats_fields,
+        )
+    )
+
+    if results:
+        extra = get_names_and_stats(
+            [r["_source"] for r in results], name_fields, stats, es
+        )
         return [
             {
                 "id": r["_id"],
                 **r["_source"],
-                **get_names(r["_source"]),
-                **get_stats(r["_source"], lsoas),
+                **extra(r["_source"]),
             }
             for r in results
         ]
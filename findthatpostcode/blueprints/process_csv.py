@@ -1,12 +1,65 @@
 from __future__ import print_function
 
+import collections
 import csv
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from itertools import islice
 
+import numpy as np
+from flask import current_app, has_app_context
+from pyproj import Transformer
+
+from findthatpostcode.blueprints.postcodes import (
+    get_extra_fields,
+    get_names_and_stats,
+)
+from findthatpostcode.controllers.controller import UK_BBOX
+from findthatpostcode.controllers.points import Point, get_nearest_postcodes
 from findthatpostcode.controllers.postcodes import Postcode
 
 # List of potential postcode fields
 POSTCODE_FIELDS = ["postcode", "postal_code", "post_code", "post code"]
 
+# number of rows looked up at once
+CSV_CHUNK_SIZE = 1000
+
+# number of chunks looked up at once
+CSV_WORKERS = 4
+
+DUMMY_CODES = {"E99999999", "S99999999", "N99999999", "W99999999"}
+
+# columns added before the postcode fields when rows have coordinates
+POINT_OUTPUT_FIELDS = ["nearest_postcode", "distance_from_postcode", "outside_uk"]
+
+# added to the name of any output column that is already in the file
+CLASHING_COLUMN_PREFIX = "ftp_"
+
+_transformers = threading.local()
+
+# fields offered in the upload form that stand for more than one field
+COMBINED_FIELDS = {
+    "latlng": ["lat", "long"],
+    "estnrth": ["oseast1m", "osnrth1m"],
+    "lep": ["lep1", "lep2"],
+    "lep_name": ["lep1_name", "lep2_name"],
+}
+
+
+def expand_fields(fields):
+    """
+    Replace the combined fields chosen in the upload form with the fields
+    they stand for, which are added to the end of the list
+    """
+    fields = list(fields)
+    for field, replacements in COMBINED_FIELDS.items():
+        if field in fields:
+            fields.extend(replacements)
+            fields.remove(field)
+    return fields
+
 
 def process_csv(
     csvfile,
@@ -16,47 +69,231 @@ def process_csv(
     fields=["lat", "long", "cty"],
     es_config=None,
 ):
-    if not es_config:
-        es_config = {}
+    for output in iter_csv(csvfile, es, postcode_field, fields, es_config):
+        outfile.write(output)
 
+
+def iter_csv(
+    csvfile,
+    es,
+    postcode_field="postcode",
+    fields=["lat", "long", "cty"],
+    es_config=None,
+    chunk_size=CSV_CHUNK_SIZE,
+    progress=None,
+    workers=CSV_WORKERS,
+    point_fields=None,
+    osgb=False,
+):
+    """
+    Add postcode data to a CSV file, yielding the output a chunk at a time
+
+    Rows are read and looked up in chunks, so memory use doesn't depend on
+    the size of the file. Up to `workers` chunks are looked up and written
+    at once on a thread pool while the next chunks are read, and the output
+    is yielded in the same order as the input. If given, `progress` is
+    called with the number of rows done so far after each chunk.
+
+    If `point_fields` is a pair of (latitude, longitude) columns, or of
+    (easting, northing) columns if `osgb` is true, the data is added for
+    the postcode nearest to each row instead of from `postcode_field`.
+
+    Added columns never replace the columns in the file: if one has the
+    same name as an existing column it is prefixed with "ftp_".
+    """
     # @TODO add option for different CSV dialects and for no headers
     # In the case of no headers you would find the field by number
     reader = csv.DictReader(csvfile)
-    writer = csv.DictWriter(outfile, reader.fieldnames + fields)
-    writer.writeheader()
-    code_cache = {"E99999999": "", "S99999999": "", "N99999999": "", "W99999999": ""}
-    for _, row in enumerate(reader):
+    input_fields = reader.fieldnames or []
+    columns = output_columns(
+        input_fields, (POINT_OUTPUT_FIELDS if point_fields else []) + fields
+    )
+    fieldnames = input_fields + list(columns.values())
+
+    # the lookups need the app's config, if there is an app
+    app = current_app._get_current_object() if has_app_context() else None
+
+    def write_chunk(chunk, header=False):
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames)
+        if header:
+            writer.writeheader()
+        with app.app_context() if app else nullcontext():
+            if point_fields:
+                chunk = add_point_fields(
+                    chunk, es, point_fields, fields, es_config, osgb, columns
+                )
+            else:
+                chunk = add_postcode_fields(
+                    chunk, es, postcode_field, fields, es_config, columns
+                )
+        writer.writerows(chunk)
+        return buffer.getvalue()
+
+    workers = max(workers, 1)
+    chunks = iter(lambda: list(islice(reader, chunk_size)), [])
+    with ThreadPoolExecutor(
+        max_workers=workers, thread_name_prefix="findthatpostcode-csv"
+    ) as executor:
+        pending = collections.deque()
+
+        def finished(wait_for):
+            while len(pending) > wait_for:
+                size, future = pending.popleft()
+                yield size, future.result()
+
+        try:
+            rows = 0
+            first = next(chunks, [])
+            pending.append((len(first), executor.submit(write_chunk, first, True)))
+            for chunk in chunks:
+                pending.append((len(chunk), executor.submit(write_chunk, chunk)))
+                for size, output in finished(workers - 1):
+                    yield output
+                    rows += size
+                    if progress:
+                        progress(rows)
+            for size, output in finished(0):
+                yield output
+                rows += size
+                if progress and size:
+                    progress(rows)
+        finally:
+            # stop any lookups still waiting if the output isn't wanted
+            for _, future in pending:
+                future.cancel()
+
+
+def output_columns(input_fields, fields):
+    """
+    The name of the output column for each field added to a file
+
+    Fields with the same name as a column already in the file are prefixed,
+    so that the file's own data is kept.
+    """
+    columns = {}
+    used = set(input_fields)
+    for field in fields:
+        column = field
+        while column in used:
+            column = CLASHING_COLUMN_PREFIX + column
+        columns[field] = column
+        used.add(column)
+    return columns
+
+
+def add_postcode_fields(rows, es, postcode_field, fields, es_config=None, columns=None):
+    """
+    Add postcode data to a list of CSV rows
+
+    The postcodes in the rows are fetched with a single mget, and the names
+    and statistics of their areas with one more request each. `columns`
+    gives the column to use for each field, if it isn't the field's name.
+    """
+    if not es_config:
+        es_config = {}
+    if not columns:
+        columns = {}
+
+    name_fields, stats, stats_fields = get_extra_fields(fields)
+    ids = [Postcode.parse_id(row.get(postcode_field)) for row in rows]
+    to_fetch = list(dict.fromkeys(i for i in ids if i))
+    sources = {}
+    if to_fetch:
+        result = es.mget(
+            index=es_config.get("es_index", "geo_postcode"),
+            body={"ids": to_fetch},
+            _source_includes=list(dict.fromkeys(fields + name_fields + stats_fields)),
+        )
+        for r in result.get("docs", []):
+            if r.get("found"):
+                sources[r["_id"]] = r["_source"]
+    extra = get_names_and_stats(list(sources.values()), name_fields, stats, es)
+
+    for row, id_ in zip(rows, ids):
+        for i in fields:
+            row[columns.get(i, i)] = None
+        source = sources.get(id_)
+        if source is None:
+            continue
+        values = extra(source)
         for i in fields:
-            row[i] = None
-        postcode = Postcode.parse_id(row.get(postcode_field))
-        if postcode:
-            pc = es.get(
-                index=es_config.get("es_index", "geo_postcode"),
-                doc_type=es_config.get("es_type", "_doc"),
-                id=postcode,
-                ignore=[404],
-            )
-            if pc["found"]:
-                for i in fields:
-                    if i.endswith("_name"):
-                        code = pc["_source"].get(i[:-5])
-                        if code in code_cache:
-                            row[i] = code_cache[code]
-                        elif code:
-                            area = es.get(
-                                index="geo_area",
-                                doc_type=es_config.get("es_type", "_doc"),
-                                id=code,
-                                ignore=[404],
-                                _source_excludes=["boundary"],
-                            )
-                            if area["found"]:
-                                row[i] = area["_source"].get("name")
-                            else:
-                                row[i] = code
-                            code_cache[code] = row[i]
-                        else:
-                            row[i] = code
-                    else:
-                        row[i] = pc["_source"].get(i)
-        writer.writerow(row)
+            value = values[i] if i in values else source.get(i)
+            if i.endswith("_name") and value is None:
+                # fall back to the code if the area's name isn't known
+                code = source.get(i[:-5])
+                value = "" if code in DUMMY_CODES else code
+            row[columns.get(i, i)] = value
+    return rows
+
+
+def get_osgb_transformer():
+    # transformers aren't shared between threads
+    if not hasattr(_transformers, "osgb"):
+        _transformers.osgb = Transformer.from_crs(
+            "EPSG:27700", "EPSG:4326", always_xy=True
+        )
+    return _transformers.osgb
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def add_point_fields(
+    rows, es, point_fields, fields, es_config=None, osgb=False, columns=None
+):
+    """
+    Add the nearest postcode and its data to a list of CSV rows with coordinates
+
+    The coordinates are converted and checked as arrays, and the nearest
+    postcodes are found with one call to `get_nearest_postcodes`. Rows
+    with missing or invalid coordinates have no `outside_uk` value.
+    """
+    if not columns:
+        columns = {}
+    x = np.array([to_float(row.get(point_fields[0])) for row in rows], dtype=float)
+    y = np.array([to_float(row.get(point_fields[1])) for row in rows], dtype=float)
+    if osgb:
+        # lists are always transformed as arrays, even with one point
+        lons, lats = get_osgb_transformer().transform(x.tolist(), y.tolist())
+        lats, lons = np.asarray(lats, dtype=float), np.asarray(lons, dtype=float)
+    else:
+        lats, lons = x, y
+    valid = np.isfinite(lats) & np.isfinite(lons)
+    in_uk = (
+        valid
+        & (lats >= UK_BBOX["min_lat"])
+        & (lats <= UK_BBOX["max_lat"])
+        & (lons >= UK_BBOX["min_lon"])
+        & (lons <= UK_BBOX["max_lon"])
+    )
+    nearest = iter(
+        get_nearest_postcodes(
+            list(zip(lats[in_uk].tolist(), lons[in_uk].tolist())),
+            es,
+            es_config,
+            max_distance=Point.max_distance,
+        )
+    )
+
+    for row, is_valid, uk in zip(rows, valid, in_uk):
+        postcode, distance = next(nearest) if uk else (None, None)
+        # no postcode within Point.max_distance
+        outside_uk = postcode is None
+        row[columns.get("nearest_postcode", "nearest_postcode")] = (
+            None if outside_uk else postcode
+        )
+        row[columns.get("distance_from_postcode", "distance_from_postcode")] = distance
+        row[columns.get("outside_uk", "outside_uk")] = outside_uk if is_valid else None
+    return add_postcode_fields(
+        rows,
+        es,
+        columns.get("nearest_postcode", "nearest_postcode"),
+        fields,
+        es_config,
+        columns,
+    )
@@ -0,0 +1,75 @@
+import json
+
+from flask import Blueprint, abort, current_app
+
+from findthatpostcode.blueprints.utils import conditional_response
+from findthatpostcode.boundaries import detail_for_zoom
+from findthatpostcode.cache import MISSING, boundary_cache
+from findthatpostcode.controllers.areas import (
+    get_area_boundaries,
+    get_boundary_manifest,
+)
+from findthatpostcode.db import get_boundaries_version, get_data_version, get_db
+from findthatpostcode.metadata import AREA_TYPES
+from findthatpostcode.tiles import (
+    TILE_BUFFER,
+    encode_tile,
+    tile_bounds,
+    tile_features,
+    valid_tile,
+)
+
+# tiles covering more areas than this are left empty - zoom in to see them
+MAX_TILE_AREAS = 2000
+
+MVT_MIMETYPE = "application/vnd.mapbox-vector-tile"
+
+bp = Blueprint("tiles", __name__, url_prefix="/tiles")
+
+
+@bp.route("/<areatype>/<int:z>/<int:x>/<int:y>.mvt")
+@conditional_response
+def get_tile(areatype, z, x, y):
+    """
+    A vector tile with the boundaries of all the areas of a type
+
+    Tiles are built the first time they are requested and then kept in the
+    boundary cache (in memory, and on disk if `BOUNDARY_CACHE_DIR` is set)
+    until the data changes. Area names are included in the tile, so it is
+    keyed on the data version as well as the boundaries. The areas in a
+    tile are found using the bbox stored in the boundary manifest, so tiles
+    aren't available until a manifest has been created by `flask import
+    boundaries`. Areas without a bbox in the manifest are left out until
+    the command is run again to add it.
+    """
+    if areatype not in AREA_TYPES or not valid_tile(z, x, y):
+        return abort(404)
+
+    es = get_db()
+    if not get_boundary_manifest().loaded:
+        return abort(404, description="No boundary manifest has been loaded")
+    key = json.dumps(["mvt", areatype, z, x, y, get_data_version(es)])
+    boundary_cache.set_version(get_boundaries_version(es))
+    content = boundary_cache.get(key)
+    if content is MISSING or content is None:
+        content = build_tile(areatype, z, x, y, es)
+        boundary_cache.set(key, content)
+    return current_app.response_class(content, mimetype=MVT_MIMETYPE)
+
+
+def build_tile(areatype, z, x, y, es):
+    manifest = get_boundary_manifest()
+    codes = manifest.intersecting(
+        tile_bounds(z, x, y, TILE_BUFFER), set(AREA_TYPES[areatype]["entities"])
+    )
+    if not codes or len(codes) > MAX_TILE_AREAS:
+        return encode_tile({areatype: []})
+
+    areas, _ = get_area_boundaries(sorted(codes), es, detail=detail_for_zoom(z))
+    features = []
+    for area in areas:
+        status, r = area.geoJSON()
+        for feature in r.get("features", []):
+            feature["properties"] = {"code": area.id, "name": area.attributes["name"]}
+            features.append(feature)
+    return encode_tile({areatype: tile_features(features, z, x, y)})
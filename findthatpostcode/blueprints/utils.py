@@ -1,7 +1,53 @@
+import hashlib
+import json
+import re
 from functools import wraps
 
 from flask import abort, current_app, jsonify, make_response, render_template, request
 
+from findthatpostcode.boundaries import DETAIL_LEVELS, detail_for_zoom
+from findthatpostcode.cache import MISSING, response_cache
+from findthatpostcode.db import get_data_version, get_db
+
+
+def get_include():
+    """
+    Relationships requested using the JSON:API `include` parameter
+
+    Returns None if the parameter isn't present, meaning that all
+    relationships should be included.
+    """
+    if "include" not in request.args:
+        return None
+    return [i.strip() for i in request.args["include"].split(",") if i.strip()]
+
+
+def get_sparse_fields():
+    """
+    Sparse fieldsets requested using JSON:API `fields[type]` parameters
+    """
+    fields = {}
+    for k, v in request.args.items():
+        m = re.match(r"^fields\[(\w+)\]$", k)
+        if m:
+            fields[m.group(1)] = {f.strip() for f in v.split(",") if f.strip()}
+    return fields
+
+
+def get_boundary_detail():
+    """
+    Level of detail for boundaries, from the `detail` or `zoom` parameters
+
+    Returns None if the full boundary should be used.
+    """
+    detail = request.args.get("detail")
+    if detail in DETAIL_LEVELS:
+        return detail
+    try:
+        return detail_for_zoom(int(request.args["zoom"]))
+    except (KeyError, ValueError):
+        return None
+
 
 def return_result(result, filetype="json", template=None, **kwargs):
     if filetype == "html" and not template:
@@ -27,13 +73,26 @@ def return_result(result, filetype="json", template=None, **kwargs):
             )
 
     if filetype in ("json", "geojson"):
-        return jsonify(result.topJSON())
+        return jsonify(result.topJSON(get_sparse_fields()))
     elif filetype == "html":
         return render_template(template, result=result, **kwargs)
 
     abort(404)
 
 
+def add_server_timing(response, timings):
+    """
+    Add the time taken by each query to a response as a Server-Timing header
+    """
+    response = make_response(response)
+    if timings:
+        response.headers["Server-Timing"] = ", ".join(
+            "{};dur={:.1f}".format(name, duration * 1000)
+            for name, duration in timings.items()
+        )
+    return response
+
+
 def jsonp(func):
     """Wraps JSONified output for JSONP requests."""
 
@@ -68,3 +127,99 @@ def cors(func):
         return response
 
     return decorated_function
+
+
+def cache_response(id_arg, parse_id=None):
+    """
+    Cache successful JSON responses until the data version changes
+
+    The cache key is made from the endpoint, the normalised id found in the
+    `id_arg` view argument, the filetype and the query arguments. Cache hits
+    are returned without calling the view.
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def decorated_function(*args, **kwargs):
+            filetype = kwargs.get("filetype", "json")
+            if filetype != "json":
+                return func(*args, **kwargs)
+
+            id_ = kwargs.get(id_arg)
+            if parse_id:
+                id_ = parse_id(id_)
+            key = json.dumps(
+                [
+                    request.endpoint,
+                    id_,
+                    filetype,
+                    sorted(request.args.items(multi=True)),
+                ]
+            )
+            response_cache.set_version(get_data_version(get_db()))
+            cached = response_cache.get(key)
+            if cached is not MISSING:
+                response = current_app.response_class(
+                    cached, mimetype="application/json"
+                )
+                response.headers["X-Cache"] = "HIT"
+                return response
+
+            response = make_response(func(*args, **kwargs))
+            if response.status_code == 200 and response.is_json:
+                response_cache.set(key, response.get_data())
+            response.headers["X-Cache"] = "MISS"
+            return response
+
+        return decorated_function
+
+    return decorator
+
+
+def release_etag():
+    """
+    Strong ETag for the current request, based on the data release
+
+    Responses only change when new data is imported, so the same URL will
+    give the same response until the release version changes. Returns None
+    if no release has been recorded.
+    """
+    version = get_data_version(get_db())
+    if not version:
+        return None
+    return hashlib.sha1(
+        "{}|{}".format(version, request.full_path).encode("utf8")
+    ).hexdigest()
+
+
+def conditional_response(func):
+    """
+    Add ETag and Cache-Control headers to successful responses
+
+    Requests with a matching `If-None-Match` header get an empty 304
+    response without calling the view. The data release is only checked
+    periodically, so this doesn't need a request to elasticsearch.
+    """
+
+    def set_cache_headers(response, etag):
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "public, max-age={}".format(
+            current_app.config["HTTP_CACHE_MAX_AGE"]
+        )
+        return response
+
+    @wraps(func)
+    def decorated_function(*args, **kwargs):
+        etag = release_etag()
+        if etag is None:
+            return func(*args, **kwargs)
+
+        if request.if_none_match.contains(etag):
+            return set_cache_headers(current_app.response_class(status=304), etag)
+
+        response = make_response(func(*args, **kwargs))
+        if response.status_code == 200:
+            set_cache_headers(response, etag)
+        return response
+
+    return decorated_function
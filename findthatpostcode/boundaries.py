@@ -0,0 +1,221 @@
+"""
+Manifest of the area boundaries stored in S3
+"""
+
+import io
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import shapely
+from botocore.exceptions import ClientError
+from shapely.geometry import shape
+
+MANIFEST_KEY = "manifest.json"
+# error codes from S3 when a file doesn't exist
+S3_NOT_FOUND = ("404", "NoSuchKey")
+NOT_LOADED = object()
+
+# simplified versions of each boundary, with the tolerance in degrees
+DETAIL_LEVELS = {
+    "low": 0.01,
+    "medium": 0.001,
+    "high": 0.0001,
+}
+
+# the level of detail needed to draw a map up to each zoom level
+ZOOM_DETAIL = [
+    (8, "low"),
+    (11, "medium"),
+    (14, "high"),
+]
+
+
+def boundary_key(area_code, detail=None):
+    if detail:
+        return "%s/%s/%s.json" % (detail, area_code[0:3], area_code)
+    return "%s/%s.json" % (area_code[0:3], area_code)
+
+
+def detail_for_zoom(zoom):
+    """
+    The smallest level of detail that looks right at a map zoom level
+    """
+    for max_zoom, detail in ZOOM_DETAIL:
+        if zoom <= max_zoom:
+            return detail
+    return None
+
+
+class BoundaryManifest:
+    """
+    The codes of all the areas with a boundary, with their size and bbox
+
+    The size of each simplified level of detail is also recorded. The
+    manifest is written to S3 by `flask import boundaries`. It is loaded the
+    first time it is needed and reloaded when the data version changes.
+    If no manifest has been created then `loaded` is False, and callers
+    need to check S3 directly.
+    """
+
+    def __init__(self):
+        self.boundaries = {}
+        self.loaded = False
+        self.version = NOT_LOADED
+        self._lock = threading.Lock()
+        self._index = None
+
+    def __contains__(self, area_code):
+        return area_code in self.boundaries
+
+    def __len__(self):
+        return len(self.boundaries)
+
+    def get(self, area_code):
+        return self.boundaries.get(area_code)
+
+    def has_detail(self, area_code, detail):
+        return detail in (self.boundaries.get(area_code) or {}).get("detail", {})
+
+    def intersecting(self, bbox, prefixes=None):
+        """
+        Codes of the areas whose bbox overlaps a bbox
+
+        Only areas whose code starts with one of `prefixes` are included, if
+        given. Areas without a recorded bbox are left out. The bboxes are
+        held in an STRtree, built the first time it's needed for each set of
+        boundaries.
+        """
+        boundaries, codes, tree = self._get_index()
+        return [
+            codes[i]
+            for i in sorted(tree.query(shapely.box(*bbox)))
+            if prefixes is None or codes[i][0:3] in prefixes
+        ]
+
+    def _get_index(self):
+        index = self._index
+        if index is None or index[0] is not self.boundaries:
+            boundaries = self.boundaries
+            codes = [
+                code
+                for code, boundary in boundaries.items()
+                if (boundary or {}).get("bbox")
+            ]
+            tree = shapely.STRtree(
+                [shapely.box(*boundaries[code]["bbox"]) for code in codes]
+            )
+            index = self._index = (boundaries, codes, tree)
+        return index
+
+    def reset(self):
+        """
+        Forget the data version, so the manifest is loaded again when needed
+        """
+        with self._lock:
+            self.version = NOT_LOADED
+
+    def load(self, client, bucket, version=None):
+        """
+        Load the manifest from S3, if the data version has changed
+        """
+        if self.version == version:
+            return self
+        with self._lock:
+            if self.version == version:
+                return self
+            manifest = read_manifest(client, bucket)
+            self.loaded = manifest is not None
+            self.boundaries = manifest or {}
+            self.version = version
+        return self
+
+
+def is_not_found(error):
+    """
+    Whether an error from S3 means that the file doesn't exist
+    """
+    return error.response.get("Error", {}).get("Code") in S3_NOT_FOUND
+
+
+def read_manifest(client, bucket):
+    """
+    Download the manifest from S3, returning None if it doesn't exist
+    """
+    buffer = io.BytesIO()
+    try:
+        client.download_fileobj(bucket, MANIFEST_KEY, buffer)
+    except ClientError:
+        return None
+    return json.loads(buffer.getvalue().decode("utf-8")).get("boundaries")
+
+
+def write_manifest(client, bucket, boundaries):
+    client.upload_fileobj(
+        io.BytesIO(json.dumps({"boundaries": boundaries}).encode("utf-8")),
+        bucket,
+        MANIFEST_KEY,
+    )
+
+
+def list_boundaries(client, bucket):
+    """
+    Build a manifest by listing the boundaries in S3
+
+    Used when there isn't a manifest yet. The bbox isn't known without
+    downloading each boundary so is left empty. Simplified boundaries are
+    recorded with the size of each level of detail.
+    """
+    boundaries = {}
+    paginator = client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket):
+        for obj in page.get("Contents", []):
+            if not obj["Key"].endswith(".json"):
+                continue
+            parts = obj["Key"][:-5].split("/")
+            if len(parts) == 2:
+                boundaries.setdefault(parts[1], {"bbox": None, "detail": {}})
+                boundaries[parts[1]]["size"] = obj["Size"]
+            elif len(parts) == 3 and parts[0] in DETAIL_LEVELS:
+                boundaries.setdefault(parts[2], {"bbox": None, "detail": {}})
+                boundaries[parts[2]]["detail"][parts[0]] = obj["Size"]
+    return boundaries
+
+
+boundary_manifest = BoundaryManifest()
+
+
+def add_missing_bboxes(client, bucket, boundaries, workers=8):
+    """
+    Record the bbox of each boundary in a manifest that doesn't have one
+
+    These are the boundaries found by `list_boundaries`, so the full
+    boundary of each is downloaded to work out its bbox. Returns the codes
+    of the areas whose bbox was added.
+    """
+    codes = [
+        code
+        for code, boundary in boundaries.items()
+        if boundary is not None and boundary.get("bbox") is None
+    ]
+
+    def get_bbox(code):
+        buffer = io.BytesIO()
+        try:
+            client.download_fileobj(bucket, boundary_key(code), buffer)
+        except ClientError as e:
+            if is_not_found(e):
+                return None
+            raise
+        geometry = json.loads(buffer.getvalue().decode("utf-8")).get("geometry")
+        if not geometry:
+            return None
+        return [round(b, 6) for b in shape(geometry).bounds]
+
+    added = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for code, bbox in zip(codes, executor.map(get_bbox, codes)):
+            if bbox is not None:
+                boundaries[code]["bbox"] = bbox
+                added.append(code)
+    return added
@@ -0,0 +1,407 @@
+"""
+Caches that are shared between requests
+"""
+
+import hashlib
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from sqlite_utils import Database
+
+MISSING = object()
+
+
+def _size(value):
+    return len(value) if isinstance(value, bytes) else 0
+
+
+class LRUCache:
+    """
+    A size and time limited least-recently-used cache
+
+    The cache is tied to a data version, and all items are cleared if
+    the version changes. Counts of hits and misses are kept so that the
+    effectiveness of the cache can be checked. If `maxbytes` is given the
+    total length of the (bytes) values is limited too.
+    """
+
+    def __init__(self, maxsize=10000, ttl=86400, maxbytes=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.maxbytes = maxbytes
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, default=MISSING):
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and item[0] < time.monotonic():
+                self._remove(key)
+                item = None
+            if item is None:
+                self.misses += 1
+                return default
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value):
+        if not self.maxsize:
+            return
+        if self.maxbytes is not None and _size(value) > self.maxbytes:
+            return
+        with self._lock:
+            if key in self._items:
+                self._remove(key)
+            self._items[key] = (time.monotonic() + self.ttl, value)
+            self._bytes += _size(value)
+            while len(self._items) > self.maxsize or (
+                self.maxbytes is not None and self._bytes > self.maxbytes
+            ):
+                self._remove(next(iter(self._items)))
+
+    def _remove(self, key):
+        _, value = self._items.pop(key)
+        self._bytes -= _size(value)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def set_version(self, version):
+        """
+        Clear the cache if the data version has changed
+        """
+        if version == self.version:
+            return
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+            self.version = version
+
+    def stats(self):
+        return {
+            "size": len(self._items),
+            "maxsize": self.maxsize,
+            "bytes": self._bytes,
+            "maxbytes": self.maxbytes,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "version": self.version,
+        }
+
+
+class SQLiteCache:
+    """
+    A time limited cache stored in a SQLite database
+
+    The database file can be shared by all the worker processes on a
+    machine. Items from previous data versions are deleted when the
+    version changes. Any database errors are treated as a cache miss.
+    """
+
+    table = "cache"
+
+    def __init__(self, path, ttl=86400):
+        self.path = path
+        self.ttl = ttl
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self._db = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.db[self.table].count
+
+    @property
+    def db(self):
+        # connections can't be shared with forked worker processes
+        if self._db is None or self._pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            self._db = Database(connection)
+            self._db.enable_wal()
+            self._db[self.table].create(
+                {"key": str, "version": str, "expires": float, "value": bytes},
+                pk="key",
+                if_not_exists=True,
+            )
+            self._pid = os.getpid()
+        return self._db
+
+    def get(self, key, default=MISSING):
+        try:
+            with self._lock:
+                row = self.db.execute(
+                    "select value from [{}] where key = ? and version is ? "
+                    "and expires > ?".format(self.table),
+                    [key, self.version, time.time()],
+                ).fetchone()
+        except sqlite3.Error:
+            row = None
+        if row is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return row[0]
+
+    def set(self, key, value):
+        try:
+            with self._lock:
+                self.db[self.table].insert(
+                    {
+                        "key": key,
+                        "version": self.version,
+                        "expires": time.time() + self.ttl,
+                        "value": value,
+                    },
+                    replace=True,
+                )
+        except sqlite3.Error:
+            pass
+
+    def clear(self):
+        try:
+            with self._lock:
+                self.db.execute("delete from [{}]".format(self.table))
+                self.db.conn.commit()
+        except sqlite3.Error:
+            pass
+
+    def set_version(self, version):
+        """
+        Delete any items that don't belong to the current data version
+        """
+        if version == self.version:
+            return
+        self.version = version
+        try:
+            with self._lock:
+                self.db.execute(
+                    "delete from [{}] where version is not ?".format(self.table),
+                    [version],
+                )
+                self.db.conn.commit()
+        except sqlite3.Error:
+            pass
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "version": self.version,
+        }
+
+
+class DiskCache:
+    """
+    A size limited least-recently-used cache of bytes stored as files
+
+    Each item is a file in a directory for the current data version, so the
+    cache can be shared by all the worker processes on a machine. Files are
+    written atomically, and reading a file updates its modified time so the
+    least recently used files are deleted when the cache is over its size.
+    A value of None is stored as an empty marker file, so missing items can
+    be cached too.
+    """
+
+    def __init__(self, path, maxbytes=1024**3):
+        self.path = path
+        self.maxbytes = maxbytes
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self._size = None
+        self._lock = threading.Lock()
+
+    @property
+    def directory(self):
+        return os.path.join(self.path, str(self.version or "current"))
+
+    def _filename(self, key, missing=False):
+        return os.path.join(
+            self.directory,
+            hashlib.sha1(key.encode("utf8")).hexdigest()
+            + (".missing" if missing else ".bin"),
+        )
+
+    def get(self, key, default=MISSING):
+        for missing in (False, True):
+            filename = self._filename(key, missing)
+            try:
+                with open(filename, "rb") as f:
+                    value = f.read()
+                os.utime(filename)
+            except OSError:
+                continue
+            self.hits += 1
+            return None if missing else value
+        self.misses += 1
+        return default
+
+    def set(self, key, value):
+        if not self.maxbytes:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                if value is not None:
+                    f.write(value)
+            os.replace(tmp, self._filename(key, value is None))
+        except OSError:
+            return
+        with self._lock:
+            if self._size is not None:
+                self._size += len(value or b"")
+            if self._size is None or self._size > self.maxbytes:
+                self._evict()
+
+    def _evict(self):
+        # other processes also write to the directory, so find the real size
+        files = []
+        for entry in os.scandir(self.directory):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+        self._size = sum(f[1] for f in files)
+        for _, size, path in sorted(files):
+            if self._size <= self.maxbytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._size -= size
+
+    def clear(self):
+        with self._lock:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self._size = None
+
+    def set_version(self, version):
+        """
+        Delete the files from any other data version
+        """
+        if version == self.version:
+            return
+        with self._lock:
+            self.version = version
+            self._size = None
+            if not os.path.isdir(self.path):
+                return
+            for entry in os.scandir(self.path):
+                if entry.is_dir() and entry.path != self.directory:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "maxbytes": self.maxbytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "version": self.version,
+        }
+
+
+class TieredCache:
+    """
+    Look up items in a series of caches, from fastest to slowest
+
+    Items found in a slower cache are copied into the faster ones.
+    """
+
+    def __init__(self, backends=None):
+        self.backends = backends or []
+
+    def get(self, key, default=MISSING):
+        for i, backend in enumerate(self.backends):
+            value = backend.get(key)
+            if value is not MISSING:
+                for faster_backend in self.backends[:i]:
+                    faster_backend.set(key, value)
+                return value
+        return default
+
+    def set(self, key, value):
+        for backend in self.backends:
+            backend.set(key, value)
+
+    def clear(self):
+        for backend in self.backends:
+            backend.clear()
+
+    def set_version(self, version):
+        for backend in self.backends:
+            backend.set_version(version)
+
+    def stats(self):
+        return [backend.stats() for backend in self.backends]
+
+
+# source documents from the geo_area index, keyed on (index, fields, code)
+area_cache = LRUCache()
+
+# rendered JSON responses, keyed on the endpoint, id, filetype and query
+response_cache = TieredCache()
+
+# boundary files downloaded from S3 and the files made from them, keyed on
+# the S3 key. Kept in memory, and on disk if BOUNDARY_CACHE_DIR is set. The
+# version is the boundaries release, so other imports don't empty it
+boundary_cache = TieredCache()
+
+
+def init_app(app):
+    area_cache.maxsize = app.config["AREA_CACHE_SIZE"]
+    area_cache.ttl = app.config["AREA_CACHE_TTL"]
+
+    backends = []
+    if app.config["RESPONSE_CACHE_SIZE"]:
+        backends.append(
+            LRUCache(
+                maxsize=app.config["RESPONSE_CACHE_SIZE"],
+                ttl=app.config["RESPONSE_CACHE_TTL"],
+            )
+        )
+    if app.config["RESPONSE_CACHE_DB"]:
+        backends.append(
+            SQLiteCache(
+                app.config["RESPONSE_CACHE_DB"], ttl=app.config["RESPONSE_CACHE_TTL"]
+            )
+        )
+    response_cache.backends = backends
+
+    boundary_cache.backends = []
+    if app.config["BOUNDARY_MEMORY_CACHE_SIZE"]:
+        boundary_cache.backends.append(
+            LRUCache(
+                maxsize=app.config["BOUNDARY_MEMORY_CACHE_ITEMS"],
+                maxbytes=app.config["BOUNDARY_MEMORY_CACHE_SIZE"],
+            )
+        )
+    if app.config["BOUNDARY_CACHE_DIR"]:
+        boundary_cache.backends.append(
+            DiskCache(
+                app.config["BOUNDARY_CACHE_DIR"],
+                maxbytes=app.config["BOUNDARY_CACHE_SIZE"],
+            )
+        )
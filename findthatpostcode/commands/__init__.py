@@ -3,6 +3,7 @@ from flask.cli import AppGroup
 from findthatpostcode.commands import (
     boundaries,
     codes,
+    enrich,
     new_pcon,
     placenames,
     postcodes,
@@ -17,6 +18,7 @@ def init_app(app):
     import_cli.add_command(codes.import_msoa_names)
     import_cli.add_command(boundaries.import_boundaries)
     import_cli.add_command(postcodes.import_nspl)
+    import_cli.add_command(postcodes.import_nearest_places)
     import_cli.add_command(stats.import_imd2025)
     import_cli.add_command(stats.import_imd2019)
     import_cli.add_command(stats.import_imd2015)
@@ -29,3 +31,8 @@ def init_app(app):
     check_cli.add_command(boundaries.check_boundaries)
 
     app.cli.add_command(check_cli)
+
+    enrich_cli = AppGroup("enrich")
+    enrich_cli.add_command(enrich.enrich_csv)
+
+    app.cli.add_command(enrich_cli)
@@ -13,7 +13,6 @@ import click
 import requests
 import requests_cache
 import tqdm
-from boto3 import session
 from elasticsearch.helpers import scan
 from flask import current_app
 from flask.cli import with_appcontext
@@ -23,6 +22,14 @@ from shapely.geometry import shape
 from shapely.ops import transform
 
 from findthatpostcode import db
+from findthatpostcode.boundaries import (
+    DETAIL_LEVELS,
+    add_missing_bboxes,
+    boundary_key,
+    list_boundaries,
+    read_manifest,
+    write_manifest,
+)
 from findthatpostcode.commands.codes import AREA_INDEX
 
 
@@ -53,17 +60,36 @@ def import_boundaries(
 
     # initialise the boto3 session
     client = db.get_s3_client()
+    bucket = current_app.config["S3_BUCKET"]
+
+    # the manifest records which areas have a boundary
+    manifest = None
+    if not examine:
+        manifest = read_manifest(client, bucket)
+        if manifest is None:
+            print("[manifest] No manifest found, listing existing boundaries")
+            manifest = list_boundaries(client, bucket)
 
     for url in urls:
         if url.startswith("http"):
-            import_boundary(client, url, examine, code_field)
+            import_boundary(client, url, examine, code_field, manifest)
         else:
             files = glob.glob(url, recursive=True)
             for file in files:
-                import_boundary(client, file, examine, code_field)
+                import_boundary(client, file, examine, code_field, manifest)
+
+    if not examine:
+        # boundaries imported before the manifest existed don't have a bbox,
+        # which is needed to find the areas in a map tile
+        added = add_missing_bboxes(client, bucket, manifest)
+        if added:
+            print("[manifest] Added the bbox of %s boundaries" % len(added))
+        write_manifest(client, bucket, manifest)
+        print("[manifest] Saved manifest with %s boundaries" % len(manifest))
+        db.record_release(db.get_db(), "boundaries")
 
 
-def import_boundary(client, url, examine=False, code_field=None):
+def import_boundary(client, url, examine=False, code_field=None, manifest=None):
     if url.startswith("http"):
         r = requests.get(url, stream=True)
         boundaries = r.json()
@@ -141,24 +167,39 @@ def import_boundary(client, url, examine=False, code_field=None):
             enumerate(boundaries["features"]), total=len(boundaries["features"])
         ):
             area_code = i["properties"][code_field]
-            prefix = area_code[0:3]
+            # create a shapely object from the geometry
+            geometry = shape(i["geometry"])
             if transformer:
-                # create a shapely object from the geometry
-                geometry = shape(i["geometry"])
-                i["geometry"] = json.loads(
-                    to_geojson(
-                        transform(
-                            transformer.transform,
-                            geometry,
-                        )
-                    )
-                )
+                geometry = transform(transformer.transform, geometry)
+                i["geometry"] = json.loads(to_geojson(geometry))
 
+            content = json.dumps(i).encode("utf-8")
             client.upload_fileobj(
-                io.BytesIO(json.dumps(i).encode("utf-8")),
+                io.BytesIO(content),
                 current_app.config["S3_BUCKET"],
-                "%s/%s.json" % (prefix, area_code),
+                boundary_key(area_code),
             )
+            detail_sizes = {}
+            for detail, tolerance in DETAIL_LEVELS.items():
+                simplified = {
+                    **i,
+                    "geometry": json.loads(
+                        to_geojson(geometry.simplify(tolerance, preserve_topology=True))
+                    ),
+                }
+                detail_content = json.dumps(simplified).encode("utf-8")
+                client.upload_fileobj(
+                    io.BytesIO(detail_content),
+                    current_app.config["S3_BUCKET"],
+                    boundary_key(area_code, detail),
+                )
+                detail_sizes[detail] = len(detail_content)
+            if manifest is not None:
+                manifest[area_code] = {
+                    "size": len(content),
+                    "bbox": [round(b, 6) for b in geometry.bounds],
+                    "detail": detail_sizes,
+                }
             boundary_count += 1
         print("[%s] %s boundaries imported" % (code, boundary_count))
 
@@ -187,25 +228,18 @@ def check_boundaries(es_index=AREA_INDEX):
             "active": area["_source"]["active"],
         }
 
-    # Get list of all boundaries from S3
-    s3_session = session.Session()
-    s3_client = s3_session.client(
-        "s3",
-        region_name=current_app.config["S3_REGION"],
-        endpoint_url=current_app.config["S3_ENDPOINT"].replace(
-            current_app.config["S3_BUCKET"] + ".", ""
-        ),
-        aws_access_key_id=current_app.config["S3_ACCESS_ID"],
-        aws_secret_access_key=current_app.config["S3_SECRET_KEY"],
-    )
-    paginator = s3_client.get_paginator("list_objects_v2")
-    page_iterator = paginator.paginate(Bucket=current_app.config["S3_BUCKET"])
-    for page in tqdm.tqdm(page_iterator):
-        for obj in page["Contents"]:
-            if obj["Key"].endswith(".json"):
-                bucket, prefix, code = obj["Key"].replace(".json", "").split("/")
-                if prefix in areas and code in areas[prefix]:
-                    areas[prefix][code]["boundary"] = True
+    # Get the areas with a boundary from the manifest
+    client = db.get_s3_client()
+    bucket = current_app.config["S3_BUCKET"]
+    manifest = read_manifest(client, bucket)
+    if manifest is None:
+        print("[manifest] No manifest found, listing existing boundaries")
+        manifest = list_boundaries(client, bucket)
+    for code, boundary in manifest.items():
+        # areas with only simplified boundaries don't have a size
+        prefix = code[0:3]
+        if "size" in (boundary or {}) and code in areas.get(prefix, {}):
+            areas[prefix][code]["boundary"] = True
 
     # Check that all areas have a boundary
     with open("boundaries.csv", "w") as f:
@@ -20,6 +20,7 @@ from openpyxl import load_workbook
 
 from findthatpostcode import db
 from findthatpostcode.commands.utils import get_latest_geoportal_url
+from findthatpostcode.controllers.areas import CHILD_FIELDS
 from findthatpostcode.metadata import ENTITIES
 
 PRD_RGC = "PRD_RGC"
@@ -162,6 +163,8 @@ def import_rgc(url=None, es_index=ENTITY_INDEX):
             )
             print("[elasticsearch] %s errors reported" % len(results[1]))
 
+    db.record_release(es, "rgc")
+
 
 @click.command("chd")
 @click.option("--url", default=None)
@@ -280,12 +283,28 @@ def import_chd(url=None, es_index=AREA_INDEX, encoding=DEFAULT_ENCODING):
                 if area[v[0]]:
                     areas[area["GEOGCD"]]["doc"]["equivalents"][k] = area[v[0]]
 
+    # store a list of the children of each area, so they don't need a search
+    for area in areas.values():
+        area["doc"]["children"] = []
+    for area in sorted(areas.values(), key=lambda a: a["doc"]["name"] or a["_id"]):
+        parent = areas.get(area["doc"]["parent"])
+        if parent:
+            parent["doc"]["children"].append(
+                {k: area["doc"].get(k) for k in CHILD_FIELDS}
+            )
+    print(
+        "[areas] Found children for %s areas"
+        % len([a for a in areas.values() if a["doc"]["children"]])
+    )
+
     print("[areas] Processed %s areas" % len(areas))
     print("[elasticsearch] %s areas to save" % len(areas))
     results = bulk(es, areas.values())
     print("[elasticsearch] saved %s areas to %s index" % (results[0], es_index))
     print("[elasticsearch] %s errors reported" % len(results[1]))
 
+    db.record_release(es, "chd")
+
 
 @click.command("msoanames")
 @click.option("--url", default=MSOA_2021_URL)
@@ -337,3 +356,5 @@ def import_msoa_names(url=MSOA_2011_URL, es_index=AREA_INDEX):
     results = bulk(es, area_updates)
     print("[elasticsearch] saved %s areas to %s index" % (results[0], es_index))
     print("[elasticsearch] %s errors reported" % len(results[1]))
+
+    db.record_release(es, "msoanames")
@@ -0,0 +1,172 @@
+"""
+Commands for adding postcode data to local files
+"""
+
+import bz2
+import gzip
+import io
+import lzma
+import os.path
+import time
+import zipfile
+from contextlib import contextmanager
+
+import click
+import tqdm
+from flask import current_app
+from flask.cli import with_appcontext
+
+from findthatpostcode import db
+from findthatpostcode.blueprints.process_csv import (
+    CSV_CHUNK_SIZE,
+    expand_fields,
+    iter_csv,
+)
+from findthatpostcode.metadata import DEFAULT_UPLOAD_FIELDS, STATS_FIELDS
+
+COMPRESSED_OPENERS = {
+    ".gz": gzip.open,
+    ".bz2": bz2.open,
+    ".xz": lzma.open,
+}
+
+
+@contextmanager
+def open_csv(path, mode="r", encoding="utf-8"):
+    """
+    Open a CSV file for streaming, which may be compressed
+
+    gzip, bz2 and xz files are read and written based on their extension,
+    and the first CSV file in a zip file is read. "-" is stdin or stdout.
+    """
+    if path == "-":
+        stream = click.get_binary_stream("stdin" if mode == "r" else "stdout")
+        f = io.TextIOWrapper(stream, encoding=encoding, newline="")
+        yield f
+        # leave stdin and stdout open
+        f.flush()
+        f.detach()
+        return
+
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".zip" and mode == "r":
+        with zipfile.ZipFile(path) as z:
+            names = [n for n in z.namelist() if n.lower().endswith(".csv")]
+            if not names:
+                raise click.ClickException("No CSV file found in {}".format(path))
+            with io.TextIOWrapper(z.open(names[0]), encoding=encoding, newline="") as f:
+                yield f
+        return
+
+    if ext in COMPRESSED_OPENERS:
+        f = COMPRESSED_OPENERS[ext](path, mode + "t", encoding=encoding, newline="")
+    else:
+        f = open(path, mode, encoding=encoding, newline="")
+    with f:
+        yield f
+
+
+@click.command("csv")
+@click.option(
+    "--column",
+    "-c",
+    "column_name",
+    default="postcode",
+    help="Column containing the postcode",
+)
+@click.option(
+    "--field",
+    "-f",
+    "fields",
+    multiple=True,
+    help="Field to add, as in the /addtocsv form (eg latlng, laua, laua_name). "
+    "Can be repeated or comma-separated.",
+)
+@click.option(
+    "--lat", "lat_column", help="Latitude column, to use the nearest postcode"
+)
+@click.option("--lon", "lon_column", help="Longitude column")
+@click.option("--easting", "easting_column", help="OSGB easting column")
+@click.option("--northing", "northing_column", help="OSGB northing column")
+@click.option("--stats/--no-stats", default=False, help="Add all statistics fields")
+@click.option("--chunk-size", default=CSV_CHUNK_SIZE, help="Rows looked up at once")
+@click.option("--workers", default=None, type=int, help="Chunks looked up at once")
+@click.option("--encoding", default="utf-8")
+@click.argument("infile")
+@click.argument("outfile", default="-")
+@with_appcontext
+def enrich_csv(
+    infile,
+    outfile="-",
+    column_name="postcode",
+    fields=(),
+    lat_column=None,
+    lon_column=None,
+    easting_column=None,
+    northing_column=None,
+    stats=False,
+    chunk_size=CSV_CHUNK_SIZE,
+    workers=None,
+    encoding="utf-8",
+):
+    """
+    Add postcode data to a local CSV file
+
+    INFILE and OUTFILE can be gzip, bz2 or xz compressed (INFILE can also
+    be a zip file), or "-" for stdin and stdout. Rows can be matched to the
+    nearest postcode to their coordinates using --lat and --lon or
+    --easting and --northing, instead of using a postcode column.
+    """
+    point_fields = None
+    osgb = False
+    if lat_column or lon_column:
+        if not (lat_column and lon_column):
+            raise click.UsageError("--lat and --lon must be used together")
+        point_fields = [lat_column, lon_column]
+    elif easting_column or northing_column:
+        if not (easting_column and northing_column):
+            raise click.UsageError("--easting and --northing must be used together")
+        point_fields = [easting_column, northing_column]
+        osgb = True
+
+    fields = [f.strip() for i in fields for f in i.split(",") if f.strip()]
+    if not fields:
+        fields = list(DEFAULT_UPLOAD_FIELDS)
+    if stats:
+        fields += [f.id for f in STATS_FIELDS if f.id not in fields]
+    fields = expand_fields(fields)
+    if workers is None:
+        workers = current_app.config["CSV_WORKERS"]
+
+    es = db.get_db()
+    progress_bar = tqdm.tqdm(unit=" rows", unit_scale=True, disable=None)
+    done = 0
+
+    def progress(rows):
+        nonlocal done
+        progress_bar.update(rows - done)
+        done = rows
+
+    start = time.perf_counter()
+    with open_csv(infile, "r", encoding) as f, open_csv(outfile, "w", encoding) as out:
+        for output in iter_csv(
+            f,
+            es,
+            column_name,
+            fields,
+            chunk_size=chunk_size,
+            progress=progress,
+            workers=workers,
+            point_fields=point_fields,
+            osgb=osgb,
+        ):
+            out.write(output)
+    progress_bar.close()
+
+    elapsed = time.perf_counter() - start
+    click.echo(
+        "{:,.0f} rows in {:,.1f} seconds ({:,.0f} rows/sec)".format(
+            done, elapsed, done / elapsed if elapsed else 0
+        ),
+        err=True,
+    )
@@ -148,3 +148,5 @@ def import_new_pcon(area_index=AREA_INDEX, postcode_index=PC_INDEX):
         % (results[0], postcode_index)
     )
     print("[elasticsearch] %s errors reported" % len(results[1]))
+
+    db.record_release(es, "new_pcon")
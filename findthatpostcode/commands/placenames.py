@@ -172,3 +172,5 @@ def import_placenames(url=None, es_index=PLACENAMES_INDEX):
             )
             print("[elasticsearch] %s errors reported" % len(results[1]))
             placenames = []
+
+    db.record_release(es, "placenames")
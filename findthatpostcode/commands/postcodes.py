@@ -5,28 +5,105 @@ Import commands for the register of geographic codes and code history database
 import csv
 import datetime
 import hashlib
+import heapq
 import io
+import re
 import zipfile
 
 import click
 import requests
 import requests_cache
-from elasticsearch.helpers import bulk
+import tqdm
+from elasticsearch.helpers import bulk, scan
 from flask import current_app
 from flask.cli import with_appcontext
 
 from findthatpostcode import db
+from findthatpostcode.commands.codes import AREA_INDEX
+from findthatpostcode.commands.placenames import PLACENAMES_INDEX
 from findthatpostcode.commands.utils import get_latest_geoportal_url
+from findthatpostcode.controllers.areas import AREA_CODE_REGEX
+from findthatpostcode.spatial import GridIndex
 
 PC_INDEX = "geo_postcode"
 PRD_NSPL = "PRD_NSPL"
+NEAREST_PLACES_COUNT = 10
+EXAMPLE_POSTCODES_COUNT = 5
+
+
+def add_example_postcode(examples, postcode, count=EXAMPLE_POSTCODES_COUNT):
+    """
+    Add an active postcode to the sample of example postcodes for its areas
+
+    Each area keeps the postcodes with the lowest hashes, so the sample is
+    spread across the area but is the same each time the data is imported.
+    """
+    if postcode["doterm"] or not postcode.get("location"):
+        return
+    key = -int(postcode["hash"][:15], 16)
+    example = (key, postcode["pcds"], postcode["location"])
+    for k, v in postcode.items():
+        if not isinstance(v, str) or not re.fullmatch(AREA_CODE_REGEX, v):
+            continue
+        area_examples = examples.setdefault(v, [])
+        if len(area_examples) < count:
+            heapq.heappush(area_examples, example)
+        elif key > area_examples[0][0]:
+            heapq.heapreplace(area_examples, example)
+
+
+def save_example_postcodes(es, examples, es_index=AREA_INDEX):
+    """
+    Store the example postcodes on each area that already exists
+    """
+    updates = (
+        {
+            "_index": es_index,
+            "_type": "_doc",
+            "_op_type": "update",
+            "_id": areacode,
+            "doc": {
+                "example_postcodes": [
+                    {"id": pcds, "location": location}
+                    for _, pcds, location in sorted(area_examples, reverse=True)
+                ]
+            },
+        }
+        for areacode, area_examples in examples.items()
+    )
+    results = bulk(es, updates, raise_on_error=False)
+    print("[elasticsearch] saved example postcodes for %s areas" % results[0])
+    print("[elasticsearch] %s areas not found" % len(results[1]))
+
+
+def save_postcode_index(postcodes, path):
+    """
+    Write the nearest-postcode index used for point lookups
+
+    `postcodes` is a list of (pcds, lat, lon) for the active postcodes.
+    """
+    index = GridIndex(
+        [p[1] for p in postcodes],
+        [p[2] for p in postcodes],
+        ids=[p[0] for p in postcodes],
+    )
+    index.save(path)
+    print("[postcodes] Saved index of %s active postcodes to %s" % (len(index), path))
 
 
 @click.command("nspl")
 @click.option("--es-index", default=PC_INDEX)
+@click.option("--area-index", default=AREA_INDEX)
 @click.option("--url", default=None)
+@click.option(
+    "--postcode-index",
+    default=None,
+    help="Where to save the nearest-postcode index (default POSTCODE_INDEX_PATH)",
+)
 @with_appcontext
-def import_nspl(url=None, es_index=PC_INDEX):
+def import_nspl(
+    url=None, es_index=PC_INDEX, area_index=AREA_INDEX, postcode_index=None
+):
     if not url:
         url = get_latest_geoportal_url(PRD_NSPL)
 
@@ -38,6 +115,8 @@ def import_nspl(url=None, es_index=PC_INDEX):
     r = requests.get(url, stream=True)
     z = zipfile.ZipFile(io.BytesIO(r.content))
     postcodes = []
+    examples = {}
+    active_postcodes = []
 
     for f in z.filelist:
         if not f.filename.endswith(".csv") or not f.filename.startswith(
@@ -130,6 +209,9 @@ def import_nspl(url=None, es_index=PC_INDEX):
 
                 record["doc"] = i
                 postcodes.append(record)
+                add_example_postcode(examples, i)
+                if not i["doterm"] and i.get("location"):
+                    active_postcodes.append((i["pcds"], i["lat"], i["long"]))
                 pcount += 1
 
             print("[postcodes] Processed %s postcodes" % pcount)
@@ -141,3 +223,99 @@ def import_nspl(url=None, es_index=PC_INDEX):
             )
             print("[elasticsearch] %s errors reported" % len(results[1]))
             postcodes = []
+
+    save_example_postcodes(es, examples, area_index)
+    save_postcode_index(
+        active_postcodes,
+        postcode_index or current_app.config["POSTCODE_INDEX_PATH"],
+    )
+
+    db.record_release(es, "nspl")
+
+
+@click.command("nearest_places")
+@click.option("--es-index", default=PC_INDEX)
+@click.option("--places-index", default=PLACENAMES_INDEX)
+@click.option("--count", default=NEAREST_PLACES_COUNT)
+@click.option("--batch-size", default=50000)
+@with_appcontext
+def import_nearest_places(
+    es_index=PC_INDEX,
+    places_index=PLACENAMES_INDEX,
+    count=NEAREST_PLACES_COUNT,
+    batch_size=50000,
+):
+    """
+    Store the nearest localities on each postcode
+
+    Needs to be run after both the postcodes and placenames are imported.
+    """
+    es = db.get_db()
+
+    place_ids = []
+    place_lats = []
+    place_lons = []
+    places = scan(
+        es,
+        index=places_index,
+        query={"query": {"match": {"descnm": {"query": "LOC"}}}},
+        _source_includes=["location"],
+    )
+    for p in places:
+        location = p["_source"].get("location")
+        if location:
+            place_ids.append(p["_id"])
+            place_lats.append(location["lat"])
+            place_lons.append(location["lon"])
+    print("[places] Found %s places with a location" % len(place_ids))
+    place_index = GridIndex(place_lats, place_lons, ids=place_ids)
+
+    def save_batch(batch):
+        nearest, distances = place_index.nearest(
+            [p["_source"]["location"]["lat"] for p in batch],
+            [p["_source"]["location"]["lon"] for p in batch],
+            k=count,
+        )
+        updates = [
+            {
+                "_index": es_index,
+                "_type": "_doc",
+                "_op_type": "update",
+                "_id": p["_id"],
+                "doc": {
+                    "nearest_places": [
+                        {"id": str(place_index.ids[j]), "distance": round(float(d), 1)}
+                        for j, d in zip(nearest[i], distances[i])
+                        if j >= 0
+                    ]
+                },
+            }
+            for i, p in enumerate(batch)
+        ]
+        return bulk(es, updates, raise_on_error=False)
+
+    postcodes = scan(
+        es,
+        index=es_index,
+        query={"query": {"exists": {"field": "location"}}},
+        _source_includes=["location"],
+    )
+    saved = 0
+    errors = 0
+    batch = []
+    for p in tqdm.tqdm(postcodes):
+        batch.append(p)
+        if len(batch) >= batch_size:
+            results = save_batch(batch)
+            saved += results[0]
+            errors += len(results[1])
+            batch = []
+    if batch:
+        results = save_batch(batch)
+        saved += results[0]
+        errors += len(results[1])
+
+    print("[elasticsearch] saved nearest places for %s postcodes" % saved)
+    print("[elasticsearch] %s errors reported" % errors)
+
+    db.record_release(es, "nearest_places")
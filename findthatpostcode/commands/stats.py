@@ -223,6 +223,8 @@ def import_imd2025(url=IMD2025_URL, es_index=AREA_INDEX):
     print("[elasticsearch] saved %s areas to %s index" % (results[0], es_index))
     print("[elasticsearch] %s errors reported" % len(results[1]))
 
+    db.record_release(es, "imd2025")
+
 
 @click.command("imd2019")
 @click.option("--es-index", default=AREA_INDEX)
@@ -273,6 +275,8 @@ def import_imd2019(url=IMD2019_URL, es_index=AREA_INDEX):
     print("[elasticsearch] saved %s areas to %s index" % (results[0], es_index))
     print("[elasticsearch] %s errors reported" % len(results[1]))
 
+    db.record_release(es, "imd2019")
+
 
 @click.command("imd2015")
 @click.option("--es-index", default=AREA_INDEX)
@@ -322,3 +326,5 @@ def import_imd2015(url=IMD2015_URL, es_index=AREA_INDEX):
     results = bulk(es, area_updates)
     print("[elasticsearch] saved %s areas to %s index" % (results[0], es_index))
     print("[elasticsearch] %s errors reported" % len(results[1]))
+
+    db.record_release(es, "imd2015")
@@ -1,15 +1,47 @@
+import copy
 import io
 import json
 from datetime import datetime
 
-from botocore.exceptions import ClientError
+from botocore.exceptions import BotoCoreError, ClientError
 from elasticsearch.helpers import scan
 from flask import current_app
 
-from findthatpostcode.controllers.controller import GEOJSON_TYPES, Controller
+from findthatpostcode.controllers.controller import (
+    GEOJSON_TYPES,
+    Controller,
+    run_queries,
+)
 from findthatpostcode.controllers.places import Place
-from findthatpostcode.db import get_s3_client
-from findthatpostcode.metadata import AREA_TYPES
+from findthatpostcode.boundaries import (
+    boundary_key,
+    boundary_manifest,
+    is_not_found,
+)
+from findthatpostcode.cache import MISSING, area_cache, boundary_cache
+from findthatpostcode.db import (
+    get_boundaries_version,
+    get_data_version,
+    get_db,
+    get_s3_client,
+)
+from findthatpostcode.metadata import AREA_TYPES, ENTITIES, STATS_FIELDS
+
+# fields needed to display an area as a relationship of another object
+AREA_SUMMARY_FIELDS = ["name", "type", "entity", "active"] + [
+    f.location for f in STATS_FIELDS
+]
+AREA_CODE_REGEX = r"[A-Z][0-9]{8}"
+
+# fields stored for each child in the list of children on an area
+CHILD_FIELDS = ["code", "name", "type", "active"]
+
+# errors from S3 that mean a file couldn't be fetched this time, rather than
+# that it doesn't exist
+S3_ERRORS = (BotoCoreError, ClientError)
+
+# large fields left out when areas are listed or searched for
+AREA_LIST_EXCLUDES = ["boundary", "children", "example_postcodes"]
 
 
 class Areatype(Controller):
@@ -70,6 +102,7 @@ class Areatype(Controller):
             index="geo_area",
             body=query,
             sort="_id:asc",
+            _source_excludes=AREA_LIST_EXCLUDES,
         )
         if pagination:
             search_params["from_"] = pagination.from_
@@ -118,7 +151,8 @@ class Area(Controller):
         self.relationships["predecessor"] = kwargs.get("predecessor")
         self.relationships["successor"] = kwargs.get("successor")
         self.relationships["children"] = kwargs.get("children")
-        self._boundary = None
+        self._boundary = MISSING
+        self.boundary_detail = None
         if data:
             self.found = True
             self.attributes = self.process_attributes(data)
@@ -128,61 +162,87 @@ class Area(Controller):
 
     @classmethod
     def get_from_es(
-        cls, id, es, es_config=None, examples_count=5, boundary=False, recursive=True
+        cls,
+        id,
+        es,
+        es_config=None,
+        examples_count=5,
+        boundary=False,
+        recursive=True,
+        include=None,
     ):
+        """
+        Fetch an area and its related areas and postcodes
+
+        `include` is a list of the relationships to fetch (by default all
+        relationships are fetched).
+        """
         if not es_config:
             es_config = {}
 
-        # fetch the initial area
-        data = es.get(
-            index=es_config.get("es_index", cls.es_index),
-            doc_type=es_config.get("es_type", cls.es_type),
-            id=cls.parse_id(id),
-            ignore=[404],
-            _source_excludes=(["boundary"]),
+        def included(relationship):
+            return include is None or relationship in include
+
+        # the area is fetched first, then the relationships are fetched at
+        # the same time
+        id = cls.parse_id(id)
+        results, timings = run_queries(
+            {"area": lambda: get_area_sources([id], es, es_config).get(id)}
         )
+        source = results["area"] or {}
         relationships = {
             "areatype": {},
             "example_postcodes": [],
         }
-        if data["found"]:
-            if data["_source"].get("type"):
-                relationships["areatype"] = Areatype(data["_source"].get("type"))
-            elif data["_source"].get("entity"):
-                relationships["areatype"] = Areatype.get_from_es(
-                    data["_source"].get("entity"), es
-                )
-
-        if examples_count:
-            relationships["example_postcodes"] = cls.get_example_postcodes(
-                id, es, examples_count=examples_count
-            )
-
-        if data.get("_source", {}) and recursive:
-            children = cls.get_children(id, es)
-            data["_source"]["child_count"] = children["total"]
-            relationships["children"] = children["areas"]
-            data["_source"]["child_counts"] = children["counts"]
-
-        if data.get("_source", {}).get("parent") and recursive:
-            relationships["parent"] = cls.get_from_es(
-                data["_source"]["parent"], es, examples_count=0, recursive=False
-            )
 
-        if data.get("_source", {}).get("predecessor") and recursive:
-            relationships["predecessor"] = [
-                cls.get_from_es(i, es, examples_count=0, recursive=False)
-                for i in data["_source"]["predecessor"]
+        def get_related(codes):
+            codes = [i for i in codes if i]
+            get_area_sources(codes, es)
+            return [
+                cls.get_from_es(i, es, examples_count=0, recursive=False) for i in codes
             ]
 
-        if data.get("_source", {}).get("successor") and recursive:
-            relationships["successor"] = [
-                cls.get_from_es(i, es, examples_count=0, recursive=False)
-                for i in data["_source"]["successor"]
-                if i
-            ]
+        # children are stored on the area by `import_chd` and example
+        # postcodes by `import_nspl`
+        children = source.pop("children", None)
+        examples = source.pop("example_postcodes", None)
+
+        queries = {}
+        if examples_count and included("example_postcodes"):
+            if examples is None:
+                queries["example_postcodes"] = lambda: cls.get_example_postcodes(
+                    id, es, examples_count=examples_count
+                )
+            elif examples:
+                queries["example_postcodes"] = lambda: cls.get_stored_postcodes(
+                    [e["id"] for e in examples[:examples_count]], es
+                )
+        if source.get("entity") and not source.get("type"):
+            queries["areatype"] = lambda: Areatype.get_from_es(source["entity"], es)
+        if source and recursive and included("children") and children is None:
+            queries["children"] = lambda: cls.get_children(id, es)
+        if source.get("parent") and recursive and included("parent"):
+            queries["parent"] = lambda: get_related([source["parent"]])[0]
+        for relationship in ("predecessor", "successor"):
+            if source.get(relationship) and recursive and included(relationship):
+                queries[relationship] = lambda r=relationship: get_related(source[r])
+        related, related_timings = run_queries(queries)
+        timings.update(related_timings)
+
+        if source.get("type"):
+            relationships["areatype"] = Areatype(source.get("type"))
+        if "children" in related:
+            children = related.pop("children")
+        if source and recursive and included("children"):
+            children = cls.group_children(children or [])
+            source["child_count"] = children["total"]
+            relationships["children"] = children["areas"]
+            source["child_counts"] = children["counts"]
+        relationships.update(related)
 
-        return cls(data.get("_id"), data=data.get("_source"), **relationships)
+        area = cls(id, data=source, **relationships)
+        area.timings = timings
+        return area
 
     def process_attributes(self, data):
         if not self.relationships.get("areatype") and data.get("type"):
@@ -215,6 +275,12 @@ class Area(Controller):
 
     @staticmethod
     def get_example_postcodes(areacode, es, examples_count=5):
+        """
+        Search for a random sample of postcodes in an area
+
+        This is only needed for areas imported before example postcodes were
+        stored on area documents by `import_nspl`.
+        """
         from findthatpostcode.controllers.postcodes import Postcode
 
         query = {
@@ -234,78 +300,97 @@ class Area(Controller):
 
         return [Postcode(e["_id"], e["_source"]) for e in example["hits"]["hits"]]
 
+    @staticmethod
+    def get_stored_postcodes(postcodes, es):
+        """
+        Fetch the example postcodes stored on an area
+        """
+        from findthatpostcode.controllers.postcodes import Postcode
+
+        result = es.mget(
+            index="geo_postcode",
+            body={"ids": postcodes},
+            _source_excludes=["nearest_places"],
+        )
+        return [
+            Postcode(e["_id"], e["_source"])
+            for e in result.get("docs", [])
+            if e.get("found")
+        ]
+
     @staticmethod
     def get_children(areacode, es):
-        query = {
-            "aggs": {"types": {"terms": {"field": "type.keyword"}}},
-            "query": {
-                "function_score": {
-                    "query": {
-                        "match": {"parent": {"query": areacode}},
-                    },
-                    "random_score": {},
-                }
-            },
-        }
-        children = es.search(
+        """
+        Find the children of an area by searching for areas with it as a parent
+
+        This is only needed for areas imported before child lists were
+        stored on area documents by `import_chd`.
+        """
+        children = scan(
+            es,
             index="geo_area",
-            body=query,
-            size=100,
-            _source_includes=["code", "name", "type", "active"],
+            query={"query": {"match": {"parent": {"query": areacode}}}},
+            _source_includes=CHILD_FIELDS,
         )
+        return [
+            {
+                **{k: c["_source"].get(k) for k in CHILD_FIELDS},
+                "code": c["_id"],
+            }
+            for c in children
+        ]
+
+    @staticmethod
+    def group_children(children):
+        """
+        Group a list of child areas by their type
+        """
+        areas = {}
+        for child in children:
+            if not child.get("type"):
+                continue
+            areas.setdefault(child["type"], []).append(Area(child["code"], dict(child)))
+        areas = dict(sorted(areas.items(), key=lambda t: -len(t[1])))
         return {
-            "total": Area.get_total_from_es(children),
-            "areas": {
-                t["key"]: [
-                    Area(e["_id"], e["_source"])
-                    for e in children["hits"]["hits"]
-                    if e["_source"].get("type") == t["key"]
-                ]
-                for t in children.get("aggregations", {})
-                .get("types", {})
-                .get("buckets", [])
-            },
-            "counts": {
-                t["key"]: t["doc_count"]
-                for t in children.get("aggregations", {})
-                .get("types", {})
-                .get("buckets", [])
-            },
+            "total": len(children),
+            "areas": areas,
+            "counts": {k: len(v) for k, v in areas.items()},
         }
 
     @property
     def boundary(self):
-        if self._boundary is None:
+        if self._boundary is MISSING:
             self._boundary = self._get_boundary()
         return self._boundary
 
     @property
     def has_boundary(self):
-        if self._boundary is None:
+        if self._boundary is MISSING:
+            manifest = get_boundary_manifest()
+            if manifest.loaded:
+                return self.id in manifest
             self._boundary = self._get_boundary()
         return self._boundary is not None
 
     def _get_boundary(self):
-        client = get_s3_client()
-        buffer = io.BytesIO()
-        area_code = self.id
-        prefix = self.id[0:3]
+        manifest = get_boundary_manifest()
+        if manifest.loaded and self.id not in manifest:
+            return None
+        boundary_cache.set_version(get_boundaries_version(get_db()))
         try:
-            client.download_fileobj(
+            return fetch_boundary(
+                self.id,
+                self.boundary_detail,
+                manifest,
+                get_s3_client(),
                 current_app.config["S3_BUCKET"],
-                "%s/%s.json" % (prefix, area_code),
-                buffer,
             )
-            boundary = json.loads(buffer.getvalue().decode("utf-8"))
-            return boundary.get("geometry")
-        except ClientError:
-            None
+        except S3_ERRORS:
+            return None
 
-    def topJSON(self):
-        json = super().topJSON()
+    def topJSON(self, fields=None):
+        json = super().topJSON(fields)
         if self.found:
-            # @TODO need to check whether boundary data
-            # actually exists before applying this
             if self.has_boundary:
                 json["links"]["geojson"] = self.url(filetype="geojson")
         return json
@@ -334,6 +419,165 @@ class Area(Controller):
         )
 
 
+def get_boundary_manifest():
+    """
+    The manifest of boundaries, reloaded if the data version has changed
+    """
+    return boundary_manifest.load(
+        get_s3_client(),
+        current_app.config["S3_BUCKET"],
+        get_data_version(get_db()),
+    )
+
+
+def get_boundary_file(key, client, bucket):
+    """
+    Get a boundary file from S3, using the local boundary cache
+
+    Returns None if the file doesn't exist, which is also cached. Other S3
+    errors are raised and not cached, as they may not happen next time. The
+    S3 client is passed in so that this can be used outside the app context.
+    """
+    content = boundary_cache.get(key)
+    if content is not MISSING:
+        return content
+
+    buffer = io.BytesIO()
+    try:
+        client.download_fileobj(bucket, key, buffer)
+        content = buffer.getvalue()
+    except ClientError as e:
+        if not is_not_found(e):
+            raise
+        content = None
+    boundary_cache.set(key, content)
+    return content
+
+
+def fetch_boundary(area_code, detail, manifest, client, bucket):
+    """
+    Get the geometry of an area's boundary at a level of detail
+
+    The full boundary is used if the simplified version isn't available.
+    """
+    keys = [boundary_key(area_code)]
+    if detail and (not manifest.loaded or manifest.has_detail(area_code, detail)):
+        keys.insert(0, boundary_key(area_code, detail))
+    for key in keys:
+        content = get_boundary_file(key, client, bucket)
+        if content is not None:
+            return json.loads(content.decode("utf-8")).get("geometry")
+    return None
+
+
+def get_area_boundaries(codes, es, es_config=None, detail=None):
+    """
+    Fetch a list of areas with their boundaries
+
+    The areas are fetched with a single request and the boundaries are
+    downloaded at the same time. Returns a list of the areas that have a
+    boundary, in the same order as the codes, and a dictionary of errors
+    for the codes that don't.
+    """
+    codes = list(dict.fromkeys(codes))
+    areas = get_areas_by_code(codes, es, es_config, fields=None)
+
+    manifest = get_boundary_manifest()
+    boundary_cache.set_version(get_boundaries_version(es))
+    client = get_s3_client()
+    bucket = current_app.config["S3_BUCKET"]
+
+    def get_boundary(code):
+        if manifest.loaded and code not in manifest:
+            return None
+        try:
+            return fetch_boundary(code, detail, manifest, client, bucket)
+        except S3_ERRORS:
+            return MISSING
+
+    boundaries, _ = run_queries(
+        {code: (lambda c=code: get_boundary(c)) for code in codes if code in areas}
+    )
+
+    results = []
+    errors = {}
+    for code in codes:
+        if code not in areas:
+            errors[code] = "area not found"
+        elif boundaries[code] is MISSING:
+            errors[code] = "boundary could not be loaded"
+        elif not boundaries[code]:
+            errors[code] = "boundary not found"
+        else:
+            areas[code]._boundary = boundaries[code]
+            areas[code].boundary_detail = detail
+            results.append(areas[code])
+    return results, errors
+
+
+def get_area_sources(codes, es, es_config=None, fields=None):
+    """
+    Fetch the source documents for a list of area codes
+
+    Documents are kept in the process-wide area cache, so only codes that
+    haven't been seen in the current data release are fetched from
+    elasticsearch (using a single mget). Returns a dictionary of area code
+    to source document, with None for any areas that weren't found.
+    """
+    if not es_config:
+        es_config = {}
+    index = es_config.get("es_index", Area.es_index)
+    fields = tuple(fields) if fields else None
+    area_cache.set_version(get_data_version(es))
+
+    codes = list(dict.fromkeys(c for c in codes if c))
+    sources = {}
+    to_fetch = []
+    for code in codes:
+        source = area_cache.get((index, fields, code))
+        if source is MISSING:
+            to_fetch.append(code)
+        else:
+            sources[code] = source
+
+    if to_fetch:
+        mget_params = dict(index=index, body={"ids": to_fetch})
+        if fields:
+            mget_params["_source_includes"] = list(fields)
+        else:
+            mget_params["_source_excludes"] = ["boundary"]
+        result = es.mget(**mget_params)
+        for a in result.get("docs", []):
+            source = a.get("_source") if a.get("found") else None
+            area_cache.set((index, fields, a["_id"]), source)
+            sources[a["_id"]] = source
+
+    return {code: copy.deepcopy(sources.get(code)) for code in codes}
+
+
+def get_areas_by_code(codes, es, es_config=None, fields=AREA_SUMMARY_FIELDS):
+    """
+    Fetch a list of areas using a single request
+
+    Only the fields needed to display the area are fetched, and no
+    relationships are added (apart from the areatype). Returns a dictionary
+    of the areas that were found, keyed by area code.
+    """
+    areas = {}
+    for code, source in get_area_sources(codes, es, es_config, fields).items():
+        if not source:
+            continue
+        source.pop("children", None)
+        source.pop("example_postcodes", None)
+        relationships = {}
+        if not source.get("type") and source.get("entity"):
+            relationships["areatype"] = Areatype(
+                ENTITIES.get(source["entity"], source["entity"])
+            )
+        areas[code] = Area(code, source, **relationships)
+    return areas
+
+
 def search_areas(q, es, pagination=None, es_config=None):
     """
     Search for areas based on a name
@@ -408,36 +652,38 @@ def search_areas(q, es, pagination=None, es_config=None):
             body=query,
             from_=pagination.from_,
             size=pagination.size,
-            _source_excludes=["boundary"],
+            _source_excludes=AREA_LIST_EXCLUDES,
             ignore=[404],
         )
     else:
         result = es.search(
             index="geo_area,geo_placename",
             body=query,
-            _source_excludes=["boundary"],
+            _source_excludes=AREA_LIST_EXCLUDES,
             ignore=[404],
         )
+    hits = result.get("hits", {}).get("hits", [])
+    related_areas = get_areas_by_code(
+        [
+            a["_source"].get("areas", {}).get("laua")
+            if a["_index"] == "geo_placename"
+            else a["_source"].get("parent")
+            for a in hits
+        ],
+        es,
+    )
     return_result = []
-    for a in result.get("hits", {}).get("hits", []):
+    for a in hits:
         if a["_index"] == "geo_placename":
             relationships = {}
-            if a["_source"].get("areas", {}).get("laua"):
-                relationships["areas"] = [
-                    Area.get_from_es(
-                        a["_source"]["areas"]["laua"],
-                        es,
-                        examples_count=0,
-                        recursive=False,
-                    )
-                ]
+            laua = related_areas.get(a["_source"].get("areas", {}).get("laua"))
+            if laua:
+                relationships["areas"] = [laua]
             return_result.append(Place(a["_id"], a["_source"], **relationships))
         else:
             relationships = {}
             if a["_source"].get("parent"):
-                relationships["parent"] = Area.get_from_es(
-                    a["_source"]["parent"], es, examples_count=0, recursive=False
-                )
+                relationships["parent"] = related_areas.get(a["_source"]["parent"])
             return_result.append(Area(a["_id"], a["_source"], **relationships))
     total = result.get("hits", {}).get("total", 0)
     if isinstance(total, dict):
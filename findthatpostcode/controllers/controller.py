@@ -1,4 +1,7 @@
 import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlencode, urlunparse
 
 GEOJSON_TYPES = {
@@ -15,6 +18,109 @@ GEOJSON_TYPES = {
     # (e.g., a Point and a LineString).
 }
 
+# a box around the UK, the Channel Islands and the Isle of Man, with a margin
+# of about 10km. Points outside it can't be near a postcode.
+UK_BBOX = {"min_lat": 49.0, "max_lat": 61.0, "min_lon": -8.8, "max_lon": 2.0}
+
+# nearest neighbour searches look within each of these distances (in metres)
+# in turn, before falling back to searching the whole index
+NEAREST_SEARCH_RADII = (1000, 5000, 25000)
+
+# independent elasticsearch queries are run using a shared, bounded pool
+QUERY_WORKERS = 8
+_query_thread = threading.local()
+
+
+def _mark_query_thread():
+    _query_thread.in_pool = True
+
+
+_query_pool = ThreadPoolExecutor(
+    max_workers=QUERY_WORKERS,
+    thread_name_prefix="findthatpostcode-query",
+    initializer=_mark_query_thread,
+)
+
+
+def run_queries(queries):
+    """
+    Run a dict of independent queries concurrently
+
+    Each query is a function with no arguments. Returns a dict of the results
+    and a dict of the time each query took in seconds. Queries started from a
+    thread in the pool (or a single query) are run one after the other, so
+    the pool can't deadlock waiting for itself.
+    """
+    timings = {}
+
+    def timed(name, func):
+        def run():
+            start = time.perf_counter()
+            try:
+                return func()
+            finally:
+                timings[name] = time.perf_counter() - start
+
+        return run
+
+    if len(queries) <= 1 or getattr(_query_thread, "in_pool", False):
+        return {name: timed(name, func)() for name, func in queries.items()}, timings
+
+    futures = {
+        name: _query_pool.submit(timed(name, func)) for name, func in queries.items()
+    }
+    return {name: future.result() for name, future in futures.items()}, timings
+
+
+def in_uk_bbox(lat, lon):
+    try:
+        return (
+            UK_BBOX["min_lat"] <= float(lat) <= UK_BBOX["max_lat"]
+            and UK_BBOX["min_lon"] <= float(lon) <= UK_BBOX["max_lon"]
+        )
+    except (TypeError, ValueError):
+        return False
+
+
+def nearest_search(
+    es, index, lat, lon, size=10, query=None, radii=NEAREST_SEARCH_RADII, **kwargs
+):
+    """
+    Search for the documents nearest to a point
+
+    Rather than sorting the whole index by distance, the search is first
+    limited to documents within a small radius of the point. The radius is
+    widened until at least `size` documents are found, and only if that
+    fails is the whole index sorted. Returns the result of the last search.
+    """
+    query = query or {"match_all": {}}
+    location = {"lat": float(lat), "lon": float(lon)}
+    sort = [{"_geo_distance": {"location": location, "unit": "m"}}]
+    for radius in [*radii, None]:
+        if radius is None:
+            body = {"query": query, "sort": sort}
+        else:
+            body = {
+                "query": {
+                    "bool": {
+                        "must": [query],
+                        "filter": [
+                            {
+                                "geo_distance": {
+                                    "distance": "{}m".format(radius),
+                                    "location": location,
+                                }
+                            }
+                        ],
+                    }
+                },
+                "sort": sort,
+            }
+        result = es.search(index=index, body=body, size=size, **kwargs)
+        if len(result.get("hits", {}).get("hits", [])) >= size:
+            break
+    return result
+
 
 class Controller:
     template = None
@@ -30,6 +136,7 @@ class Controller:
         self.relationships = {}
         self.id = self.parse_id(id)
         self.pagination = None
+        self.timings = {}
         if data:
             self.found = True
             self.attributes = self.process_attributes(data)
@@ -129,7 +236,8 @@ class Controller:
         return []
 
     # role = top|identifier|embedded
-    def toJSON(self, role="top"):
+    # fields = sparse fieldsets to return for each type, eg {"areas": {"name"}}
+    def toJSON(self, role="top", fields=None):
         json = {}
         included = []
 
@@ -143,14 +251,22 @@ class Controller:
         if role == "identifer":
             return (json, included)
 
+        relationships = self.relationships
         json["attributes"] = self.attributes
+        if fields and self.url_slug in fields:
+            json["attributes"] = {
+                k: v for k, v in self.attributes.items() if k in fields[self.url_slug]
+            }
+            relationships = {
+                k: v for k, v in relationships.items() if k in fields[self.url_slug]
+            }
         json["links"] = {"self": self.url(), "html": self.url("html")}
 
         # add relationship information
-        if len(self.relationships) > 0:
+        if len(relationships) > 0:
             json["relationships"] = {}
 
-        for i, items in self.relationships.items():
+        for i, items in relationships.items():
             json["relationships"][i] = {
                 "links": {
                     "self": self.relationship_url(i, False),
@@ -163,16 +279,16 @@ class Controller:
                     j.toJSON("identifer")[0] for j in items
                 ]
                 if role != "embedded":
-                    included += [j.toJSON("embedded")[0] for j in items]
+                    included += [j.toJSON("embedded", fields)[0] for j in items]
             elif hasattr(items, "toJSON"):
                 json["relationships"][i]["data"] = items.toJSON("identifer")[0]
                 if role != "embedded":
-                    included.append(items.toJSON("embedded")[0])
+                    included.append(items.toJSON("embedded", fields)[0])
 
         return (json, included)
 
-    def topJSON(self):
-        json = self.toJSON()
+    def topJSON(self, fields=None):
+        json = self.toJSON(fields=fields)
         if not self.found:
             return {
                 "errors": [
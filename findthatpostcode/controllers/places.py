@@ -1,6 +1,6 @@
 import re
 
-from findthatpostcode.controllers.controller import Controller
+from findthatpostcode.controllers.controller import Controller, nearest_search
 
 
 class Place(Controller):
@@ -21,8 +21,19 @@ class Place(Controller):
         return "<Place {}>".format(self.id)
 
     @classmethod
-    def get_from_es(cls, id, es, es_config=None, examples_count=5, recursive=True):
-        from findthatpostcode.controllers.areas import Area
+    def get_from_es(
+        cls, id, es, es_config=None, examples_count=5, recursive=True, include=None
+    ):
+        """
+        Fetch a place and its related areas, postcodes and places
+
+        `include` is a list of the relationships to fetch (by default all
+        relationships are fetched).
+        """
+        from findthatpostcode.controllers.areas import (
+            AREA_CODE_REGEX,
+            get_areas_by_code,
+        )
 
         if not es_config:
             es_config = {}
@@ -40,20 +51,26 @@ class Place(Controller):
             "nearest_places": [],
             "areas": [],
         }
-        for k, v in data.get("_source", {}).get("areas", {}).items():
-            if isinstance(v, str) and re.match(r"[A-Z][0-9]{8}", v):
-                area = Area.get_from_es(v, es, examples_count=0)
-                if area.found:
+        if include is None or "areas" in include:
+            area_codes = [
+                v
+                for v in data.get("_source", {}).get("areas", {}).values()
+                if isinstance(v, str) and re.match(AREA_CODE_REGEX, v)
+            ]
+            areas = get_areas_by_code(area_codes, es)
+            for v in area_codes:
+                if v in areas:
                     # data["_source"]["areas"][k + "_name"] =
                     # area.attributes.get("name")
-                    relationships["areas"].append(area)
+                    relationships["areas"].append(areas[v])
 
-        if examples_count:
+        if examples_count and (include is None or "nearest_postcodes" in include):
             relationships["nearest_postcodes"] = cls.get_nearest_postcodes(
                 data.get("_source", {}).get("location"),
                 es,
                 examples_count=examples_count,
             )
+        if examples_count and (include is None or "nearest_places" in include):
             relationships["nearest_places"] = cls.get_nearest_places(
                 data.get("_source", {}).get("location"), es, examples_count=10
             )
@@ -75,42 +92,27 @@ class Place(Controller):
 
         if not location:
             return []
-        query = {
-            "query": {"match_all": {}},
-            "sort": [
-                {
-                    "_geo_distance": {
-                        "location": {
-                            "lat": location.get("lat"),
-                            "lon": location.get("lon"),
-                        },
-                        "unit": "m",
-                    }
-                }
-            ],
-        }
-        example = es.search(index="geo_postcode", body=query, size=examples_count)
+        example = nearest_search(
+            es,
+            "geo_postcode",
+            location.get("lat"),
+            location.get("lon"),
+            size=examples_count,
+        )
         return [Postcode(e["_id"], e["_source"]) for e in example["hits"]["hits"]]
 
     @staticmethod
     def get_nearest_places(location, es, examples_count=10):
         if not location:
             return []
-        query = {
-            "query": {"match": {"descnm": {"query": "LOC"}}},
-            "sort": [
-                {
-                    "_geo_distance": {
-                        "location": {
-                            "lat": location.get("lat"),
-                            "lon": location.get("lon"),
-                        },
-                        "unit": "m",
-                    }
-                }
-            ],
-        }
-        example = es.search(index="geo_placename", body=query, size=examples_count)
+        example = nearest_search(
+            es,
+            "geo_placename",
+            location.get("lat"),
+            location.get("lon"),
+            size=examples_count,
+            query={"match": {"descnm": {"query": "LOC"}}},
+        )
         return [Place(e["_id"], e["_source"]) for e in example["hits"]["hits"]]
 
     def get_area(self, areatype):
@@ -120,3 +122,26 @@ class Place(Controller):
         for a in self.relationships["areas"]:
             if a.relationships["areatype"].id == areatype:
                 return a
+
+
+def get_places_by_code(codes, es, es_config=None):
+    """
+    Fetch a list of places using a single request
+
+    Returns a dictionary of the places that were found, keyed by place code,
+    in the same order as the codes given.
+    """
+    if not es_config:
+        es_config = {}
+    codes = list(dict.fromkeys(c for c in codes if c))
+    if not codes:
+        return {}
+    result = es.mget(
+        index=es_config.get("es_index", Place.es_index),
+        body={"ids": codes},
+    )
+    return {
+        p["_id"]: Place(p["_id"], p["_source"])
+        for p in result.get("docs", [])
+        if p.get("found")
+    }
@@ -1,7 +1,42 @@
+import os
+import threading
+import time
 from urllib.parse import urlunparse
 
-from findthatpostcode.controllers.controller import Controller
+from flask import current_app, has_app_context
+from shapely.geometry import shape
+
+from findthatpostcode.boundaries import NOT_LOADED
+from findthatpostcode.cache import MISSING, boundary_cache
+from findthatpostcode.controllers.areas import (
+    S3_ERRORS,
+    fetch_boundary,
+    get_areas_by_code,
+    get_boundary_manifest,
+)
+from findthatpostcode.controllers.controller import (
+    GEOJSON_TYPES,
+    Controller,
+    in_uk_bbox,
+    nearest_search,
+    run_queries,
+)
 from findthatpostcode.controllers.postcodes import Postcode
+from findthatpostcode.db import (
+    get_boundaries_version,
+    get_data_version,
+    get_db,
+    get_s3_client,
+)
+from findthatpostcode.metadata import AREA_TYPES, ENTITIES
+from findthatpostcode.spatial import GridIndex, PolygonIndex
+
+
+ACTIVE_POSTCODES_QUERY = {"bool": {"must_not": {"exists": {"field": "doterm"}}}}
+
+# seconds to wait before building the point-in-polygon index again, if some
+# of the boundaries couldn't be loaded last time
+POLYGON_INDEX_RETRY = 300
 
 
 class Point(Controller):
@@ -18,58 +53,61 @@ class Point(Controller):
     def __repr__(self):
         return "<Point {}, {}>".format(self.id[0], self.id[1])
 
-    @staticmethod
-    def get_nearest_postcodes_query(lat, lon):
-        return {
-            "query": {"bool": {"must_not": {"exists": {"field": "doterm"}}}},
-            "sort": [
-                {"_geo_distance": {"location": {"lat": lat, "lon": lon}, "unit": "m"}}
-            ],
-        }
-
     @classmethod
-    def get_from_es(cls, id, es, es_config=None):
+    def get_from_es(cls, id, es, es_config=None, include=None):
+        """
+        Find the nearest postcode to a point
+
+        The nearest postcode is always fetched. `include` can contain paths
+        like "nearest_postcode.areas" to choose which of the postcode's
+        relationships are fetched (by default all relationships are fetched).
+        If the nearest-postcode index has been built then it is used to find
+        the postcode, and elasticsearch is only used to fetch its data.
+        Points outside the UK are rejected without looking for a postcode.
+        """
         if not es_config:
             es_config = {}
 
-        query = cls.get_nearest_postcodes_query(id[0], id[1])
+        if not in_uk_bbox(id[0], id[1]):
+            return cls(id, data={"distance_from_postcode": None, "outside_uk": True})
 
-        data = es.search(
-            index=es_config.get("es_index", cls.es_index),
-            body=query,
-            ignore=[404],
-            size=1,
-            _source_excludes=es_config.get("_source_exclude", []),
+        [(postcode_id, distance)] = get_nearest_postcodes(
+            [id], es, es_config, max_distance=cls.max_distance
         )
+        if postcode_id is None:
+            return cls(id, data={"distance_from_postcode": None, "outside_uk": True})
 
-        if data["hits"]["total"] == 0:
-            return cls(id)
+        postcode_include = None
+        if include is not None:
+            postcode_include = [
+                i.split(".", 1)[1] for i in include if i.startswith("nearest_postcode.")
+            ]
 
-        postcode = data["hits"]["hits"][0]
         return cls(
             id,
-            data={"distance_from_postcode": postcode["sort"][0]},
-            nearest_postcode=Postcode.get_from_es(postcode["_id"], es),
-        )
-
-    def get_by_id(self, lat, lon):
-        self.set_from_data(
-            {"_id": "{},{}".format(lat, lon), "_source": {"lat": lat, "lon": lon}}
-        )
-        query = self.get_nearest_postcodes_query(lat, lon)
-        result = self.es.search(
-            index=self.config.get("es_index", "postcode"), body=query, size=1
+            data={"distance_from_postcode": distance},
+            nearest_postcode=Postcode.get_from_es(
+                postcode_id, es, include=postcode_include
+            ),
         )
-        if result["hits"]["total"] > 0:
-            postcode = result["hits"]["hits"][0]
-            self.relationships["nearest_postcode"] = Postcode(
-                self.config
-            ).set_from_data(postcode)
-            self.attributes["distance_from_postcode"] = postcode["sort"][0]
 
-    def get_errors(self):
-        if self.attributes.get("distance_from_postcode") > self.max_distance:
-            self.found = False
+    def outside_uk_errors(self):
+        """
+        Errors for points that are outside the UK or far from any postcode
+        """
+        if self.attributes.get("outside_uk"):
+            return [
+                {
+                    "status": "400",
+                    "code": "point_outside_uk",
+                    "title": "Point is outside the UK",
+                    "detail": (
+                        "Point ({}, {}) is outside the area covered by UK postcodes"
+                    ).format(*self.id),
+                }
+            ]
+        distance = self.attributes.get("distance_from_postcode")
+        if distance is not None and distance > self.max_distance:
             return [
                 {
                     "status": "400",
@@ -80,10 +118,17 @@ class Point(Controller):
                         "Are you sure this point is in the UK?"
                     ).format(
                         self.relationships["nearest_postcode"].id,
-                        (self.attributes.get("distance_from_postcode") / 1000),
+                        (distance / 1000),
                     ),
                 }
             ]
+        return []
+
+    def get_errors(self):
+        errors = self.outside_uk_errors()
+        if errors:
+            self.found = False
+            return errors
         if not self.found:
             return [
                 {
@@ -94,29 +139,15 @@ class Point(Controller):
             ]
         return []
 
-    def topJSON(self):
-        # check if postcode is too far away
-        if self.attributes.get("distance_from_postcode") > self.max_distance:
+    def topJSON(self, fields=None):
+        # check if the point is outside the UK
+        errors = self.outside_uk_errors()
+        if errors:
             self.found = False
-            return {
-                "errors": [
-                    {
-                        "status": "400",
-                        "code": "point_outside_uk",
-                        "title": "Nearest postcode is more than 10km away",
-                        "detail": (
-                            "Nearest postcode ({}) is more than 10km away ({:,.1f}km). "
-                            "Are you sure this point is in the UK?"
-                        ).format(
-                            self.relationships["nearest_postcode"].id,
-                            (self.attributes.get("distance_from_postcode") / 1000),
-                        ),
-                    }
-                ]
-            }
-
-        json = super().topJSON()
-        postcode_json = self.relationships["nearest_postcode"].toJSON()
+            return {"errors": errors}
+
+        json = super().topJSON(fields)
+        postcode_json = self.relationships["nearest_postcode"].toJSON(fields=fields)
         json["included"] += postcode_json[1]
         return json
 
@@ -162,3 +193,269 @@ class Point(Controller):
                 "",
             ]
         )
+
+
+class PostcodeIndexLoader:
+    """
+    The nearest-postcode index written by `flask import nspl`
+
+    The file is memory-mapped, so all the worker processes on a server share
+    the same pages. It is reopened when the file changes.
+    """
+
+    def __init__(self):
+        self.index = None
+        self.key = None
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        key = (path, stat.st_ino, stat.st_mtime_ns)
+        if self.key != key:
+            with self._lock:
+                if self.key != key:
+                    self.index = GridIndex.load(path)
+                    self.key = key
+        return self.index
+
+
+postcode_index = PostcodeIndexLoader()
+
+
+def get_postcode_index():
+    """
+    The nearest-postcode index, or None if it hasn't been built
+    """
+    path = current_app.config["POSTCODE_INDEX_PATH"]
+    if not path:
+        return None
+    return postcode_index.get(path)
+
+
+def get_nearest_postcodes(points, es, es_config=None, max_distance=None):
+    """
+    Find the nearest active postcode to each of a list of (lat, lon) points
+
+    Uses the nearest-postcode index if it exists, which looks up all the
+    points in one vectorised query. Otherwise elasticsearch is searched
+    for each point concurrently. Returns a (postcode, distance in metres)
+    tuple for each point, or (None, None) if no postcode was found within
+    `max_distance` metres.
+    """
+    if not points:
+        return []
+    index = get_postcode_index() if has_app_context() else None
+    if index is not None:
+        nearest, distances = index.nearest(
+            [p[0] for p in points], [p[1] for p in points], max_distance=max_distance
+        )
+        found = [
+            (index.ids[i].decode("utf8"), float(d)) if i >= 0 else (None, None)
+            for i, d in zip(nearest[:, 0], distances[:, 0])
+        ]
+    else:
+        if not es_config:
+            es_config = {}
+
+        def search(lat, lon):
+            data = nearest_search(
+                es,
+                es_config.get("es_index", Point.es_index),
+                lat,
+                lon,
+                size=1,
+                query=ACTIVE_POSTCODES_QUERY,
+                ignore=[404],
+                _source_includes=[],
+            )
+            if not data.get("hits", {}).get("hits"):
+                return (None, None)
+            hit = data["hits"]["hits"][0]
+            return (hit["_id"], float(hit["sort"][0]))
+
+        unique_points = list(dict.fromkeys(points))
+        results, _ = run_queries({p: (lambda p=p: search(*p)) for p in unique_points})
+        found = [results[p] for p in points]
+
+    # distances are given to the nearest 10cm, however they were found
+    return [
+        (postcode, round(distance, 1))
+        if postcode is not None and (max_distance is None or distance <= max_distance)
+        else (None, None)
+        for postcode, distance in found
+    ]
+
+
+class PolygonIndexLoader:
+    """
+    The point-in-polygon index for the area types in POLYGON_INDEX_AREATYPES
+
+    The index is built from the boundaries in S3 the first time it is
+    needed. When the data version changes a new index is built in the
+    background, and the old one is used until it is ready. If the manifest
+    or any of the boundaries couldn't be loaded the index is used but not
+    kept for the data version, so it is built again after
+    `POLYGON_INDEX_RETRY` seconds.
+    """
+
+    def __init__(self):
+        self.index = None
+        self.version = NOT_LOADED
+        self.retry_after = None
+        self._lock = threading.Lock()
+
+    def get(self, app, version):
+        if self.version == version:
+            return self.index
+        if self.index is not None:
+            if self.retry_after is not None and time.monotonic() < self.retry_after:
+                return self.index
+            if not self._lock.locked():
+                threading.Thread(
+                    target=self.load, args=(app, version), daemon=True
+                ).start()
+            return self.index
+        return self.load(app, version)
+
+    def load(self, app, version):
+        with self._lock:
+            if self.version != version:
+                with app.app_context():
+                    self.index, complete = build_polygon_index(
+                        app.config["POLYGON_INDEX_AREATYPES"]
+                    )
+                    app.logger.info(
+                        "Built point-in-polygon index of %s areas in %.1fs, "
+                        "using about %.0fMB",
+                        len(self.index),
+                        self.index.build_time,
+                        self.index.memory / 1024**2,
+                    )
+                if complete:
+                    self.version = version
+                    self.retry_after = None
+                else:
+                    self.retry_after = time.monotonic() + POLYGON_INDEX_RETRY
+        return self.index
+
+
+polygon_index = PolygonIndexLoader()
+
+
+def build_polygon_index(areatypes):
+    """
+    Build a point-in-polygon index of all the areas of some types
+
+    The areas are found using the boundary manifest, and their full
+    boundaries downloaded concurrently. Returns the index, and whether all
+    the boundaries were loaded.
+    """
+    manifest = get_boundary_manifest()
+    if not manifest.loaded:
+        current_app.logger.warning(
+            "No boundary manifest found, so the point-in-polygon index is empty"
+        )
+        # look for the manifest again next time
+        manifest.reset()
+    boundary_cache.set_version(get_boundaries_version(get_db()))
+    client = get_s3_client()
+    bucket = current_app.config["S3_BUCKET"]
+    prefixes = {e for a in areatypes for e in AREA_TYPES.get(a, {}).get("entities", [])}
+    codes = sorted(c for c in manifest.boundaries if c[0:3] in prefixes)
+
+    def get_boundary(code):
+        try:
+            return fetch_boundary(code, None, manifest, client, bucket)
+        except S3_ERRORS:
+            return MISSING
+
+    boundaries, _ = run_queries(
+        {code: (lambda c=code: get_boundary(c)) for code in codes}
+    )
+
+    start = time.perf_counter()
+    index_codes = []
+    geometries = []
+    missing = [code for code in codes if boundaries[code] is MISSING]
+    if missing:
+        current_app.logger.warning(
+            "%s boundaries couldn't be loaded for the point-in-polygon index",
+            len(missing),
+        )
+    for code in codes:
+        boundary = boundaries[code]
+        if not boundary or boundary is MISSING:
+            continue
+        index_codes.append(code)
+        geometries.append(
+            shape(
+                {
+                    **boundary,
+                    "type": GEOJSON_TYPES.get(boundary["type"], boundary["type"]),
+                }
+            )
+        )
+    index = PolygonIndex(index_codes, geometries)
+    index.build_time += time.perf_counter() - start
+    return index, manifest.loaded and not missing
+
+
+def get_polygon_index():
+    """
+    The point-in-polygon index, or None if it isn't enabled
+    """
+    app = current_app._get_current_object()
+    if not app.config["POLYGON_INDEX_AREATYPES"]:
+        return None
+    return polygon_index.get(app, get_data_version(get_db()))
+
+
+def start_polygon_index(app):
+    """
+    Build the point-in-polygon index in the background when the app starts
+    """
+    if not app.config["POLYGON_INDEX_AREATYPES"]:
+        return
+
+    def build():
+        with app.app_context():
+            get_polygon_index()
+
+    threading.Thread(target=build, daemon=True).start()
+
+
+def get_areas_containing(points, index, es):
+    """
+    Find the areas that contain each of a list of (lat, lon) points
+
+    Returns a dict for each point with the code and name of the area of each
+    type, like the fields of a postcode. Where more than one area of a type
+    contains a point, active areas are preferred.
+    """
+    lats = [p[0] for p in points]
+    lons = [p[1] for p in points]
+    containing = index.containing(lats, lons) if points else []
+    areas = get_areas_by_code(
+        {code for codes in containing for code in codes}, es, fields=["name", "active"]
+    )
+
+    def preference(code):
+        area = areas.get(code)
+        return (not (area and area.attributes.get("active")), code)
+
+    results = []
+    for codes in containing:
+        result = {}
+        for code in sorted(codes, key=preference):
+            areatype = ENTITIES.get(code[0:3])
+            if not areatype or areatype in result:
+                continue
+            result[areatype] = code
+            result[areatype + "_name"] = (
+                areas[code].attributes.get("name") if code in areas else None
+            )
+        results.append(result)
+    return results
@@ -3,9 +3,9 @@ from datetime import datetime
 
 from dictlib import dig_get
 
-from findthatpostcode.controllers.areas import Area
-from findthatpostcode.controllers.controller import Controller
-from findthatpostcode.controllers.places import Place
+from findthatpostcode.controllers.areas import AREA_CODE_REGEX, get_areas_by_code
+from findthatpostcode.controllers.controller import Controller, nearest_search
+from findthatpostcode.controllers.places import Place, get_places_by_code
 from findthatpostcode.metadata import (
     OAC11_CODE,
     OTHER_CODES,
@@ -25,13 +25,21 @@ class Postcode(Controller):
         super().__init__(id, data)
         if pcareas:
             self.relationships["areas"] = pcareas
+        if places is not None:
             self.relationships["nearest_places"] = places
 
     def __repr__(self):
         return "<Postcode {}>".format(self.id)
 
     @classmethod
-    def get_from_es(cls, id, es, es_config=None):
+    def get_from_es(cls, id, es, es_config=None, include=None):
+        """
+        Fetch a postcode and its related areas and places
+
+        `include` is a list of the relationships to fetch (by default all
+        relationships are fetched). The names of areas are only added to the
+        attributes if the "areas" relationship is included.
+        """
         if not es_config:
             es_config = {}
         data = es.get(
@@ -47,14 +55,29 @@ class Postcode(Controller):
 
         pcareas = []
         postcode = data.get("_source")
-        for k in list(postcode.keys()):
-            if isinstance(postcode[k], str) and re.match(r"[A-Z][0-9]{8}", postcode[k]):
-                area = Area.get_from_es(postcode[k], es, examples_count=0)
-                if area.found:
+        if include is None or "areas" in include:
+            area_fields = [
+                k
+                for k, v in postcode.items()
+                if isinstance(v, str) and re.match(AREA_CODE_REGEX, v)
+            ]
+            areas = get_areas_by_code([postcode[k] for k in area_fields], es)
+            for k in area_fields:
+                area = areas.get(postcode[k])
+                if area:
                     postcode[k + "_name"] = area.attributes.get("name")
                     pcareas.append(area)
 
-        places = cls.get_nearest_places(data.get("_source", {}).get("location"), es, 10)
+        # nearest places are stored on the postcode by `flask import nearest_places`
+        nearest_places = postcode.pop("nearest_places", None)
+        places = None
+        if include is None or "nearest_places" in include:
+            if nearest_places is not None:
+                places = list(
+                    get_places_by_code([p["id"] for p in nearest_places], es).values()
+                )
+            else:
+                places = cls.get_nearest_places(postcode.get("location"), es, 10)
         return cls(data.get("_id"), data.get("_source"), pcareas, places)
 
     def process_attributes(self, postcode):
@@ -92,21 +115,14 @@ class Postcode(Controller):
     def get_nearest_places(location, es, examples_count=10):
         if not location:
             return []
-        query = {
-            "query": {"match": {"descnm": {"query": "LOC"}}},
-            "sort": [
-                {
-                    "_geo_distance": {
-                        "location": {
-                            "lat": location.get("lat"),
-                            "lon": location.get("lon"),
-                        },
-                        "unit": "m",
-                    }
-                }
-            ],
-        }
-        example = es.search(index="geo_placename", body=query, size=examples_count)
+        example = nearest_search(
+            es,
+            "geo_placename",
+            location.get("lat"),
+            location.get("lon"),
+            size=examples_count,
+            query={"match": {"descnm": {"query": "LOC"}}},
+        )
         return [Place(e["_id"], e["_source"]) for e in example["hits"]["hits"]]
 
     def get_attribute(self, attr):
@@ -118,7 +134,7 @@ class Postcode(Controller):
         if attr in self.attributes:
             return self.attributes.get(attr)
 
-        for a in self.relationships["areas"]:
+        for a in self.relationships.get("areas", []):
             if attr.endswith("_name"):
                 if a.relationships["areatype"].id == attr[:-5]:
                     return a.attributes.get("name")
@@ -132,11 +148,11 @@ class Postcode(Controller):
         """
         area_id = self.attributes.get(areatype)
         if area_id:
-            for a in self.relationships["areas"]:
+            for a in self.relationships.get("areas", []):
                 if a.id == area_id:
                     return a
 
-        for a in self.relationships["areas"]:
+        for a in self.relationships.get("areas", []):
             if a.relationships["areatype"].id == areatype:
                 return a
 
@@ -173,8 +189,8 @@ class Postcode(Controller):
 
         return "%s %s" % ("".join(first_part), "".join(last_part))
 
-    def toJSON(self, role="top"):
-        json = super().toJSON(role)
+    def toJSON(self, role="top", fields=None):
+        json = super().toJSON(role, fields)
         for i in self.date_fields:
             if json[0].get("attributes", {}).get(i) and isinstance(
                 json[0]["attributes"][i], datetime
@@ -1,4 +1,5 @@
 import datetime
+import time
 
 import click
 from boto3 import session
@@ -12,11 +13,25 @@ INDEXES = {
         "properties": {
             "location": {"type": "geo_point"},
             "hash": {"type": "text", "index_prefixes": {}},
+            "nearest_places": {"type": "object", "enabled": False},
         }
     },
     "geo_placename": {"properties": {"location": {"type": "geo_point"}}},
-    "geo_area": {"properties": {"boundary": {"type": "geo_shape"}}},
+    "geo_area": {
+        "properties": {
+            "boundary": {"type": "geo_shape"},
+            "children": {"type": "object", "enabled": False},
+            "example_postcodes": {"type": "object", "enabled": False},
+        }
+    },
+    "geo_release": {"properties": {"updated": {"type": "date"}}},
 }
+RELEASE_INDEX = "geo_release"
+RELEASE_ID = "current"
+RELEASE_CHECK_INTERVAL = 60
+
+# the current data release is checked at most once per interval per process
+_release = {"data": {}, "checked": None}
 
 
 def get_db():
@@ -50,6 +65,58 @@ def init_db(reset=False):
         )
 
 
+def get_data_release(es):
+    """
+    Get details of the data release currently loaded into elasticsearch
+    """
+    now = time.monotonic()
+    if (
+        _release["checked"] is None
+        or now - _release["checked"] > RELEASE_CHECK_INTERVAL
+    ):
+        result = es.get(index=RELEASE_INDEX, id=RELEASE_ID, ignore=[404])
+        _release["data"] = result.get("_source") or {}
+        _release["checked"] = now
+    return _release["data"]
+
+
+def get_data_version(es):
+    return get_data_release(es).get("version")
+
+
+def get_boundaries_version(es):
+    """
+    The version of the boundaries, which only changes when they are imported
+
+    Returns None if no boundaries import has been recorded.
+    """
+    imported = get_data_release(es).get("datasets", {}).get("boundaries")
+    if not imported:
+        return None
+    return datetime.datetime.fromisoformat(imported).strftime("%Y%m%d%H%M%S")
+
+
+def record_release(es, dataset):
+    """
+    Record that a dataset has been imported, which creates a new data version
+    """
+    now = datetime.datetime.now()
+    es.update(
+        index=RELEASE_INDEX,
+        id=RELEASE_ID,
+        body={
+            "doc": {
+                "version": now.strftime("%Y%m%d%H%M%S"),
+                "updated": now,
+                "datasets": {dataset: now},
+            },
+            "doc_as_upsert": True,
+        },
+    )
+    _release["checked"] = None
+    click.echo("[release] recorded import of %s" % dataset)
+
+
 def get_log_db():
     if "log_db" not in g:
         if current_app.config.get("LOGGING_DB"):
@@ -0,0 +1,387 @@
+"""
+Compact encodings of GeoJSON features: TopoJSON and FlatGeobuf
+"""
+
+import datetime
+import json
+import struct
+
+# TopoJSON
+
+
+def to_topojson(features, object_name="areas", quantization=1e6):
+    """
+    Encode a list of GeoJSON polygon features as TopoJSON
+
+    Coordinates are quantized onto a grid, and the edges shared between
+    neighbouring areas are only stored once.
+    """
+    rings = [
+        ring
+        for feature in features
+        for polygon in _polygons(feature.get("geometry"))
+        for ring in polygon
+    ]
+    all_points = [p for ring in rings for p in ring]
+    if not all_points:
+        return {
+            "type": "Topology",
+            "objects": {object_name: {"type": "GeometryCollection", "geometries": []}},
+            "arcs": [],
+        }
+
+    x0 = min(p[0] for p in all_points)
+    y0 = min(p[1] for p in all_points)
+    x1 = max(p[0] for p in all_points)
+    y1 = max(p[1] for p in all_points)
+    kx = (x1 - x0) / (quantization - 1) if x1 > x0 else 1
+    ky = (y1 - y0) / (quantization - 1) if y1 > y0 else 1
+
+    def quantize(ring):
+        points = []
+        for x, y, *_ in ring:
+            point = (round((x - x0) / kx), round((y - y0) / ky))
+            if not points or points[-1] != point:
+                points.append(point)
+        if points[0] != points[-1]:
+            points.append(points[0])
+        return points
+
+    # find the points where rings meet and then diverge
+    quantized = {}
+    neighbours = {}
+    junctions = set()
+    for ring in rings:
+        points = quantized.setdefault(id(ring), quantize(ring))[:-1]
+        for i, point in enumerate(points):
+            pair = (points[i - 1], points[(i + 1) % len(points)])
+            seen = neighbours.setdefault(point, pair)
+            if seen != pair and seen != pair[::-1]:
+                junctions.add(point)
+
+    arcs = []
+    arc_index = {}
+
+    def add_arc(points):
+        key = tuple(points)
+        if key in arc_index:
+            return arc_index[key]
+        if key[::-1] in arc_index:
+            return ~arc_index[key[::-1]]
+        arc_index[key] = len(arcs)
+        arcs.append(points)
+        return arc_index[key]
+
+    def ring_arcs(ring):
+        points = quantized[id(ring)][:-1]
+        starts = [i for i, p in enumerate(points) if p in junctions]
+        if not starts:
+            # a ring without junctions is a single arc, starting from the
+            # lowest point so that identical rings are matched
+            start = points.index(min(points))
+            points = points[start:] + points[:start]
+            return [add_arc(points + [points[0]])]
+        points = points[starts[0] :] + points[: starts[0] + 1]
+        result = []
+        arc = [points[0]]
+        for point in points[1:]:
+            arc.append(point)
+            if point in junctions:
+                result.append(add_arc(arc))
+                arc = [point]
+        return result
+
+    geometries = []
+    for feature in features:
+        polygons = [
+            [ring_arcs(ring) for ring in polygon]
+            for polygon in _polygons(feature.get("geometry"))
+        ]
+        geometry = {"properties": feature.get("properties", {})}
+        if feature.get("id") is not None:
+            geometry["id"] = feature["id"]
+        if not polygons:
+            geometry["type"] = None
+        elif feature["geometry"]["type"] == "Polygon":
+            geometry["type"] = "Polygon"
+            geometry["arcs"] = polygons[0]
+        else:
+            geometry["type"] = "MultiPolygon"
+            geometry["arcs"] = polygons
+        geometries.append(geometry)
+
+    return {
+        "type": "Topology",
+        "bbox": [x0, y0, x1, y1],
+        "transform": {"scale": [kx, ky], "translate": [x0, y0]},
+        "objects": {
+            object_name: {"type": "GeometryCollection", "geometries": geometries}
+        },
+        "arcs": [_delta_encode(arc) for arc in arcs],
+    }
+
+
+def _polygons(geometry):
+    if not geometry:
+        return []
+    if geometry["type"] == "Polygon":
+        return [geometry["coordinates"]]
+    if geometry["type"] == "MultiPolygon":
+        return geometry["coordinates"]
+    return []
+
+
+def _delta_encode(points):
+    result = [list(points[0])]
+    for previous, point in zip(points, points[1:]):
+        result.append([point[0] - previous[0], point[1] - previous[1]])
+    return result
+
+
+# FlatGeobuf
+#
+# A FlatGeobuf file is a magic number, a header and then the features, each
+# encoded as a size-prefixed flatbuffer. See https://flatgeobuf.org/ for the
+# schema. No spatial index is written.
+
+FGB_MAGIC = b"fgb\x03fgb\x00"
+
+FGB_GEOMETRY_TYPES = {"Polygon": 3, "MultiPolygon": 6}
+
+FGB_BOOL = 2
+FGB_LONG = 7
+FGB_DOUBLE = 10
+FGB_STRING = 11
+FGB_JSON = 12
+FGB_DATETIME = 13
+
+_SCALARS = {
+    "bool": ("<B", 1),
+    "u8": ("<B", 1),
+    "u16": ("<H", 2),
+    "i32": ("<i", 4),
+    "u32": ("<I", 4),
+    "u64": ("<Q", 8),
+}
+
+
+def to_flatgeobuf(features, name="areas", metadata=None):
+    """
+    Encode a list of GeoJSON polygon features as FlatGeobuf
+
+    `metadata` is stored in the header as JSON.
+    """
+    features = [f for f in features if f.get("geometry", {}).get("type")]
+    geometry_types = {f["geometry"]["type"] for f in features}
+    geometry_type = "Polygon" if geometry_types == {"Polygon"} else "MultiPolygon"
+
+    # a column for every property, with a type that fits all its values
+    value_types = {}
+    for feature in features:
+        for k, v in feature.get("properties", {}).items():
+            types = value_types.setdefault(k, set())
+            if v is not None:
+                types.add(_value_type(v))
+    columns = {k: _column_type(types) for k, types in value_types.items() if types}
+    column_index = {k: i for i, k in enumerate(columns)}
+
+    points = [
+        p
+        for f in features
+        for polygon in _polygons(f["geometry"])
+        for ring in polygon
+        for p in ring
+    ]
+    envelope = None
+    if points:
+        envelope = [
+            min(p[0] for p in points),
+            min(p[1] for p in points),
+            max(p[0] for p in points),
+            max(p[1] for p in points),
+        ]
+
+    header = [
+        (0, "string", name),
+        (1, "[f64]", envelope),
+        (2, "u8", FGB_GEOMETRY_TYPES[geometry_type]),
+        (
+            7,
+            "[table]",
+            [[(0, "string", k), (1, "u8", t)] for k, t in columns.items()],
+        ),
+        (8, "u64", len(features)),
+        (9, "u16", 0),
+        (10, "table", [(0, "string", "EPSG"), (1, "i32", 4326)]),
+        (13, "string", json.dumps(metadata) if metadata else None),
+    ]
+    output = bytearray(FGB_MAGIC)
+    output.extend(_size_prefixed(header))
+    for feature in features:
+        output.extend(
+            _size_prefixed(
+                [
+                    (0, "table", _fgb_geometry(feature["geometry"], geometry_type)),
+                    (
+                        1,
+                        "[u8]",
+                        _fgb_properties(
+                            feature.get("properties", {}), columns, column_index
+                        ),
+                    ),
+                ]
+            )
+        )
+    return bytes(output)
+
+
+def _value_type(value):
+    if isinstance(value, bool):
+        return FGB_BOOL
+    if isinstance(value, int):
+        return FGB_LONG
+    if isinstance(value, float):
+        return FGB_DOUBLE
+    if isinstance(value, str):
+        return FGB_STRING
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return FGB_DATETIME
+    return FGB_JSON
+
+
+def _column_type(types):
+    if len(types) == 1:
+        return types.pop()
+    if types == {FGB_LONG, FGB_DOUBLE}:
+        return FGB_DOUBLE
+    return FGB_JSON
+
+
+def _fgb_properties(properties, columns, column_index):
+    output = bytearray()
+    for k, v in properties.items():
+        if v is None or k not in columns:
+            continue
+        column_type = columns[k]
+        if column_type == FGB_BOOL:
+            value = struct.pack("<B", v)
+        elif column_type == FGB_LONG:
+            value = struct.pack("<q", v)
+        elif column_type == FGB_DOUBLE:
+            value = struct.pack("<d", v)
+        else:
+            if column_type == FGB_DATETIME:
+                v = v.isoformat()
+            elif column_type == FGB_JSON:
+                v = json.dumps(v, default=str)
+            encoded = v.encode("utf8")
+            value = struct.pack("<I", len(encoded)) + encoded
+        output.extend(struct.pack("<H", column_index[k]))
+        output.extend(value)
+    return bytes(output)
+
+
+def _fgb_geometry(geometry, geometry_type):
+    polygons = _polygons(geometry)
+    if geometry_type == "Polygon":
+        return _fgb_polygon(polygons[0])
+    return [
+        (6, "u8", FGB_GEOMETRY_TYPES["MultiPolygon"]),
+        (7, "[table]", [_fgb_polygon(polygon) for polygon in polygons]),
+    ]
+
+
+def _fgb_polygon(rings):
+    xy = []
+    ends = []
+    for ring in rings:
+        for x, y, *_ in ring:
+            xy.extend((x, y))
+        ends.append(len(xy) // 2)
+    return [
+        (0, "[u32]", ends if len(ends) > 1 else None),
+        (1, "[f64]", xy),
+        (6, "u8", FGB_GEOMETRY_TYPES["Polygon"]),
+    ]
+
+
+def _size_prefixed(fields):
+    buffer = bytearray(4)
+    root = _write_table(buffer, fields)
+    struct.pack_into("<I", buffer, 0, root)
+    return struct.pack("<I", len(buffer)) + bytes(buffer)
+
+
+def _pad(buffer, size):
+    buffer.extend(b"\0" * (-len(buffer) % size))
+
+
+def _write_table(buffer, fields):
+    """
+    Write a flatbuffer table and return its position
+
+    The vtable is written before the table and all the objects it refers to
+    are written after it, so that every offset points forward.
+    """
+    fields = [f for f in fields if f[2] is not None]
+    slots = max((f[0] for f in fields), default=-1) + 1
+    vtable_size = 4 + 2 * slots
+    _pad(buffer, 2)
+    vtable = len(buffer)
+    buffer.extend(b"\0" * vtable_size)
+
+    _pad(buffer, 8)
+    table = len(buffer)
+    buffer.extend(b"\0" * 4)
+    offsets = {}
+    references = []
+    for slot, kind, value in fields:
+        if kind in _SCALARS:
+            fmt, size = _SCALARS[kind]
+            _pad(buffer, size)
+            offsets[slot] = len(buffer) - table
+            buffer.extend(struct.pack(fmt, value))
+        else:
+            _pad(buffer, 4)
+            offsets[slot] = len(buffer) - table
+            references.append((len(buffer), kind, value))
+            buffer.extend(b"\0" * 4)
+
+    struct.pack_into("<i", buffer, table, table - vtable)
+    struct.pack_into("<HH", buffer, vtable, vtable_size, len(buffer) - table)
+    for slot, offset in offsets.items():
+        struct.pack_into("<H", buffer, vtable + 4 + 2 * slot, offset)
+
+    for position, kind, value in references:
+        target = _write_object(buffer, kind, value)
+        struct.pack_into("<I", buffer, position, target - position)
+    return table
+
+
+def _write_object(buffer, kind, value):
+    if kind == "table":
+        return _write_table(buffer, value)
+
+    _pad(buffer, 4)
+    if kind == "[f64]" and len(buffer) % 8 == 0:
+        # the vector elements need to be 8-byte aligned
+        buffer.extend(b"\0" * 4)
+    position = len(buffer)
+    if kind == "string":
+        encoded = value.encode("utf8")
+        buffer.extend(struct.pack("<I", len(encoded)) + encoded + b"\0")
+    elif kind == "[f64]":
+        buffer.extend(struct.pack("<I%dd" % len(value), len(value), *value))
+    elif kind == "[u32]":
+        buffer.extend(struct.pack("<I%dI" % len(value), len(value), *value))
+    elif kind == "[u8]":
+        buffer.extend(struct.pack("<I", len(value)) + bytes(value))
+    elif kind == "[table]":
+        buffer.extend(struct.pack("<I", len(value)) + b"\0" * (4 * len(value)))
+        for i, table_fields in enumerate(value):
+            element = position + 4 + 4 * i
+            target = _write_table(buffer, table_fields)
+            struct.pack_into("<I", buffer, element, target - element)
+    else:
+        raise ValueError("Unknown flatbuffer type {}".format(kind))
+    return position
@@ -0,0 +1,232 @@
+"""
+Background jobs for adding postcode data to large CSV files
+"""
+
+import codecs
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from findthatpostcode.blueprints.process_csv import iter_csv
+from findthatpostcode.db import get_db
+
+JOB_ID_REGEX = r"^[0-9a-f]{32}$"
+
+QUEUED = "queued"
+RUNNING = "running"
+FINISHED = "finished"
+FAILED = "failed"
+
+
+class CSVJobs:
+    """
+    Queue of CSV files to be processed by a pool of threads
+
+    Each job is a directory holding the uploaded file, the output and a
+    status file. The status is kept on disk so that any worker process on
+    the machine can report the progress of a job, and it is updated after
+    each chunk of rows. Times in the status are seconds since the epoch.
+
+    Jobs are run by a thread in the process that created them, so a job
+    whose process stops is never finished. Queued or running jobs that
+    haven't been updated for `timeout` seconds are reported as failed. While
+    the threads are busy, the jobs waiting in the process's queue are updated
+    as the running jobs make progress, so they don't look stale. Jobs older
+    than `ttl` seconds are deleted when a new job is created.
+
+    `path` needs to be shared by every server process that might be asked
+    about a job. With more than one server (eg several dynos, each with its
+    own filesystem) it must be on shared storage, or jobs must be sent to a
+    single server.
+    """
+
+    def __init__(self, path=None, workers=2, ttl=86400, timeout=3600):
+        self.path = path
+        self.workers = workers
+        self.ttl = ttl
+        self.timeout = timeout
+        self._executor = None
+        self._lock = threading.Lock()
+        self._queued = set()
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers,
+                    thread_name_prefix="findthatpostcode-csv-job",
+                )
+            return self._executor
+
+    def job_dir(self, job_id):
+        if not re.match(JOB_ID_REGEX, job_id or ""):
+            raise KeyError(job_id)
+        return os.path.join(self.path, job_id)
+
+    def input_path(self, job_id):
+        return os.path.join(self.job_dir(job_id), "input.csv")
+
+    def output_path(self, job_id):
+        return os.path.join(self.job_dir(job_id), "output.csv")
+
+    def create(self, app, upload, filename, options):
+        """
+        Spool an uploaded file to disk and queue it for processing
+
+        `options` are the keyword arguments given to `iter_csv`.
+        """
+        self.remove_old_jobs()
+        job_id = uuid.uuid4().hex
+        os.makedirs(self.job_dir(job_id))
+        with open(self.input_path(job_id), "wb") as f:
+            shutil.copyfileobj(upload, f)
+
+        job = {
+            "id": job_id,
+            "status": QUEUED,
+            "filename": filename,
+            "options": options,
+            "rows": 0,
+            "created": time.time(),
+            "started": None,
+            "finished": None,
+            "error": None,
+        }
+        self.save(job)
+        with self._lock:
+            self._queued.add(job_id)
+        self.executor.submit(self.run, app, job_id)
+        return job
+
+    def get(self, job_id):
+        """
+        The status of a job, or None if it doesn't exist
+
+        A queued or running job that hasn't been updated for `timeout`
+        seconds is marked as failed.
+        """
+        job = self._read(job_id)
+        if job is None:
+            return None
+        if (
+            job["status"] in (QUEUED, RUNNING)
+            and time.time() - job.get("updated", 0) > self.timeout
+        ):
+            job.update(
+                {
+                    "status": FAILED,
+                    "finished": job.get("updated"),
+                    "error": "The job stopped before it finished",
+                }
+            )
+            self.save(job)
+        job["rows_per_second"] = None
+        if job["started"]:
+            end = job["finished"] or time.time()
+            elapsed = end - job["started"]
+            if elapsed > 0:
+                job["rows_per_second"] = round(job["rows"] / elapsed, 1)
+        return job
+
+    def _read(self, job_id):
+        try:
+            with open(os.path.join(self.job_dir(job_id), "status.json")) as f:
+                return json.load(f)
+        except (KeyError, OSError, ValueError):
+            return None
+
+    def refresh_queue(self):
+        """
+        Update the jobs waiting in this process's queue, so they aren't stale
+        """
+        cutoff = time.time() - self.timeout / 4
+        with self._lock:
+            queued = list(self._queued)
+        for job_id in queued:
+            job = self._read(job_id)
+            if job and job["status"] == QUEUED and job.get("updated", 0) < cutoff:
+                self.save(job)
+
+    def save(self, job):
+        job["updated"] = time.time()
+        directory = self.job_dir(job["id"])
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(job, f)
+        os.replace(temp_path, os.path.join(directory, "status.json"))
+
+    def run(self, app, job_id):
+        """
+        Process a job, using the same code as the /addtocsv upload
+
+        Jobs that have been deleted or marked as failed since they were
+        queued are skipped.
+        """
+        with self._lock:
+            self._queued.discard(job_id)
+        job = self.get(job_id)
+        if job is None or job["status"] != QUEUED:
+            return
+        job.update({"status": RUNNING, "started": time.time()})
+        self.save(job)
+
+        def progress(rows):
+            job["rows"] = rows
+            self.save(job)
+            self.refresh_queue()
+
+        output_path = self.output_path(job_id)
+        temp_path = output_path + ".tmp"
+        try:
+            with app.app_context():
+                with (
+                    open(self.input_path(job_id), "rb") as infile,
+                    open(temp_path, "w", newline="") as outfile,
+                ):
+                    for output in iter_csv(
+                        codecs.iterdecode(infile, "utf-8"),
+                        get_db(),
+                        progress=progress,
+                        workers=app.config["CSV_WORKERS"],
+                        **job["options"],
+                    ):
+                        outfile.write(output)
+            os.replace(temp_path, output_path)
+            job["status"] = FINISHED
+        except Exception as e:
+            job["status"] = FAILED
+            job["error"] = str(e)
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+        job["finished"] = time.time()
+        self.save(job)
+        os.unlink(self.input_path(job_id))
+
+    def remove_old_jobs(self):
+        if not self.path or not os.path.isdir(self.path):
+            return
+        cutoff = time.time() - self.ttl
+        for job_id in os.listdir(self.path):
+            directory = os.path.join(self.path, job_id)
+            try:
+                if os.path.getmtime(directory) < cutoff:
+                    shutil.rmtree(directory)
+            except OSError:
+                continue
+
+
+csv_jobs = CSVJobs()
+
+
+def init_app(app):
+    csv_jobs.path = app.config["CSV_JOBS_DIR"]
+    csv_jobs.workers = app.config["CSV_JOB_WORKERS"]
+    csv_jobs.ttl = app.config["CSV_JOB_TTL"]
+    csv_jobs.timeout = app.config["CSV_JOB_TIMEOUT"]
@@ -0,0 +1,319 @@
+"""
+Nearest neighbour and point-in-polygon searches on latitude/longitude points
+"""
+
+import json
+import math
+import os
+import tempfile
+import time
+
+import numpy as np
+import shapely
+
+EARTH_RADIUS = 6371008.8  # metres
+METRES_PER_DEGREE = EARTH_RADIUS * math.pi / 180
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """
+    Distance in metres between points, using numpy broadcasting
+    """
+    lat1, lon1, lat2, lon2 = (
+        np.radians(np.asarray(a, dtype=np.float64)) for a in (lat1, lon1, lat2, lon2)
+    )
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+class GridIndex:
+    """
+    Grid-bucketed index of points for nearest neighbour queries
+
+    Points are sorted by the grid cell they fall in, so the points in a
+    row of adjacent cells form one contiguous slice of the arrays. A search
+    looks at the rings of cells around the query point, widening the ring
+    until the nearest points found are guaranteed to be closer than
+    anything outside it.
+    """
+
+    row_width = 1_000_000
+    file_magic = b"FTPGRID1"
+
+    def __init__(self, lats, lons, ids=None, cell_size=0.05):
+        self.cell_size = cell_size
+        lats = np.asarray(lats, dtype=np.float32)
+        lons = np.asarray(lons, dtype=np.float32)
+        keys = self.cell_keys(lats, lons)
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.lats = lats[order]
+        self.lons = lons[order]
+        self.ids = None if ids is None else np.asarray(ids)[order]
+        self.bounds = self.cell_bounds()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def cell_bounds(self):
+        """
+        The first and last rows and columns that contain a point
+        """
+        if not len(self):
+            return None
+        rows, cols = np.divmod(self.keys, self.row_width)
+        return (int(rows[0]), int(rows[-1]), int(cols.min()), int(cols.max()))
+
+    def save(self, path):
+        """
+        Write the index to a file that can be memory-mapped by `load`
+
+        The file is a JSON header describing the arrays followed by the
+        arrays themselves. It is written to a temporary file first and then
+        moved into place, so processes that already have the old file open
+        are not affected.
+        """
+        arrays = {"keys": self.keys, "lats": self.lats, "lons": self.lons}
+        if self.ids is not None:
+            arrays["ids"] = (
+                self.ids.astype(np.bytes_) if self.ids.dtype.kind in "OU" else self.ids
+            )
+        header = {
+            "cell_size": self.cell_size,
+            "bounds": self.bounds,
+            "arrays": {},
+        }
+        offset = 0
+        for name, array in arrays.items():
+            offset += -offset % 8
+            header["arrays"][name] = {
+                "dtype": array.dtype.str,
+                "shape": list(array.shape),
+                "offset": offset,
+            }
+            offset += array.nbytes
+        header_bytes = json.dumps(header).encode("utf8")
+        start = len(self.file_magic) + 4 + len(header_bytes)
+        start += -start % 8
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(self.file_magic)
+                f.write(len(header_bytes).to_bytes(4, "little"))
+                f.write(header_bytes)
+                for name, array in arrays.items():
+                    f.write(
+                        b"\0" * (start + header["arrays"][name]["offset"] - f.tell())
+                    )
+                    f.write(np.ascontiguousarray(array).tobytes())
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Open an index written by `save`
+
+        With `mmap` the arrays are memory-mapped rather than read, so
+        processes using the same file share its pages.
+        """
+        with open(path, "rb") as f:
+            if f.read(len(cls.file_magic)) != cls.file_magic:
+                raise ValueError("{} is not a grid index file".format(path))
+            header_length = int.from_bytes(f.read(4), "little")
+            header = json.loads(f.read(header_length).decode("utf8"))
+        start = len(cls.file_magic) + 4 + header_length
+        start += -start % 8
+
+        index = cls.__new__(cls)
+        index.cell_size = header["cell_size"]
+        index.bounds = tuple(header["bounds"]) if header["bounds"] else None
+        index.ids = None
+        for name, array in header["arrays"].items():
+            shape = tuple(array["shape"])
+            if mmap and shape[0]:
+                value = np.memmap(
+                    path,
+                    dtype=array["dtype"],
+                    mode="r",
+                    offset=start + array["offset"],
+                    shape=shape,
+                )
+            else:
+                value = np.fromfile(
+                    path,
+                    dtype=array["dtype"],
+                    count=int(np.prod(shape)),
+                    offset=start + array["offset"],
+                ).reshape(shape)
+            setattr(index, name, value)
+        return index
+
+    def cell_coords(self, lats, lons):
+        rows = np.floor((np.asarray(lats) + 90) / self.cell_size).astype(np.int64)
+        cols = np.floor((np.asarray(lons) + 180) / self.cell_size).astype(np.int64)
+        return rows, cols
+
+    def cell_keys(self, lats, lons):
+        rows, cols = self.cell_coords(lats, lons)
+        return rows * self.row_width + cols
+
+    def ring_candidates(self, row, col, ring):
+        """
+        Positions of all the points within `ring` cells of a cell
+        """
+        slices = []
+        for r in range(row - ring, row + ring + 1):
+            start = np.searchsorted(self.keys, r * self.row_width + col - ring, "left")
+            end = np.searchsorted(self.keys, r * self.row_width + col + ring, "right")
+            if end > start:
+                slices.append(np.arange(start, end))
+        if not slices:
+            return np.array([], dtype=np.int64)
+        return np.concatenate(slices)
+
+    def ring_distance(self, lat, ring):
+        """
+        Minimum distance from a point to anything outside a ring of cells
+        """
+        max_lat = min(abs(lat) + (ring + 1) * self.cell_size, 89.9)
+        return (
+            ring * self.cell_size * METRES_PER_DEGREE * math.cos(math.radians(max_lat))
+        )
+
+    def nearest(self, lats, lons, k=1, max_distance=None):
+        """
+        Find the k nearest points to each of the query points
+
+        Returns two arrays of shape (n, k): the positions of the nearest points
+        in this index (-1 where there aren't enough points) and the distances
+        to them in metres (infinity where there aren't enough points). If
+        `max_distance` is given then points further away than it are not
+        returned, and the search stops once it has looked that far. Query
+        points that aren't finite have no neighbours.
+        """
+        lats = np.atleast_1d(np.asarray(lats, dtype=np.float64))
+        lons = np.atleast_1d(np.asarray(lons, dtype=np.float64))
+        indexes = np.full((len(lats), k), -1, dtype=np.int64)
+        distances = np.full((len(lats), k), np.inf)
+        finite = np.isfinite(lats) & np.isfinite(lons)
+        if not finite.all():
+            # NaN or infinite points have no neighbours, and would never be
+            # placed in a cell
+            found, found_distances = self.nearest(
+                lats[finite], lons[finite], k=k, max_distance=max_distance
+            )
+            indexes[finite] = found
+            distances[finite] = found_distances
+            return indexes, distances
+        if not len(self) or not len(lats):
+            return indexes, distances
+
+        # the furthest ring that could be needed covers every point
+        min_row, max_row, min_col, max_col = self.bounds
+        rows, cols = self.cell_coords(lats, lons)
+        max_ring = int(
+            max(
+                np.abs(max_row - rows).max(),
+                np.abs(min_row - rows).max(),
+                np.abs(max_col - cols).max(),
+                np.abs(min_col - cols).max(),
+                1,
+            )
+        )
+
+        # points in the same cell share the same candidates
+        query_keys = rows * self.row_width + cols
+        query_order = np.argsort(query_keys, kind="stable")
+        cells, starts = np.unique(query_keys[query_order], return_index=True)
+        for cell, query in zip(cells, np.split(query_order, starts[1:])):
+            row, col = divmod(int(cell), self.row_width)
+            max_lat = np.abs(lats[query]).max()
+            ring = 1
+            while True:
+                candidates = self.ring_candidates(row, col, ring)
+                limit = self.ring_distance(max_lat, ring)
+                n = min(k, len(candidates))
+                if n:
+                    d = haversine(
+                        lats[query][:, None],
+                        lons[query][:, None],
+                        self.lats[candidates][None, :],
+                        self.lons[candidates][None, :],
+                    )
+                    nearest = np.argsort(d, axis=1)[:, :n]
+                    nearest_d = np.take_along_axis(d, nearest, axis=1)
+                    complete = n == k and nearest_d[:, -1].max() <= limit
+                else:
+                    complete = False
+                if max_distance is not None and limit >= max_distance:
+                    complete = True
+                if complete or ring >= max_ring:
+                    break
+                ring += 1
+
+            if n:
+                if max_distance is not None:
+                    nearest = np.where(nearest_d <= max_distance, nearest, -1)
+                found = np.where(nearest >= 0, candidates[nearest], -1)
+                indexes[query, :n] = found
+                distances[query, :n] = np.where(found >= 0, nearest_d, np.inf)
+
+        return indexes, distances
+
+
+class PolygonIndex:
+    """
+    Index of area boundaries for point-in-polygon queries
+
+    The boundaries are held in a shapely STRtree and prepared, so that a
+    query only tests the few polygons whose bbox contains a point. Points on
+    the border between two areas are in both.
+    """
+
+    def __init__(self, codes, geometries):
+        start = time.perf_counter()
+        self.codes = np.asarray(codes, dtype=object)
+        self.geometries = np.asarray(geometries, dtype=object)
+        shapely.prepare(self.geometries)
+        self.tree = shapely.STRtree(self.geometries)
+        self.build_time = time.perf_counter() - start
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def memory(self):
+        """
+        Rough size of the index in bytes, based on the number of coordinates
+
+        Prepared geometries need about as much memory again as the
+        coordinates themselves.
+        """
+        if not len(self):
+            return 0
+        return int(shapely.get_num_coordinates(self.geometries).sum()) * 16 * 2
+
+    def containing(self, lats, lons):
+        """
+        The codes of the areas containing each of the points
+        """
+        points = shapely.points(
+            np.atleast_1d(np.asarray(lons, dtype=np.float64)),
+            np.atleast_1d(np.asarray(lats, dtype=np.float64)),
+        )
+        results = [[] for _ in range(len(points))]
+        if not len(self):
+            return results
+        point_index, geometry_index = self.tree.query(points, predicate="intersects")
+        for p, g in zip(point_index, geometry_index):
+            results[p].append(self.codes[g])
+        return results
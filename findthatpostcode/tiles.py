@@ -0,0 +1,209 @@
+"""
+Mapbox vector tiles of area boundaries
+
+Tiles follow the XYZ scheme used by web maps, in the web mercator
+projection. See https://github.com/mapbox/vector-tile-spec for the format.
+"""
+
+import math
+import struct
+
+import numpy as np
+import shapely
+from shapely.geometry import shape
+from shapely.geometry.polygon import orient
+
+TILE_EXTENT = 4096
+TILE_BUFFER = 64  # in tile units, so that borders are drawn across tile edges
+MAX_ZOOM = 20
+
+MVT_POLYGON = 3
+MVT_MOVE_TO = 1
+MVT_LINE_TO = 2
+MVT_CLOSE_PATH = 7
+
+
+def valid_tile(z, x, y):
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2**z and 0 <= y < 2**z
+
+
+def tile_lon(x, z):
+    return x / 2**z * 360 - 180
+
+
+def tile_lat(y, z):
+    return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / 2**z))))
+
+
+def tile_bounds(z, x, y, buffer=0):
+    """
+    The bbox of a tile as [min lon, min lat, max lon, max lat]
+
+    `buffer` extends the tile on each side, in tile units.
+    """
+    b = buffer / TILE_EXTENT
+    return [
+        max(tile_lon(x - b, z), -180),
+        tile_lat(min(y + 1 + b, 2**z), z),
+        min(tile_lon(x + 1 + b, z), 180),
+        tile_lat(max(y - b, 0), z),
+    ]
+
+
+def bbox_overlaps(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def to_tile_coords(geometry, z, x, y):
+    """
+    Project a longitude/latitude geometry onto the grid of a tile
+    """
+    scale = 2**z
+
+    def project(coords):
+        lon = coords[:, 0]
+        lat = np.radians(np.clip(coords[:, 1], -85.0511, 85.0511))
+        mx = (lon + 180) / 360 * scale - x
+        my = (1 - np.log(np.tan(lat) + 1 / np.cos(lat)) / math.pi) / 2 * scale - y
+        return np.round(np.column_stack([mx, my]) * TILE_EXTENT)
+
+    return shapely.transform(geometry, project)
+
+
+def tile_features(features, z, x, y):
+    """
+    Clip GeoJSON features to a tile and convert them to tile coordinates
+
+    Returns a list of (shapely geometry, properties) for the features that
+    still have an area once they have been clipped.
+    """
+    bounds = tile_bounds(z, x, y, TILE_BUFFER)
+    results = []
+    for feature in features:
+        if not feature.get("geometry"):
+            continue
+        geometry = shape(feature["geometry"])
+        if not bbox_overlaps(geometry.bounds, bounds):
+            continue
+        geometry = shapely.clip_by_rect(geometry, *bounds)
+        geometry = shapely.make_valid(to_tile_coords(geometry, z, x, y))
+        polygons = [
+            g
+            for g in getattr(geometry, "geoms", [geometry])
+            if g.geom_type == "Polygon" and g.area > 0
+        ]
+        if polygons:
+            results.append((polygons, feature.get("properties", {})))
+    return results
+
+
+def encode_tile(layers):
+    """
+    Encode a vector tile
+
+    `layers` is a dict of layer name to a list of (polygons, properties)
+    as returned by `tile_features`.
+    """
+    return b"".join(
+        _field(3, _layer(name, features)) for name, features in layers.items()
+    )
+
+
+def _layer(name, features):
+    keys = {}
+    values = {}
+    encoded = []
+    for polygons, properties in features:
+        tags = []
+        for k, v in properties.items():
+            if v is None:
+                continue
+            value = _value(v)
+            tags.append(keys.setdefault(k, len(keys)))
+            tags.append(values.setdefault(value, len(values)))
+        encoded.append(
+            _field(2, _packed(tags))
+            + _key(3, 0)
+            + _varint(MVT_POLYGON)
+            + _field(4, _packed(_polygon_commands(polygons)))
+        )
+    return b"".join(
+        [
+            _key(15, 0) + _varint(2),
+            _field(1, name.encode("utf8")),
+            *[_field(2, f) for f in encoded],
+            *[_field(3, k.encode("utf8")) for k in keys],
+            *[_field(4, v) for v in values],
+            _key(5, 0) + _varint(TILE_EXTENT),
+        ]
+    )
+
+
+def _value(value):
+    if isinstance(value, bool):
+        return _key(7, 0) + _varint(int(value))
+    if isinstance(value, int):
+        return _key(6, 0) + _varint(_zigzag(value))
+    if isinstance(value, float):
+        return _key(3, 1) + struct.pack("<d", value)
+    return _field(1, str(value).encode("utf8"))
+
+
+def _polygon_commands(polygons):
+    """
+    Geometry commands for a polygon, with the cursor starting at 0, 0
+
+    Exterior rings wind clockwise on screen (positive area in tile
+    coordinates) and interior rings anti-clockwise.
+    """
+    commands = []
+    cx = cy = 0
+    for polygon in polygons:
+        polygon = orient(polygon, 1.0)
+        for ring in [polygon.exterior, *polygon.interiors]:
+            points = []
+            for px, py in ring.coords[:-1]:
+                point = (int(px), int(py))
+                if not points or points[-1] != point:
+                    points.append(point)
+            if len(points) > 1 and points[0] == points[-1]:
+                points.pop()
+            if len(points) < 3:
+                continue
+            for i, (px, py) in enumerate(points):
+                if i == 0:
+                    commands.append(MVT_MOVE_TO | (1 << 3))
+                elif i == 1:
+                    commands.append(MVT_LINE_TO | ((len(points) - 1) << 3))
+                commands.extend((_zigzag(px - cx), _zigzag(py - cy)))
+                cx, cy = px, py
+            commands.append(MVT_CLOSE_PATH | (1 << 3))
+    return commands
+
+
+def _zigzag(n):
+    return (n << 1) ^ (n >> 63)
+
+
+def _varint(n):
+    output = bytearray()
+    while True:
+        byte = n & 0x7F
+        n >>= 7
+        if n:
+            output.append(byte | 0x80)
+        else:
+            output.append(byte)
+            return bytes(output)
+
+
+def _key(field, wire_type):
+    return _varint((field << 3) | wire_type)
+
+
+def _field(field, content):
+    return _key(field, 2) + _varint(len(content)) + content
+
+
+def _packed(values):
+    return b"".join(_varint(v) for v in values)
@@ -0,0 +1,405 @@
+import csv
+import io
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+
+from findthatpostcode.blueprints.process_csv import (
+    expand_fields,
+    iter_csv,
+    output_columns,
+    process_csv,
+)
+from findthatpostcode.jobs import FAILED, FINISHED, QUEUED, RUNNING, CSVJobs, csv_jobs
+from tests.conftest import CountingElasticsearch
+
+CSV_INPUT = "name,postcode\nA,EX36 4AT\nB,ex364at\nC,XX1 1XX\nD,\n"
+
+
+class SlowElasticsearch(CountingElasticsearch):
+    """Adds a delay to each mget, like the round trip to a real server"""
+
+    def __init__(self, delay=0.01, jitter=0, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.delay = delay
+        self.jitter = jitter
+
+    def mget(self, *args, **kwargs):
+        time.sleep(self.delay + random.random() * self.jitter)
+        return super().mget(*args, **kwargs)
+
+
+class ConcurrentElasticsearch(SlowElasticsearch):
+    """Records the most mget requests that were running at the same time"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def mget(self, *args, **kwargs):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            return super().mget(*args, **kwargs)
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+def large_csv(rows):
+    postcodes = ["EX36 4AT", "XX1 1XX", ""]
+    return "name,postcode\n" + "".join(
+        "{},{}\n".format(i, postcodes[i % len(postcodes)]) for i in range(rows)
+    )
+
+
+def test_addtocsv(client):
+    rv = client.post(
+        "/addtocsv",
+        data={
+            "csvfile": (io.BytesIO(CSV_INPUT.encode("utf8")), "test.csv"),
+            "column_name": "postcode",
+            "fields": ["latlng", "laua", "laua_name"],
+        },
+    )
+    assert rv.status_code == 200
+    assert rv.mimetype == "text/csv"
+    assert rv.headers["Content-Disposition"] == 'attachment; filename="test.csv"'
+    rows = list(csv.DictReader(io.StringIO(rv.data.decode("utf8"))))
+    assert [r["name"] for r in rows] == ["A", "B", "C", "D"]
+    assert rows[0]["laua"] == "E07000043"
+    assert rows[0]["laua_name"]
+    assert rows[0]["lat"] == rows[1]["lat"]
+    assert rows[2]["laua"] == ""
+    assert rows[3]["lat"] == ""
+
+
+POINTS_INPUT = (
+    "name,lat,lon,easting,northing\n"
+    "A,51.01467,-3.83317,271505,125521\n"
+    "B,40.0,-3.0,200000,-2000000\n"
+    "C,,,,\n"
+)
+
+
+def test_addtocsv_points(client):
+    rv = client.post(
+        "/addtocsv",
+        data={
+            "csvfile": (io.BytesIO(POINTS_INPUT.encode("utf8")), "test.csv"),
+            "lat_column": "lat",
+            "lon_column": "lon",
+            "fields": ["laua"],
+        },
+    )
+    assert rv.status_code == 200
+    rows = list(csv.DictReader(io.StringIO(rv.data.decode("utf8"))))
+    assert list(rows[0].keys())[-4:] == [
+        "nearest_postcode",
+        "distance_from_postcode",
+        "outside_uk",
+        "laua",
+    ]
+    assert rows[0]["nearest_postcode"] == "EX36 4AT"
+    assert rows[0]["distance_from_postcode"] == "69.0"
+    assert rows[0]["outside_uk"] == "False"
+    assert rows[0]["laua"] == "E07000043"
+    # outside the UK, so no postcode is looked up
+    assert rows[1]["outside_uk"] == "True"
+    assert rows[1]["nearest_postcode"] == ""
+    assert rows[1]["laua"] == ""
+    # no coordinates
+    assert rows[2]["outside_uk"] == ""
+
+
+def test_process_csv_osgb():
+    es = CountingElasticsearch()
+    output = "".join(
+        iter_csv(
+            io.StringIO(POINTS_INPUT),
+            es,
+            fields=["laua"],
+            point_fields=["easting", "northing"],
+            osgb=True,
+        )
+    )
+    rows = list(csv.DictReader(io.StringIO(output)))
+    assert rows[0]["nearest_postcode"] == "EX36 4AT"
+    assert rows[0]["laua"] == "E07000043"
+    assert rows[1]["outside_uk"] == "True"
+    assert rows[2]["outside_uk"] == ""
+    # only the point in the UK is searched for
+    assert es.calls.count("search") == 1
+
+
+def test_process_csv_chunks():
+    es = CountingElasticsearch()
+    outputs = list(
+        iter_csv(io.StringIO(CSV_INPUT), es, "postcode", ["lat", "long"], chunk_size=2)
+    )
+    assert len(outputs) == 2
+    assert outputs[0].startswith("name,postcode,lat,long\r\n")
+    # one mget for each chunk with a postcode in it, rather than a get per row
+    assert es.calls.count("mget") == 2
+
+    progress = []
+    list(
+        iter_csv(
+            io.StringIO(CSV_INPUT),
+            es,
+            "postcode",
+            ["lat"],
+            chunk_size=3,
+            progress=progress.append,
+        )
+    )
+    assert progress == [3, 4]
+
+    output = io.StringIO()
+    process_csv(io.StringIO(CSV_INPUT), output, es, "postcode", ["lat", "long"])
+    assert output.getvalue() == "".join(outputs)
+
+
+def test_addtocsv_spooled_to_disk(client, monkeypatch):
+    monkeypatch.setattr("findthatpostcode.blueprints.addtocsv.UPLOAD_SPOOL_SIZE", 10)
+    spools = []
+
+    class Spool(tempfile.SpooledTemporaryFile):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            spools.append(self)
+
+    monkeypatch.setattr(tempfile, "SpooledTemporaryFile", Spool)
+    rv = client.post(
+        "/addtocsv",
+        data={
+            "csvfile": (io.BytesIO(CSV_INPUT.encode("utf8")), "test.csv"),
+            "column_name": "postcode",
+            "fields": ["laua"],
+        },
+    )
+    rows = list(csv.DictReader(io.StringIO(rv.data.decode("utf8"))))
+    assert [r["name"] for r in rows] == ["A", "B", "C", "D"]
+    # the upload is bigger than the limit, so it's kept on disk
+    assert spools[0]._rolled
+
+
+def test_addtocsv_job(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(csv_jobs, "path", str(tmp_path))
+    rv = client.post(
+        "/addtocsv/jobs",
+        data={
+            "csvfile": (io.BytesIO(CSV_INPUT.encode("utf8")), "test.csv"),
+            "column_name": "postcode",
+            "fields": ["latlng", "laua"],
+        },
+    )
+    assert rv.status_code == 202
+    job_id = rv.json["data"]["id"]
+    assert rv.headers["Location"].endswith("/addtocsv/jobs/{}".format(job_id))
+    assert rv.json["data"]["options"]["fields"] == ["laua", "lat", "long"]
+
+    deadline = time.time() + 10
+    while rv.json["data"]["status"] not in (FINISHED, FAILED):
+        assert time.time() < deadline
+        time.sleep(0.05)
+        rv = client.get("/addtocsv/jobs/{}".format(job_id))
+    assert rv.json["data"]["status"] == FINISHED
+    assert rv.json["data"]["rows"] == 4
+    assert rv.json["data"]["rows_per_second"] > 0
+
+    rv = client.get(rv.json["links"]["download"])
+    assert rv.status_code == 200
+    assert rv.headers["Content-Disposition"].startswith("attachment")
+    rows = list(csv.DictReader(io.StringIO(rv.data.decode("utf8"))))
+    assert [r["name"] for r in rows] == ["A", "B", "C", "D"]
+    assert rows[0]["laua"] == "E07000043"
+
+
+def test_addtocsv_job_not_found(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(csv_jobs, "path", str(tmp_path))
+    assert client.get("/addtocsv/jobs/" + "0" * 32).status_code == 404
+    assert client.get("/addtocsv/jobs/..").status_code == 404
+    assert client.get("/addtocsv/jobs/{}/download".format("0" * 32)).status_code == 404
+
+
+def new_job(jobs, job_id, **kwargs):
+    os.makedirs(jobs.job_dir(job_id))
+    with open(jobs.input_path(job_id), "w") as f:
+        f.write(CSV_INPUT)
+    job = {
+        "id": job_id,
+        "status": QUEUED,
+        "filename": "test.csv",
+        "options": {},
+        "rows": 0,
+        "created": time.time(),
+        "started": None,
+        "finished": None,
+        "error": None,
+        **kwargs,
+    }
+    jobs.save(job)
+    return job
+
+
+def age_job(jobs, job_id, seconds):
+    status_path = os.path.join(jobs.job_dir(job_id), "status.json")
+    with open(status_path) as f:
+        job = json.load(f)
+    job["updated"] -= seconds
+    with open(status_path, "w") as f:
+        json.dump(job, f)
+
+
+def test_job_stale(tmp_path):
+    jobs = CSVJobs(str(tmp_path), timeout=60)
+    job_id = "1" * 32
+    new_job(jobs, job_id, status=RUNNING, started=time.time())
+    assert jobs.get(job_id)["status"] == RUNNING
+
+    # the process running the job stopped an hour ago
+    age_job(jobs, job_id, 3600)
+    job = jobs.get(job_id)
+    assert job["status"] == FAILED
+    assert job["error"]
+    # it finished when it was last updated
+    assert job["finished"] < job["started"] - 3000
+    assert jobs.get(job_id)["status"] == FAILED
+
+
+def test_job_queued(client, tmp_path):
+    jobs = CSVJobs(str(tmp_path), timeout=60)
+    running_id, queued_id, lost_id = "5" * 32, "6" * 32, "7" * 32
+    new_job(jobs, running_id)
+    # both jobs have been waiting for an hour, the queued one for this
+    # process and the lost one for a process that has stopped
+    for job_id in (queued_id, lost_id):
+        new_job(jobs, job_id)
+        age_job(jobs, job_id, 3600)
+    jobs._queued.update([running_id, queued_id])
+
+    # the queued job is kept fresh while another job runs
+    jobs.run(client.application, running_id)
+    assert jobs.get(running_id)["status"] == FINISHED
+    assert jobs.get(queued_id)["status"] == QUEUED
+    assert jobs.get(lost_id)["status"] == FAILED
+
+    jobs.run(client.application, queued_id)
+    assert jobs.get(queued_id)["status"] == FINISHED
+
+
+def test_job_run_skipped(client, tmp_path):
+    jobs = CSVJobs(str(tmp_path))
+    # deleted jobs, and jobs that aren't queued, aren't run
+    jobs.run(client.application, "2" * 32)
+    job_id = "3" * 32
+    new_job(jobs, job_id, status=FAILED)
+    jobs.run(client.application, job_id)
+    assert jobs.get(job_id)["status"] == FAILED
+    assert client.db.calls == []
+
+
+def test_job_failed(client, tmp_path):
+    jobs = CSVJobs(str(tmp_path))
+    job_id = "4" * 32
+    new_job(jobs, job_id, options={"not_an_option": True})
+    jobs.run(client.application, job_id)
+
+    job = jobs.get(job_id)
+    assert job["status"] == FAILED
+    assert "not_an_option" in job["error"]
+    assert isinstance(job["created"], float)
+    assert job["created"] <= job["started"] <= job["finished"]
+    assert os.listdir(jobs.job_dir(job_id)) == ["status.json"]
+
+
+def test_expand_fields():
+    fields = ["latlng", "laua", "lep_name"]
+    assert expand_fields(fields) == ["laua", "lat", "long", "lep1_name", "lep2_name"]
+    assert fields == ["latlng", "laua", "lep_name"]
+
+
+def test_process_csv_order():
+    # chunks that take different times to look up are still output in order
+    es = SlowElasticsearch(delay=0, jitter=0.01)
+    progress = []
+    output = "".join(
+        iter_csv(
+            io.StringIO(large_csv(200)),
+            es,
+            "postcode",
+            ["lat"],
+            chunk_size=10,
+            workers=8,
+            progress=progress.append,
+        )
+    )
+    rows = list(csv.DictReader(io.StringIO(output)))
+    assert [r["name"] for r in rows] == [str(i) for i in range(200)]
+    assert rows[0]["lat"] and not rows[1]["lat"]
+    assert progress == list(range(10, 201, 10))
+
+    assert "".join(iter_csv(io.StringIO("name,postcode\n"), es)) == (
+        "name,postcode,lat,long,cty\r\n"
+    )
+
+
+def test_process_csv_overlap():
+    es = ConcurrentElasticsearch(delay=0.1)
+    output = "".join(
+        iter_csv(
+            io.StringIO(large_csv(800)),
+            es,
+            "postcode",
+            ["lat"],
+            chunk_size=100,
+            workers=4,
+        )
+    )
+    assert len(output.splitlines()) == 801
+    # the lookups for several chunks overlap, up to the number of workers
+    assert es.calls.count("mget") == 8
+    assert es.max_active == 4
+
+
+def test_addtocsv_points_clashing_columns(client):
+    # the default fields include lat and long, which are already in the file
+    rv = client.post(
+        "/addtocsv",
+        data={
+            "csvfile": (
+                io.BytesIO(b"id,lat,lon,outside_uk\n1,51.0,-3.8,x\n2,abc,,y\n"),
+                "test.csv",
+            ),
+            "lat_column": "lat",
+            "lon_column": "lon",
+        },
+    )
+    assert rv.status_code == 200
+    reader = csv.DictReader(io.StringIO(rv.data.decode("utf8")))
+    rows = list(reader)
+    assert len(reader.fieldnames) == len(set(reader.fieldnames))
+    assert reader.fieldnames[:4] == ["id", "lat", "lon", "outside_uk"]
+    assert "ftp_outside_uk" in reader.fieldnames
+    assert "ftp_lat" in reader.fieldnames
+    assert [r["lat"] for r in rows] == ["51.0", "abc"]
+    assert [r["outside_uk"] for r in rows] == ["x", "y"]
+    assert rows[0]["ftp_outside_uk"] == "False"
+    assert rows[0]["nearest_postcode"] == "EX36 4AT"
+    assert rows[0]["ftp_lat"] == "51.01467"
+    assert rows[0]["laua"] == "E07000043"
+    assert rows[1]["ftp_lat"] == ""
+
+
+def test_output_columns():
+    assert output_columns(["lat", "ftp_lat"], ["lat", "long"]) == {
+        "lat": "ftp_ftp_lat",
+        "long": "long",
+    }
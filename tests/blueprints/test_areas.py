@@ -1,3 +1,9 @@
+import time
+
+from findthatpostcode.boundaries import MANIFEST_KEY
+from findthatpostcode.cache import boundary_cache
+from findthatpostcode.db import _release, get_boundaries_version
+
 AREA_CODE = "S02000783"
 AREA_NAME = "Lower Bow & Larkfield, Fancy Farm, Mallard Bowl"
 
@@ -21,6 +27,14 @@ def test_area_json(client):
     )
 
 
+def test_area_json_include(client):
+    rv = client.get("/areas/{}.json?include=parent".format(AREA_CODE))
+    data = rv.get_json()
+    assert data["data"]["attributes"]["name"] == AREA_NAME
+    assert data["data"]["relationships"]["example_postcodes"]["data"] == []
+    assert "child_counts" not in data["data"]["attributes"]
+
+
 def test_missing_area_json(client):
     rv = client.get("/areas/123445676.json")
     assert rv.status == "404 NOT FOUND"
@@ -66,3 +80,98 @@ def test_area_names(client):
     content = rv.data.decode("utf8")
     assert rv.mimetype == "text/csv"
     assert "E01020135" in content
+
+
+def test_area_server_timing(client):
+    # use a query string that won't already be in the response cache
+    rv = client.get("/areas/E01020135.json?timing=1")
+    assert rv.status_code == 200
+    assert "area;dur=" in rv.headers["Server-Timing"]
+
+
+def test_area_geojson_multiple(client):
+    rv = client.get("/areas/E01020135+S02000783+E99999999.geojson")
+    data = rv.get_json()
+    assert rv.status_code == 200
+    assert [f["properties"]["code"] for f in data["features"]] == [
+        "E01020135",
+        "S02000783",
+    ]
+    assert data["errors"] == {"E99999999": "area not found"}
+
+
+def test_area_geojson_none_found(client):
+    rv = client.get("/areas/E99999999+E99999998.geojson")
+    assert rv.status_code == 404
+
+
+def test_area_children_geojson(client):
+    rv = client.get("/areas/S02000783/children/lsoa11.geojson")
+    assert rv.status_code == 404
+    assert rv.get_json()["message"] == {
+        "S01000126": "area not found",
+        "S01000127": "area not found",
+    }
+
+
+def test_area_topojson(client):
+    rv = client.get("/areas/E01020135+S02000783+E99999999.topojson")
+    assert rv.status_code == 200
+    data = rv.get_json()
+    assert data["type"] == "Topology"
+    assert [
+        g["properties"]["code"] for g in data["objects"]["areas"]["geometries"]
+    ] == [
+        "E01020135",
+        "S02000783",
+    ]
+    assert data["errors"] == {"E99999999": "area not found"}
+
+
+def test_area_flatgeobuf(client):
+    rv = client.get("/areas/{}.fgb".format(AREA_CODE))
+    assert rv.status_code == 200
+    assert rv.mimetype == "application/flatgeobuf"
+    assert rv.data.startswith(b"fgb\x03fgb\x00")
+
+
+def test_area_flatgeobuf_cached(client):
+    boundary_cache.clear()
+    first = client.get("/areas/{}.fgb".format(AREA_CODE))
+    assert client.s3_client.downloads
+
+    # the encoded file is kept in memory, without a BOUNDARY_CACHE_DIR
+    client.db.calls.clear()
+    client.s3_client.downloads.clear()
+    second = client.get("/areas/{}.fgb".format(AREA_CODE))
+    assert second.data == first.data
+    assert client.s3_client.downloads == []
+    assert "mget" not in client.db.calls
+
+
+def test_area_flatgeobuf_new_release(client, monkeypatch):
+    boundary_cache.clear()
+    release = {
+        "version": "20260801120000",
+        "datasets": {"boundaries": "2026-07-01T09:00:00.123456"},
+    }
+    monkeypatch.setitem(_release, "data", release)
+    monkeypatch.setitem(_release, "checked", time.monotonic())
+    assert get_boundaries_version(client.db) == "20260701090000"
+    assert client.get("/areas/{}.fgb".format(AREA_CODE)).status_code == 200
+
+    # postcodes are imported, but the boundaries haven't changed
+    monkeypatch.setitem(_release, "data", {**release, "version": "20260901120000"})
+    client.db.calls.clear()
+    client.s3_client.downloads.clear()
+    rv = client.get("/areas/{}.fgb".format(AREA_CODE))
+    assert rv.status_code == 200
+    # the file is made again with the new area data, from the same boundary
+    assert "mget" in client.db.calls
+    assert [d for d in client.s3_client.downloads if d != MANIFEST_KEY] == []
+
+
+def test_boundaries_version_not_imported(client, monkeypatch):
+    monkeypatch.setitem(_release, "data", {"version": "20260801120000"})
+    monkeypatch.setitem(_release, "checked", time.monotonic())
+    assert get_boundaries_version(client.db) is None
@@ -46,3 +46,10 @@ def test_areatype_csv(client):
     content = rv.data.decode("utf8")
     assert rv.mimetype == "text/csv"
     assert "E01020135" in content
+
+
+def test_areatype_json_excludes_stored_lists(client):
+    rv = client.get("/areatypes/{}.json".format(AREATYPE_CODE))
+    for item in rv.get_json()["included"]:
+        assert "children" not in item.get("attributes", {})
+        assert "example_postcodes" not in item.get("attributes", {})
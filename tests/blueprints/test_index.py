@@ -24,3 +24,10 @@ def test_about(client):
         "Contains National Statistics data © Crown copyright and database right"
         in content
     )
+
+
+def test_version(client):
+    rv = client.get("/version")
+    assert rv.mimetype == "application/json"
+    assert rv.json["version"] == "20260801120000"
+    assert "nspl" in rv.json["datasets"]
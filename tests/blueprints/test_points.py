@@ -1,3 +1,14 @@
+import json
+import time
+
+import pytest
+
+from findthatpostcode.boundaries import NOT_LOADED, boundary_manifest
+from findthatpostcode.cache import area_cache
+from findthatpostcode.controllers.points import polygon_index
+from findthatpostcode.spatial import GridIndex
+
+
 def test_point_json(client):
     rv = client.get("/points/51.501,-0.2936")
     point_json = rv.get_json()
@@ -13,7 +24,7 @@ def test_point_json(client):
     )
     assert (
         point_json.get("data", {}).get("attributes", {}).get("distance_from_postcode")
-        == 68.9707515287199
+        == 69.0
     )
 
 
@@ -33,3 +44,239 @@ def test_point_html(client):
 
 def test_point_html_distance(client):
     pass
+
+
+def test_point_areas(client):
+    client.application.config["POLYGON_INDEX_AREATYPES"] = ["msoa21", "lsoa21"]
+    previous = (
+        boundary_manifest.version,
+        boundary_manifest.boundaries,
+        boundary_manifest.loaded,
+    )
+    boundary_manifest.version = "20260801120000"
+    boundary_manifest.boundaries = {
+        "S02000783": {"size": 100, "bbox": [100, 0, 101, 1]},
+        "E01020135": {"size": 100, "bbox": [100, 0, 101, 1]},
+        "E05000001": {"size": 100, "bbox": [100, 0, 101, 1]},
+    }
+    boundary_manifest.loaded = True
+    try:
+        rv = client.get("/points/0.5,100.5/areas")
+        assert rv.status_code == 200
+        data = rv.get_json()["data"]
+        assert data["found"] is True
+        assert data["msoa21"] == "S02000783"
+        assert data["msoa21_name"] == "Lower Bow & Larkfield, Fancy Farm, Mallard Bowl"
+        assert data["lsoa21"] == "E01020135"
+        # only the requested area types are included
+        assert "ward" not in data
+
+        rv = client.post("/points/areas", json={"points": [[0.5, 100.5], [51.5, -0.1]]})
+        assert rv.status_code == 200
+        data = rv.get_json()["data"]
+        assert [d["found"] for d in data] == [True, False]
+        assert data[0]["msoa21"] == "S02000783"
+
+        rv = client.post("/points/areas", json=[["a", 1]])
+        assert rv.status_code == 400
+    finally:
+        (
+            boundary_manifest.version,
+            boundary_manifest.boundaries,
+            boundary_manifest.loaded,
+        ) = previous
+        polygon_index.index = None
+        polygon_index.version = NOT_LOADED
+
+
+def test_point_areas_retry(client):
+    client.application.config["POLYGON_INDEX_AREATYPES"] = ["msoa21"]
+    previous = (
+        boundary_manifest.version,
+        boundary_manifest.boundaries,
+        boundary_manifest.loaded,
+    )
+    try:
+        # there's no manifest yet, so the index is empty but isn't kept
+        rv = client.get("/points/0.5,100.5/areas")
+        assert rv.get_json()["data"]["found"] is False
+        assert polygon_index.version is NOT_LOADED
+
+        # it isn't built again straight away
+        client.s3_client.downloads.clear()
+        rv = client.get("/points/0.5,100.5/areas")
+        assert client.s3_client.downloads == []
+
+        boundary_manifest.version = "20260801120000"
+        boundary_manifest.boundaries = {
+            "S02000783": {"size": 100, "bbox": [100, 0, 101, 1]},
+        }
+        boundary_manifest.loaded = True
+        polygon_index.retry_after = time.monotonic()
+        client.get("/points/0.5,100.5/areas")
+        deadline = time.time() + 10
+        while polygon_index.version != "20260801120000":
+            assert time.time() < deadline
+            time.sleep(0.01)
+        rv = client.get("/points/0.5,100.5/areas")
+        assert rv.get_json()["data"]["msoa21"] == "S02000783"
+    finally:
+        (
+            boundary_manifest.version,
+            boundary_manifest.boundaries,
+            boundary_manifest.loaded,
+        ) = previous
+        polygon_index.index = None
+        polygon_index.version = NOT_LOADED
+        polygon_index.retry_after = None
+
+
+def test_point_areas_not_enabled(client):
+    rv = client.get("/points/0.5,100.5/areas")
+    assert rv.status_code == 404
+
+
+def test_point_postcode_index(client, tmp_path):
+    path = str(tmp_path / "postcodes.grid")
+    GridIndex([51.0, 51.5], [-3.5, -0.3], ids=["SW1A 1AA", "EX36 4AT"]).save(path)
+    client.application.config["POSTCODE_INDEX_PATH"] = path
+
+    rv = client.get("/points/51.501,-0.2936.json")
+    data = rv.get_json()
+    assert data["data"]["relationships"]["nearest_postcode"]["data"]["id"] == "EX36 4AT"
+    assert 0 < data["data"]["attributes"]["distance_from_postcode"] < 1000
+    # elasticsearch is only used to fetch the postcode, not to find it
+    assert client.db.calls[0] == "get"
+
+    # in the UK's bbox, but more than 10km from any postcode
+    client.db.calls.clear()
+    rv = client.get("/points/60.5,-8.5.json")
+    assert rv.status_code == 400
+    assert rv.get_json()["message"]["errors"][0]["code"] == "point_outside_uk"
+    assert client.db.calls == []
+
+    rv = client.post("/points/bulk", json={"points": [[60.5, -8.5]]})
+    assert rv.get_json()["data"][0]["outside_uk"] is True
+    assert rv.get_json()["data"][0]["postcode"] is None
+
+
+def test_points_bulk(client):
+    area_cache.clear()
+    rv = client.post(
+        "/points/bulk",
+        json={
+            "points": [[51.501, -0.2936], ["x", 1], {"lat": 51.5, "lon": -0.29}],
+            "properties": ["laua", "laua_name"],
+        },
+    )
+    assert rv.status_code == 200
+    data = rv.get_json()["data"]
+    assert len(data) == 3
+    assert data[0]["query"] == {"lat": 51.501, "lon": -0.2936}
+    assert data[0]["found"] is True
+    assert data[0]["postcode"] == "EX36 4AT"
+    assert data[0]["distance"] == 69.0
+    assert data[0]["outside_uk"] is False
+    assert data[0]["laua"] == "E07000043"
+    assert "laua_name" in data[0]
+    assert data[1] == {"query": None, "found": False, "error": "invalid_point"}
+    assert data[2]["postcode"] == "EX36 4AT"
+    # the postcode is only fetched once
+    assert client.db.calls.count("mget") == 2
+
+
+def test_points_bulk_csv(client, tmp_path):
+    path = str(tmp_path / "postcodes.grid")
+    GridIndex([51.0, 55.0], [-3.5, -3.0], ids=["EX36 4AT", "EH1 1AA"]).save(path)
+    client.application.config["POSTCODE_INDEX_PATH"] = path
+
+    rv = client.post(
+        "/points/bulk.ndjson",
+        data="Latitude,Longitude\n51.01,-3.5\n40.0,-3.0\n,\n",
+        content_type="text/csv",
+    )
+    assert rv.status_code == 200
+    assert rv.mimetype == "application/x-ndjson"
+    data = [json.loads(line) for line in rv.data.decode("utf8").splitlines()]
+    assert len(data) == 3
+    assert data[0]["found"] is True
+    assert data[0]["postcode"] == "EX36 4AT"
+    assert 1000 < data[0]["distance"] < 1200
+    assert data[1]["outside_uk"] is True
+    assert data[1]["error"] == "point_outside_uk"
+    assert data[1]["postcode"] is None
+    assert data[2]["error"] == "invalid_point"
+    assert "search" not in client.db.calls
+
+
+def test_points_bulk_ndjson_input(client):
+    rv = client.post(
+        "/points/bulk",
+        data='{"lat": 51.501, "lon": -0.2936}\n[51.501, -0.2936]\nnot json\n',
+        content_type="application/x-ndjson",
+    )
+    data = rv.get_json()["data"]
+    assert [d["found"] for d in data] == [True, True, False]
+
+
+def test_points_bulk_none(client):
+    assert client.post("/points/bulk", json={"points": []}).status_code == 400
+    assert client.post("/points/bulk.csv", json=[[51, 0]]).status_code == 404
+
+
+def test_point_outside_uk(client):
+    rv = client.get("/points/48.85,2.35.json")
+    assert rv.status_code == 400
+    assert rv.get_json()["message"]["errors"][0]["code"] == "point_outside_uk"
+    assert client.db.calls == []
+
+    rv = client.get("/points/48.85,2.35.html")
+    assert rv.status_code == 400
+
+
+def test_nearest_places(client):
+    rv = client.get("/places/nearest/51.501,-0.2936")
+    assert rv.status_code == 200
+    assert client.db.calls[0] == "search"
+
+    client.db.calls.clear()
+    rv = client.get("/places/nearest/48.85,2.35")
+    assert rv.status_code == 400
+    assert client.db.calls == []
+
+
+def test_points_bulk_not_finite(client):
+    rv = client.post(
+        "/points/bulk",
+        json={"points": [["nan", "0"], ["inf", 1], {"lat": "-inf", "lon": 0}]},
+    )
+    assert rv.status_code == 200
+    # the response must be valid JSON, so NaN can't be echoed back
+    data = json.loads(rv.data, parse_constant=lambda c: pytest.fail(c))["data"]
+    assert [d["error"] for d in data] == ["invalid_point"] * 3
+    assert [d["query"] for d in data] == [None] * 3
+
+
+def test_points_bulk_limit(client, monkeypatch):
+    monkeypatch.setattr("findthatpostcode.blueprints.points.BULK_LIMIT", 3)
+    points = [[51.01467, -3.83317]] * 4
+    rv = client.post("/points/bulk", json={"points": points})
+    assert rv.status_code == 400
+    rv = client.post(
+        "/points/bulk",
+        data="\n".join(json.dumps(p) for p in points),
+        content_type="application/x-ndjson",
+    )
+    assert rv.status_code == 400
+    # the limit is checked before any points are looked up
+    assert client.db.calls == []
+
+    rv = client.post("/points/bulk", json={"points": points[:3]})
+    assert rv.status_code == 200
+
+
+def test_points_bulk_bad_properties(client):
+    rv = client.post(
+        "/points/bulk", json={"points": [[51.01467, -3.83317]], "properties": "lat"}
+    )
+    assert rv.status_code == 400
@@ -1,3 +1,6 @@
+import json
+
+
 def test_postcode_json(client):
     rv = client.get("/postcodes/EX36 4AT")
     postcode_json = rv.get_json()
@@ -21,6 +24,45 @@ def test_postcode_json(client):
     assert postcode_json.get("data", {}).get("attributes", {}).get("long") == -3.83317
 
 
+def test_postcode_json_cached(client):
+    rv = client.get("/postcodes/ex364at.json?cache_test=1")
+    assert rv.headers["X-Cache"] == "MISS"
+
+    # the same postcode in a different format uses the cached response
+    cached = client.get("/postcodes/EX36 4AT.json?cache_test=1")
+    assert cached.headers["X-Cache"] == "HIT"
+    assert cached.mimetype == "application/json"
+    assert cached.headers["Access-Control-Allow-Origin"] == "*"
+    assert cached.get_json() == rv.get_json()
+
+
+def test_postcode_json_include(client):
+    rv = client.get("/postcodes/EX36 4AT.json?include=")
+    postcode_json = rv.get_json()
+    assert rv.status_code == 200
+    assert postcode_json["included"] == []
+    assert "areas" not in postcode_json["data"].get("relationships", {})
+
+    rv = client.get("/postcodes/EX36 4AT.json?include=areas")
+    postcode_json = rv.get_json()
+    assert "E01020135" in [a["id"] for a in postcode_json["included"]]
+    assert "nearest_places" not in postcode_json["data"]["relationships"]
+
+
+def test_postcode_json_sparse_fields(client):
+    rv = client.get("/postcodes/EX36 4AT.json?fields[postcodes]=lat,long,areas")
+    postcode_json = rv.get_json()
+    assert postcode_json["data"]["attributes"] == {"lat": 51.01467, "long": -3.83317}
+    assert list(postcode_json["data"]["relationships"].keys()) == ["areas"]
+
+    rv = client.get("/postcodes/EX36 4AT.json?fields[areas]=name")
+    postcode_json = rv.get_json()
+    assert postcode_json["data"]["attributes"]["lat"] == 51.01467
+    for area in postcode_json["included"]:
+        if area["type"] == "areas":
+            assert set(area["attributes"].keys()) <= {"name"}
+
+
 def test_postcode_missing_json(client):
     rv = client.get("/postcodes/14214124")
     assert rv.mimetype == "application/json"
@@ -86,3 +128,86 @@ def test_postcode_hashes_too_small(client):
     )
     assert rv.headers["Access-Control-Allow-Origin"] == "*"
     assert rv.status_code == 400
+
+
+def test_postcode_bulk(client):
+    rv = client.post(
+        "/postcodes/bulk",
+        json={"postcodes": ["ex364at", "EX36 4EJ", "XX1 1XX"], "properties": ["laua"]},
+    )
+    assert rv.status_code == 200
+    assert rv.mimetype == "application/json"
+    data = rv.json["data"]
+    assert [r["query"] for r in data] == ["ex364at", "EX36 4EJ", "XX1 1XX"]
+    assert data[0]["id"] == "EX36 4AT"
+    assert data[0]["found"] is True
+    assert data[1]["found"] is True
+    assert data[2]["found"] is False
+    assert "nearest_places" not in data[1]
+
+
+def test_postcode_bulk_form(client):
+    rv = client.post(
+        "/postcodes/bulk",
+        data={"postcodes": ["EX36 4AT", "EX36 4EJ"], "properties": ["laua_name"]},
+    )
+    assert rv.status_code == 200
+    assert len(rv.json["data"]) == 2
+    assert "laua_name" in rv.json["data"][0]
+
+
+def test_postcode_bulk_ndjson(client):
+    rv = client.post("/postcodes/bulk.ndjson", json=["EX36 4AT", "EX36 4EJ"])
+    assert rv.status_code == 200
+    assert rv.mimetype == "application/x-ndjson"
+    lines = rv.get_data(as_text=True).splitlines()
+    assert len(lines) == 2
+    assert json.loads(lines[0])["id"] == "EX36 4AT"
+
+
+def test_postcode_bulk_empty(client):
+    rv = client.post("/postcodes/bulk", json={"postcodes": []})
+    assert rv.status_code == 400
+
+
+def test_postcode_bulk_too_many(client):
+    rv = client.post("/postcodes/bulk", json={"postcodes": ["EX36 4AT"] * 5001})
+    assert rv.status_code == 400
+
+
+def test_postcode_etag(client):
+    rv = client.get("/postcodes/EX36 4AT.json")
+    assert rv.status_code == 200
+    etag = rv.headers["ETag"]
+    assert not etag.startswith("W/")
+    assert "max-age" in rv.headers["Cache-Control"]
+
+    # the same url gives the same etag, a different one doesn't
+    assert client.get("/postcodes/EX36 4AT.json").headers["ETag"] == etag
+    assert client.get("/postcodes/EX36 4AT.html").headers["ETag"] != etag
+
+    client.db.calls.clear()
+    rv = client.get("/postcodes/EX36 4AT.json", headers={"If-None-Match": etag})
+    assert rv.status_code == 304
+    assert rv.headers["ETag"] == etag
+    assert not rv.data
+    assert client.db.calls == []
+
+
+def test_postcode_missing_no_etag(client):
+    rv = client.get("/postcodes/XX1 1XX.json")
+    assert rv.status_code == 404
+    assert "ETag" not in rv.headers
+
+
+def test_postcode_bulk_bad_properties(client):
+    for properties in ["laua", [1, 2], {"laua": True}]:
+        rv = client.post(
+            "/postcodes/bulk",
+            json={"postcodes": ["EX36 4AT"], "properties": properties},
+        )
+        assert rv.status_code == 400
+    rv = client.post(
+        "/postcodes/bulk", json={"postcodes": ["EX36 4AT"], "properties": None}
+    )
+    assert rv.status_code == 200
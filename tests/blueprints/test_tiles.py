@@ -0,0 +1,95 @@
+from findthatpostcode.boundaries import boundary_manifest
+from findthatpostcode.cache import boundary_cache
+
+
+def set_manifest(boundaries):
+    previous = (
+        boundary_manifest.version,
+        boundary_manifest.boundaries,
+        boundary_manifest.loaded,
+    )
+    boundary_manifest.version = "20260801120000"
+    boundary_manifest.boundaries = boundaries
+    boundary_manifest.loaded = True
+    return previous
+
+
+def reset_manifest(previous):
+    (
+        boundary_manifest.version,
+        boundary_manifest.boundaries,
+        boundary_manifest.loaded,
+    ) = previous
+
+
+def test_tile(client):
+    previous = set_manifest(
+        {
+            "S02000783": {"size": 100, "bbox": [100, 0, 101, 1], "detail": {}},
+            "E01020135": {"size": 100, "bbox": [-1, 50, 0, 51], "detail": {}},
+        }
+    )
+    try:
+        rv = client.get("/tiles/msoa21/8/199/127.mvt")
+        assert rv.status_code == 200
+        assert rv.mimetype == "application/vnd.mapbox-vector-tile"
+        assert b"S02000783" in rv.data
+        assert b"Lower Bow & Larkfield" in rv.data
+        assert "S02000783.json" in client.s3_client.downloads[-1]
+
+        # areas of other types, or outside the tile, aren't fetched
+        rv = client.get("/tiles/lsoa21/8/199/127.mvt")
+        assert rv.status_code == 200
+        assert b"E01020135" not in rv.data
+    finally:
+        reset_manifest(previous)
+
+
+def test_tile_cached(client):
+    boundary_cache.clear()
+    previous = set_manifest(
+        {"S02000783": {"size": 100, "bbox": [100, 0, 101, 1], "detail": {}}}
+    )
+    try:
+        first = client.get("/tiles/msoa21/8/199/127.mvt")
+        assert b"S02000783" in first.data
+
+        # the tile is kept in memory, without a BOUNDARY_CACHE_DIR
+        client.db.calls.clear()
+        client.s3_client.downloads.clear()
+        second = client.get("/tiles/msoa21/8/199/127.mvt")
+        assert second.data == first.data
+        assert client.s3_client.downloads == []
+        assert "mget" not in client.db.calls
+    finally:
+        reset_manifest(previous)
+
+
+def test_tile_missing_bbox(client):
+    boundary_cache.clear()
+    previous = set_manifest(
+        {
+            "S02000783": {"size": 100, "bbox": None, "detail": {}},
+            "E01020135": {"size": 100, "bbox": None, "detail": {}},
+        }
+    )
+    try:
+        # the boundaries aren't downloaded during the request to find the
+        # bbox, so the areas are left out
+        rv = client.get("/tiles/msoa21/8/199/127.mvt")
+        assert rv.status_code == 200
+        assert b"S02000783" not in rv.data
+        assert "S02/S02000783.json" not in client.s3_client.downloads
+    finally:
+        reset_manifest(previous)
+
+
+def test_tile_no_manifest(client):
+    # the mock S3 client has no manifest
+    rv = client.get("/tiles/msoa21/8/199/127.mvt")
+    assert rv.status_code == 404
+
+
+def test_tile_invalid(client):
+    assert client.get("/tiles/notatype/8/199/127.mvt").status_code == 404
+    assert client.get("/tiles/msoa21/1/2/0.mvt").status_code == 404
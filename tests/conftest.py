@@ -4,9 +4,11 @@ import os
 from contextlib import contextmanager
 
 import pytest
+from botocore.exceptions import ClientError
 from flask import appcontext_pushed, g
 
 import findthatpostcode
+from findthatpostcode.boundaries import MANIFEST_KEY
 
 mock_data = {}
 mock_data_dir = os.path.join(os.path.dirname(__file__), "mock_data")
@@ -29,11 +31,13 @@ def db_set(app, db, s3_client):
 def client():
     app = findthatpostcode.create_app()
     app.config["TESTING"] = True
-    db = MockElasticsearch()
+    db = CountingElasticsearch()
     s3_client = MockBoto3()
 
     with db_set(app, db, s3_client):
         with app.test_client() as client:
+            client.db = db
+            client.s3_client = s3_client
             # with app.app_context():
             #     app.init_db()
             yield client
@@ -41,9 +45,12 @@ def client():
 
 class MockBoto3:
     def __init__(self, *args, **kwargs):
-        pass
+        self.downloads = []
 
     def download_fileobj(self, bucket, filepath, fileobj, **kwargs):
+        self.downloads.append(filepath)
+        if filepath == MANIFEST_KEY:
+            raise ClientError({"Error": {"Code": "404"}}, "GetObject")
         fileobj.write(json.dumps(mock_data.get("geo_boundary")).encode("utf-8"))
 
     def upload_fileobj(self, *args, **kwargs):
@@ -129,6 +136,9 @@ class MockElasticsearch:
         for i in index:
             hits.extend(copy.deepcopy(mock_data.get(i, [])))
         hits = hits[: kwargs.get("size", 10)]
+        for h in hits:
+            for field in kwargs.get("_source_excludes", []):
+                h.get("_source", {}).pop(field, None)
 
         # if there's a sort parameter then include a sort array
         if kwargs.get("body", {}).get("sort", []):
@@ -157,6 +167,12 @@ class MockElasticsearch:
             "found": False,
         }
 
+    def mget(self, body=None, index=None, **kwargs):
+        docs = body.get("docs") or [{"_id": i} for i in body.get("ids", [])]
+        return {
+            "docs": [self.get(index=d.get("_index", index), id=d["_id"]) for d in docs]
+        }
+
     def scroll(self, body=None, scroll_id=None, **kwargs):
         result = self.search_result_wrapper()
         result["_scroll_id"] = None
@@ -164,3 +180,17 @@ class MockElasticsearch:
 
     def clear_scroll(self, **kwargs):
         pass
+
+
+class CountingElasticsearch(MockElasticsearch):
+    """Records the name of each method called, to check the number of requests"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.calls = []
+
+    def __getattribute__(self, name):
+        attr = super().__getattribute__(name)
+        if name in ("search", "get", "mget", "scroll"):
+            super().__getattribute__("calls").append(name)
+        return attr
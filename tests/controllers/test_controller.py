@@ -1,4 +1,7 @@
-from findthatpostcode.controllers.controller import Controller
+import threading
+import time
+
+from findthatpostcode.controllers.controller import Controller, run_queries
 from tests.conftest import MockElasticsearch
 
 
@@ -36,3 +39,28 @@ def test_controller_fetch():
     assert len(a.attributes) > 4
     assert a.found is True
     assert len(a.get_errors()) == 0
+
+
+def test_run_queries():
+    def slow(value):
+        def query():
+            time.sleep(0.2)
+            return value, threading.current_thread().name
+
+        return query
+
+    start = time.perf_counter()
+    results, timings = run_queries({"a": slow(1), "b": slow(2), "c": slow(3)})
+    assert time.perf_counter() - start < 0.5
+    assert {k: v[0] for k, v in results.items()} == {"a": 1, "b": 2, "c": 3}
+    assert set(timings) == {"a", "b", "c"}
+    assert all(t >= 0.2 for t in timings.values())
+
+
+def test_run_queries_nested():
+    # queries run from the pool don't wait for more threads from the pool
+    def outer():
+        return run_queries({"x": lambda: 1, "y": lambda: 2})[0]
+
+    results, _ = run_queries({i: outer for i in "abcdefghijkl"})
+    assert all(r == {"x": 1, "y": 2} for r in results.values())
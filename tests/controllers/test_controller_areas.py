@@ -1,8 +1,14 @@
 import types
 
-from findthatpostcode.controllers.areas import Area, get_all_areas, search_areas
+from findthatpostcode.controllers.areas import (
+    Area,
+    Areatype,
+    get_all_areas,
+    get_areas_by_code,
+    search_areas,
+)
 from findthatpostcode.controllers.postcodes import Postcode
-from tests.conftest import MockElasticsearch
+from tests.conftest import CountingElasticsearch, MockElasticsearch
 
 
 def test_area_class():
@@ -24,6 +30,50 @@ def test_area_class_es():
 
     assert len(a.relationships["example_postcodes"]) > 0
     assert isinstance(a.relationships["example_postcodes"][0], Postcode)
+    assert "area" in a.timings
+    assert "example_postcodes" in a.timings
+
+
+def test_area_children_stored():
+    es = CountingElasticsearch()
+    a = Area.get_from_es("S02000783", es, include=["children"])
+
+    # children are read from the area document rather than searched for
+    assert "search" not in es.calls
+    assert "children" not in a.attributes
+    assert a.attributes["child_count"] == 3
+    assert a.attributes["child_counts"] == {"lsoa11": 2, "oa11": 1}
+    assert [c.id for c in a.relationships["children"]["lsoa11"]] == [
+        "S01000126",
+        "S01000127",
+    ]
+    assert a.relationships["children"]["lsoa11"][0].attributes["name"] == "Mallard Bowl"
+
+
+def test_area_example_postcodes_stored():
+    es = CountingElasticsearch()
+    a = Area.get_from_es("E01020122", es, include=["example_postcodes"])
+
+    # example postcodes are fetched by id rather than searched for
+    assert "search" not in es.calls
+    assert [p.id for p in a.relationships["example_postcodes"]] == [
+        "EX36 4EJ",
+        "EX36 4AT",
+    ]
+    assert "example_postcodes" not in a.attributes
+
+
+def test_get_areas_by_code():
+    es = MockElasticsearch()
+    a = get_areas_by_code(["S02000783", "E01020135", "S02000783", "X99999999"], es)
+
+    assert list(a.keys()) == ["S02000783", "E01020135"]
+    assert isinstance(a["E01020135"], Area)
+    assert a["S02000783"].attributes["name"] == (
+        "Lower Bow & Larkfield, Fancy Farm, Mallard Bowl"
+    )
+    assert a["E01020135"].relationships["areatype"].id == "lsoa21"
+    assert get_areas_by_code([], es) == {}
 
 
 def test_search_areas():
@@ -36,6 +86,20 @@ def test_search_areas():
     assert isinstance(a["result"][0], Area)
 
 
+def test_area_lists_exclude_stored_lists():
+    es = MockElasticsearch()
+    areas = search_areas("test", es)["result"]
+    assert "S02000783" in [a.id for a in areas]
+    assert "E01020122" in [a.id for a in areas]
+
+    areatype = Areatype("msoa21")
+    areatype.get_areas(es)
+    areas += areatype.relationships["areas"]
+    for area in areas:
+        assert "children" not in area.attributes
+        assert "example_postcodes" not in area.attributes
+
+
 def test_get_all_areas():
     es = MockElasticsearch()
     a = get_all_areas(es)
@@ -1,5 +1,10 @@
+from findthatpostcode.controllers.controller import (
+    NEAREST_SEARCH_RADII,
+    in_uk_bbox,
+    nearest_search,
+)
 from findthatpostcode.controllers.points import Point
-from tests.conftest import MockElasticsearch
+from tests.conftest import CountingElasticsearch, MockElasticsearch
 
 
 def test_point_class():
@@ -11,9 +16,39 @@ def test_point_class():
 
 def test_point_class_es():
     es = MockElasticsearch()
-    a = Point.get_from_es((100, -100), es)
+    a = Point.get_from_es((51.0, -3.8), es)
 
-    assert a.id == (100, -100)
+    assert a.id == (51.0, -3.8)
     assert a.relationships["nearest_postcode"].id == "EX36 4AT"
     assert a.relationships["nearest_postcode"].attributes["oseast1m"] == 271505
-    assert str(a) == "<Point 100, -100>"
+    assert str(a) == "<Point 51.0, -3.8>"
+
+
+def test_point_outside_uk():
+    es = CountingElasticsearch()
+    a = Point.get_from_es((100, -100), es)
+
+    assert es.calls == []
+    assert "nearest_postcode" not in a.relationships
+    assert a.get_errors()[0]["code"] == "point_outside_uk"
+    assert a.topJSON()["errors"][0]["title"] == "Point is outside the UK"
+
+
+def test_nearest_search():
+    es = CountingElasticsearch()
+    result = nearest_search(es, "geo_postcode", 51.0, -3.8, size=1)
+    assert es.calls == ["search"]
+    assert len(result["hits"]["hits"]) == 1
+
+    # widen the search until enough results are found
+    es = CountingElasticsearch()
+    nearest_search(es, "geo_postcode", 51.0, -3.8, size=1000)
+    assert es.calls == ["search"] * (len(NEAREST_SEARCH_RADII) + 1)
+
+
+def test_in_uk_bbox():
+    assert in_uk_bbox(51.5, -0.1)
+    assert in_uk_bbox("60.15", "-1.15")
+    assert not in_uk_bbox(48.85, 2.35)
+    assert not in_uk_bbox(100, -100)
+    assert not in_uk_bbox("x", 0)
@@ -1,5 +1,6 @@
+from findthatpostcode.controllers.places import Place
 from findthatpostcode.controllers.postcodes import Postcode
-from tests.conftest import MockElasticsearch
+from tests.conftest import CountingElasticsearch, MockElasticsearch
 
 
 def test_postcode_class():
@@ -16,3 +17,31 @@ def test_postcode_class_es():
     assert a.id == "EX36 4AT"
     assert a.attributes["oseast1m"] == 271505
     assert str(a) == "<Postcode EX36 4AT>"
+
+
+def test_postcode_stored_nearest_places():
+    es = MockElasticsearch()
+    a = Postcode.get_from_es("EX36 4EJ", es)
+
+    assert "nearest_places" not in a.attributes
+    assert [p.id for p in a.relationships["nearest_places"]] == [
+        "IPN0113538",
+        "IPN0020716",
+    ]
+    assert isinstance(a.relationships["nearest_places"][0], Place)
+    assert a.relationships["nearest_places"][0].attributes["name"] == "South Molton"
+
+
+def test_postcode_include():
+    es = CountingElasticsearch()
+    a = Postcode.get_from_es("EX36 4AT", es, include=[])
+    assert a.found
+    assert es.calls == ["get"]
+    assert "areas" not in a.relationships
+    assert "laua_name" not in a.attributes
+
+    es = CountingElasticsearch()
+    a = Postcode.get_from_es("EX36 4AT", es, include=["areas"])
+    assert "search" not in es.calls
+    assert a.attributes["lsoa21_name"]
+    assert "nearest_places" not in a.relationships
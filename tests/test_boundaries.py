@@ -0,0 +1,238 @@
+import csv
+import json
+
+import pytest
+from botocore.exceptions import ClientError
+
+from findthatpostcode.boundaries import (
+    MANIFEST_KEY,
+    BoundaryManifest,
+    add_missing_bboxes,
+    boundary_key,
+    boundary_manifest,
+    detail_for_zoom,
+    list_boundaries,
+    read_manifest,
+    write_manifest,
+)
+from findthatpostcode.cache import MISSING, DiskCache, boundary_cache
+from findthatpostcode.controllers.areas import get_boundary_file
+
+
+class DictS3:
+    """Stores uploaded files in a dict"""
+
+    def __init__(self, files=None):
+        self.files = files or {}
+        self.downloads = 0
+
+    def download_fileobj(self, bucket, key, fileobj):
+        self.downloads += 1
+        if key not in self.files:
+            raise ClientError({"Error": {"Code": "404"}}, "GetObject")
+        fileobj.write(self.files[key])
+
+    def upload_fileobj(self, fileobj, bucket, key):
+        self.files[key] = fileobj.read()
+
+    def get_paginator(self, name):
+        files = self.files
+
+        class Paginator:
+            def paginate(self, Bucket):
+                yield {
+                    "Contents": [{"Key": k, "Size": len(v)} for k, v in files.items()]
+                }
+
+        return Paginator()
+
+
+def test_manifest_roundtrip():
+    client = DictS3()
+    assert read_manifest(client, "bucket") is None
+    write_manifest(client, "bucket", {"E01000001": {"size": 10, "bbox": [0, 0, 1, 1]}})
+    assert read_manifest(client, "bucket") == {
+        "E01000001": {"size": 10, "bbox": [0, 0, 1, 1]}
+    }
+
+
+def test_manifest_load():
+    client = DictS3()
+    manifest = BoundaryManifest()
+
+    # with no manifest the boundaries need to be checked directly
+    manifest.load(client, "bucket", "1")
+    assert manifest.loaded is False
+
+    write_manifest(client, "bucket", {"E01000001": {"size": 10, "bbox": None}})
+    manifest.load(client, "bucket", "1")
+    assert manifest.loaded is False
+    assert client.downloads == 1
+
+    # a new data version reloads the manifest
+    manifest.load(client, "bucket", "2")
+    assert manifest.loaded is True
+    assert "E01000001" in manifest
+    assert "E01000002" not in manifest
+    assert manifest.get("E01000001")["size"] == 10
+    manifest.load(client, "bucket", "2")
+    assert client.downloads == 2
+
+
+def test_list_boundaries():
+    client = DictS3(
+        {
+            "E01/E01000001.json": b"{}",
+            "E02/E02000001.json": b'{"a": 1}',
+            "low/E02/E02000001.json": b"{}",
+            MANIFEST_KEY: json.dumps({"boundaries": {}}).encode(),
+        }
+    )
+    assert list_boundaries(client, "bucket") == {
+        "E01000001": {"size": 2, "bbox": None, "detail": {}},
+        "E02000001": {"size": 8, "bbox": None, "detail": {"low": 2}},
+    }
+
+
+def test_area_without_boundary_in_manifest(client):
+    client.get("/version")
+    version, boundaries, loaded = (
+        boundary_manifest.version,
+        boundary_manifest.boundaries,
+        boundary_manifest.loaded,
+    )
+    try:
+        boundary_manifest.version = "20260801120000"
+        boundary_manifest.boundaries = {}
+        boundary_manifest.loaded = True
+
+        rv = client.get("/areas/S02000783.json?manifest=1")
+        assert rv.status_code == 200
+        assert "geojson" not in rv.json["links"]
+        assert client.s3_client.downloads == []
+
+        rv = client.get("/areas/S02000783.geojson")
+        assert rv.status_code == 404
+        assert client.s3_client.downloads == []
+    finally:
+        boundary_manifest.version = version
+        boundary_manifest.boundaries = boundaries
+        boundary_manifest.loaded = loaded
+
+
+def test_boundary_disk_cache(client, tmp_path):
+    backends = boundary_cache.backends
+    boundary_cache.backends = [DiskCache(str(tmp_path))]
+    try:
+        rv = client.get("/areas/S02000783.geojson?cached=1")
+        assert rv.status_code == 200
+        assert client.s3_client.downloads.count("S02/S02000783.json") == 1
+
+        rv = client.get("/areas/S02000783.geojson?cached=2")
+        assert rv.status_code == 200
+        assert client.s3_client.downloads.count("S02/S02000783.json") == 1
+    finally:
+        boundary_cache.backends = backends
+
+
+def test_boundary_file_errors():
+    class ErrorS3(DictS3):
+        code = "404"
+
+        def download_fileobj(self, bucket, key, fileobj):
+            self.downloads += 1
+            raise ClientError({"Error": {"Code": self.code}}, "GetObject")
+
+    boundary_cache.clear()
+    client = ErrorS3()
+    # files that don't exist are cached
+    assert get_boundary_file("E01/E01000001.json", client, "bucket") is None
+    assert get_boundary_file("E01/E01000001.json", client, "bucket") is None
+    assert client.downloads == 1
+
+    # other errors might not happen next time, so aren't cached
+    for code in ("403", "SlowDown", "500"):
+        client.code = code
+        with pytest.raises(ClientError):
+            get_boundary_file("E01/E01000002.json", client, "bucket")
+        assert boundary_cache.get("E01/E01000002.json") is MISSING
+
+
+def test_detail_for_zoom():
+    assert detail_for_zoom(5) == "low"
+    assert detail_for_zoom(10) == "medium"
+    assert detail_for_zoom(13) == "high"
+    assert detail_for_zoom(18) is None
+    assert boundary_key("E01000001", "low") == "low/E01/E01000001.json"
+
+
+def test_area_geojson_detail(client):
+    rv = client.get("/areas/S02000783.geojson?detail=low")
+    assert rv.status_code == 200
+    assert "low/S02/S02000783.json" in client.s3_client.downloads
+
+    rv = client.get("/areas/E01020135.geojson?zoom=16")
+    assert rv.status_code == 200
+    assert client.s3_client.downloads[-1] == "E01/E01020135.json"
+
+
+def test_manifest_intersecting():
+    manifest = BoundaryManifest()
+    manifest.boundaries = {
+        "E01000001": {"bbox": [0, 0, 1, 1]},
+        "E01000002": {"bbox": [2, 2, 3, 3]},
+        "E02000001": {"bbox": [0, 0, 3, 3]},
+        "E01000003": {"bbox": None},
+    }
+    assert manifest.intersecting([0.5, 0.5, 2.5, 2.5]) == [
+        "E01000001",
+        "E01000002",
+        "E02000001",
+    ]
+    assert manifest.intersecting([0.5, 0.5, 1.5, 1.5], {"E01"}) == ["E01000001"]
+    assert manifest.intersecting([4, 4, 5, 5]) == []
+
+    # the index is rebuilt when the manifest is reloaded
+    manifest.boundaries = {"E01000004": {"bbox": [4, 4, 5, 5]}}
+    assert manifest.intersecting([4, 4, 5, 5]) == ["E01000004"]
+
+
+def test_add_missing_bboxes():
+    triangle = {"type": "Polygon", "coordinates": [[[0, 0], [1, 0], [1, 2], [0, 0]]]}
+    client = DictS3(
+        {
+            boundary_key("E01000001"): json.dumps({"geometry": triangle}).encode(),
+            boundary_key("E01000002", "low"): b"{}",
+        }
+    )
+    boundaries = list_boundaries(client, "bucket")
+    boundaries["E01000003"] = {"size": 10, "bbox": [4, 4, 5, 5], "detail": {}}
+    client.downloads = 0
+
+    assert add_missing_bboxes(client, "bucket", boundaries) == ["E01000001"]
+    assert boundaries["E01000001"]["bbox"] == [0, 0, 1, 2]
+    # there's no full boundary to find the bbox of
+    assert boundaries["E01000002"]["bbox"] is None
+    assert boundaries["E01000003"]["bbox"] == [4, 4, 5, 5]
+    assert client.downloads == 2
+
+
+def test_check_boundaries(client, tmp_path, monkeypatch):
+    s3 = DictS3()
+    write_manifest(
+        s3,
+        "bucket",
+        {
+            "E01020135": {"size": 10, "bbox": [0, 0, 1, 1], "detail": {}},
+            # only a simplified boundary
+            "E01020122": {"bbox": None, "detail": {"low": 5}},
+        },
+    )
+    monkeypatch.setattr(client.s3_client, "download_fileobj", s3.download_fileobj)
+    monkeypatch.chdir(tmp_path)
+
+    result = client.application.test_cli_runner().invoke(args=["check", "boundaries"])
+    assert result.exit_code == 0, result.output
+    with open(tmp_path / "boundaries.csv") as f:
+        rows = {row["prefix"]: row for row in csv.DictReader(f)}
+    assert rows["E01"]["total_with_boundary"] == "1"
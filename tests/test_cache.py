@@ -0,0 +1,139 @@
+import time
+
+from findthatpostcode.cache import (
+    MISSING,
+    DiskCache,
+    LRUCache,
+    SQLiteCache,
+    TieredCache,
+    area_cache,
+)
+from findthatpostcode.controllers.areas import get_area_sources
+from tests.conftest import CountingElasticsearch
+
+
+def test_lru_cache():
+    cache = LRUCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", None)
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("c") is MISSING
+
+    # "a" is the least recently used item
+    cache.set("c", 3)
+    assert len(cache) == 2
+    assert cache.get("a") is MISSING
+    assert cache.get("b") is None
+    assert cache.stats()["hits"] == 3
+    assert cache.stats()["misses"] == 2
+
+    # changing the version clears the cache
+    cache.set_version("20250101")
+    assert len(cache) == 0
+    assert cache.stats()["version"] == "20250101"
+
+
+def test_lru_cache_ttl():
+    cache = LRUCache(maxsize=2, ttl=-1)
+    cache.set("a", 1)
+    time.sleep(0.01)
+    assert cache.get("a") is MISSING
+    assert len(cache) == 0
+
+
+def test_lru_cache_maxbytes():
+    cache = LRUCache(maxsize=10, maxbytes=10)
+    cache.set("a", b"12345")
+    cache.set("b", b"1234")
+    cache.set("c", None)
+    assert cache.stats()["bytes"] == 9
+    # "a" is removed to make space
+    cache.set("d", b"123")
+    assert cache.get("a") is MISSING
+    assert cache.get("b") == b"1234"
+    assert cache.stats()["bytes"] == 7
+    # replacing an item replaces its size
+    cache.set("b", b"1")
+    assert cache.stats()["bytes"] == 4
+    # items larger than the cache aren't kept
+    cache.set("e", b"x" * 11)
+    assert cache.get("e") is MISSING
+    assert cache.get("d") == b"123"
+
+
+def test_sqlite_cache(tmp_path):
+    cache = SQLiteCache(str(tmp_path / "cache.db"))
+    cache.set_version("20250101")
+    cache.set("a", b"value")
+    assert cache.get("a") == b"value"
+    assert cache.get("b") is MISSING
+
+    # a second process using the same file sees the same items
+    other = SQLiteCache(str(tmp_path / "cache.db"))
+    other.set_version("20250101")
+    assert other.get("a") == b"value"
+
+    # a new data version removes the old items
+    other.set_version("20250201")
+    assert other.get("a") is MISSING
+    cache.set_version("20250201")
+    assert len(cache) == 0
+
+
+def test_disk_cache(tmp_path):
+    cache = DiskCache(str(tmp_path), maxbytes=25)
+    cache.set_version("1")
+    cache.set("a", b"0123456789")
+    cache.set("missing", None)
+    assert cache.get("a") == b"0123456789"
+    assert cache.get("missing") is None
+    assert cache.get("b") is MISSING
+
+    # another process sharing the directory sees the same items
+    other = DiskCache(str(tmp_path), maxbytes=25)
+    other.set_version("1")
+    assert other.get("a") == b"0123456789"
+
+    # the least recently used item is removed when over the size limit
+    cache.set("b", b"0123456789")
+    time.sleep(0.01)
+    cache.get("a")
+    cache.set("c", b"0123456789")
+    assert cache.get("b") is MISSING
+    assert cache.get("a") == b"0123456789"
+    assert cache.get("c") == b"0123456789"
+
+    # a new data version removes the old files
+    cache.set_version("2")
+    assert cache.get("a") is MISSING
+    assert not (tmp_path / "1").exists()
+
+
+def test_tiered_cache(tmp_path):
+    memory = LRUCache()
+    disk = SQLiteCache(str(tmp_path / "cache.db"))
+    cache = TieredCache([memory, disk])
+    disk.set("a", b"value")
+    assert memory.get("a") is MISSING
+    assert cache.get("a") == b"value"
+    assert memory.get("a") == b"value"
+
+
+def test_get_area_sources_cached():
+    area_cache.clear()
+    es = CountingElasticsearch()
+    areas = get_area_sources(["S02000783", "X99999999"], es, fields=["name"])
+    assert areas["S02000783"]["code"] == "S02000783"
+    assert areas["X99999999"] is None
+    assert es.calls.count("mget") == 1
+
+    # found and missing areas are both served from the cache
+    areas = get_area_sources(["X99999999", "S02000783"], es, fields=["name"])
+    assert list(areas.keys()) == ["X99999999", "S02000783"]
+    assert es.calls.count("mget") == 1
+
+    # copies are returned so callers can't change the cached documents
+    areas["S02000783"]["code"] = "changed"
+    areas = get_area_sources(["S02000783"], es, fields=["name"])
+    assert areas["S02000783"]["code"] == "S02000783"
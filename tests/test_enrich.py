@@ -0,0 +1,77 @@
+import csv
+import gzip
+import io
+import zipfile
+
+from findthatpostcode.commands.enrich import enrich_csv
+
+CSV_INPUT = "name,pc\nA,EX36 4AT\nB,XX1 1XX\n"
+
+
+def read_rows(text):
+    return list(csv.DictReader(io.StringIO(text)))
+
+
+def test_enrich_csv(client, tmp_path):
+    infile = tmp_path / "input.csv.gz"
+    with gzip.open(infile, "wt") as f:
+        f.write(CSV_INPUT)
+    outfile = tmp_path / "output.csv"
+
+    runner = client.application.test_cli_runner()
+    result = runner.invoke(
+        args=[
+            "enrich",
+            "csv",
+            str(infile),
+            str(outfile),
+            "-c",
+            "pc",
+            "-f",
+            "latlng,laua",
+            "-f",
+            "lsoa21",
+        ],
+    )
+    assert result.exit_code == 0, result.output
+    assert "2 rows in" in result.output
+
+    rows = read_rows(outfile.read_text())
+    assert list(rows[0].keys()) == ["name", "pc", "laua", "lsoa21", "lat", "long"]
+    assert rows[0]["laua"] == "E07000043"
+    assert rows[0]["lat"]
+    assert rows[1]["laua"] == ""
+
+
+def test_enrich_csv_zip_to_stdout(client, tmp_path):
+    infile = tmp_path / "input.zip"
+    with zipfile.ZipFile(infile, "w") as z:
+        z.writestr("readme.txt", "not a csv")
+        z.writestr("input.csv", CSV_INPUT)
+
+    result = client.application.test_cli_runner().invoke(
+        enrich_csv, [str(infile), "-c", "pc", "--stats"]
+    )
+    assert result.exit_code == 0, result.output
+    rows = read_rows(result.stdout)
+    assert rows[0]["laua_name"]
+    assert "imd2025_rank" in rows[0]
+    assert "rows/sec" in result.stderr
+
+
+def test_enrich_csv_points(client, tmp_path):
+    infile = tmp_path / "input.csv"
+    infile.write_text("name,e,n\nA,271505,125521\n")
+
+    runner = client.application.test_cli_runner()
+    result = runner.invoke(
+        enrich_csv, [str(infile), "--easting", "e", "--northing", "n", "-f", "laua"]
+    )
+    assert result.exit_code == 0, result.output
+    rows = read_rows(result.stdout)
+    assert rows[0]["nearest_postcode"] == "EX36 4AT"
+    assert rows[0]["outside_uk"] == "False"
+    assert rows[0]["laua"] == "E07000043"
+
+    result = runner.invoke(enrich_csv, [str(infile), "--easting", "e"])
+    assert result.exit_code == 2
@@ -0,0 +1,187 @@
+import json
+import struct
+
+import pytest
+
+from findthatpostcode.formats import FGB_MAGIC, to_flatgeobuf, to_topojson
+
+# two squares that share an edge
+WEST = {
+    "type": "Feature",
+    "properties": {"code": "W", "count": 1, "active": True},
+    "geometry": {
+        "type": "Polygon",
+        "coordinates": [[[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]]],
+    },
+}
+EAST = {
+    "type": "Feature",
+    "properties": {"code": "E", "count": 2.5, "active": False},
+    "geometry": {
+        "type": "MultiPolygon",
+        "coordinates": [[[[1, 0], [2, 0], [2, 1], [1, 1], [1, 0]]]],
+    },
+}
+
+
+def decode_arc(topology, index):
+    scale = topology["transform"]["scale"]
+    translate = topology["transform"]["translate"]
+    arc = topology["arcs"][index if index >= 0 else ~index]
+    x = y = 0
+    points = []
+    for dx, dy in arc:
+        x += dx
+        y += dy
+        points.append(
+            (
+                round(x * scale[0] + translate[0], 5),
+                round(y * scale[1] + translate[1], 5),
+            )
+        )
+    return points if index >= 0 else points[::-1]
+
+
+def decode_ring(topology, arcs):
+    points = []
+    for index in arcs:
+        arc = decode_arc(topology, index)
+        points.extend(arc if not points else arc[1:])
+    return points
+
+
+def test_topojson_shared_arcs():
+    topology = to_topojson([WEST, EAST])
+    assert topology["type"] == "Topology"
+    geometries = topology["objects"]["areas"]["geometries"]
+    assert [g["type"] for g in geometries] == ["Polygon", "MultiPolygon"]
+    assert geometries[0]["properties"]["code"] == "W"
+
+    # the shared edge is stored once and used in both directions
+    west_arcs = geometries[0]["arcs"][0]
+    east_arcs = geometries[1]["arcs"][0][0]
+    assert len(topology["arcs"]) == 3
+    shared = {i if i >= 0 else ~i for i in west_arcs} & {
+        i if i >= 0 else ~i for i in east_arcs
+    }
+    assert len(shared) == 1
+
+    # the rings can be rebuilt from the arcs
+    west = decode_ring(topology, west_arcs)
+    assert west[0] == west[-1]
+    assert set(west) == {(0, 0), (1, 0), (1, 1), (0, 1)}
+    east = decode_ring(topology, east_arcs)
+    assert set(east) == {(1, 0), (2, 0), (2, 1), (1, 1)}
+
+
+def test_topojson_empty():
+    topology = to_topojson([])
+    assert topology["arcs"] == []
+    assert topology["objects"]["areas"]["geometries"] == []
+
+
+def read_table(buffer, position):
+    """The position of each field in a flatbuffer table"""
+    vtable = position - struct.unpack_from("<i", buffer, position)[0]
+    vtable_size = struct.unpack_from("<H", buffer, vtable)[0]
+    fields = {}
+    for slot in range((vtable_size - 4) // 2):
+        offset = struct.unpack_from("<H", buffer, vtable + 4 + 2 * slot)[0]
+        if offset:
+            fields[slot] = position + offset
+    return fields
+
+
+def follow(buffer, position):
+    return position + struct.unpack_from("<I", buffer, position)[0]
+
+
+def read_vector(buffer, position, fmt):
+    start = follow(buffer, position)
+    length = struct.unpack_from("<I", buffer, start)[0]
+    return list(struct.unpack_from("<%d%s" % (length, fmt), buffer, start + 4))
+
+
+def read_string(buffer, position):
+    return bytes(read_vector(buffer, position, "B")).decode("utf8")
+
+
+def test_flatgeobuf():
+    content = to_flatgeobuf([WEST, EAST], metadata={"errors": {"X": "missing"}})
+    assert content.startswith(FGB_MAGIC)
+
+    # header
+    size = struct.unpack_from("<I", content, 8)[0]
+    header = content[12 : 12 + size]
+    fields = read_table(header, struct.unpack_from("<I", header, 0)[0])
+    assert read_string(header, fields[0]) == "areas"
+    assert read_vector(header, fields[1], "d") == [0, 0, 2, 1]
+    assert header[fields[2]] == 6
+    assert struct.unpack_from("<Q", header, fields[8])[0] == 2
+    assert struct.unpack_from("<H", header, fields[9])[0] == 0
+    assert json.loads(read_string(header, fields[13])) == {"errors": {"X": "missing"}}
+    columns = []
+    start = follow(header, fields[7])
+    for i in range(struct.unpack_from("<I", header, start)[0]):
+        column = read_table(header, follow(header, start + 4 + 4 * i))
+        columns.append((read_string(header, column[0]), header[column[1]]))
+    assert columns == [("code", 11), ("count", 10), ("active", 2)]
+
+    # features
+    position = 12 + size
+    features = []
+    while position < len(content):
+        size = struct.unpack_from("<I", content, position)[0]
+        features.append(content[position + 4 : position + 4 + size])
+        position += 4 + size
+    assert len(features) == 2
+
+    feature = features[1]
+    fields = read_table(feature, struct.unpack_from("<I", feature, 0)[0])
+    geometry = read_table(feature, follow(feature, fields[0]))
+    assert feature[geometry[6]] == 6
+    start = follow(feature, geometry[7])
+    assert struct.unpack_from("<I", feature, start)[0] == 1
+    part = read_table(feature, follow(feature, start + 4))
+    assert feature[part[6]] == 3
+    assert read_vector(feature, part[1], "d") == [1, 0, 2, 0, 2, 1, 1, 1, 1, 0]
+
+    properties = bytes(read_vector(feature, fields[1], "B"))
+    assert struct.unpack_from("<HI", properties, 0) == (0, 1)
+    assert properties[6:7] == b"E"
+    assert struct.unpack_from("<Hd", properties, 7) == (1, 2.5)
+    assert struct.unpack_from("<HB", properties, 17) == (2, 0)
+
+
+def read_with_gdal(path):
+    pyogrio = pytest.importorskip("pyogrio")
+    shapely = pytest.importorskip("shapely")
+    meta, _, geometries, fields = pyogrio.raw.read(path)
+    properties = [dict(zip(meta["fields"], values)) for values in zip(*fields)]
+    return [shapely.from_wkb(g) for g in geometries], properties
+
+
+def test_flatgeobuf_gdal(tmp_path):
+    path = tmp_path / "areas.fgb"
+    path.write_bytes(to_flatgeobuf([WEST, EAST]))
+    geometries, properties = read_with_gdal(str(path))
+
+    assert [g.bounds for g in geometries] == [(0, 0, 1, 1), (1, 0, 2, 1)]
+    assert [g.area for g in geometries] == [1, 1]
+    assert [p["code"] for p in properties] == ["W", "E"]
+    assert [p["count"] for p in properties] == [1, 2.5]
+    assert [bool(p["active"]) for p in properties] == [True, False]
+
+
+def test_topojson_gdal(tmp_path):
+    path = tmp_path / "areas.topojson"
+    path.write_text(json.dumps(to_topojson([WEST, EAST])))
+    geometries, properties = read_with_gdal(str(path))
+
+    # coordinates are only accurate to the quantization grid
+    for geometry, bounds in zip(geometries, [(0, 0, 1, 1), (1, 0, 2, 1)]):
+        assert geometry.bounds == pytest.approx(bounds, abs=1e-5)
+        assert geometry.area == pytest.approx(1, abs=1e-5)
+    assert [p["code"] for p in properties] == ["W", "E"]
+    assert [p["count"] for p in properties] == [1, 2.5]
+    assert [bool(p["active"]) for p in properties] == [True, False]
@@ -0,0 +1,109 @@
+import numpy as np
+from shapely.geometry import box
+
+from findthatpostcode.spatial import GridIndex, PolygonIndex, haversine
+
+
+def test_haversine():
+    # London to Edinburgh is roughly 534km
+    distance = haversine(51.5072, -0.1276, 55.9533, -3.1883)
+    assert 530000 < distance < 538000
+    assert haversine(51.5, -0.1, 51.5, -0.1) == 0
+
+
+def test_grid_index_nearest():
+    rng = np.random.default_rng(42)
+    lats = rng.uniform(50, 58, 2000)
+    lons = rng.uniform(-6, 1.5, 2000)
+    index = GridIndex(lats, lons, ids=np.arange(2000))
+
+    query_lats = rng.uniform(49, 59, 200)
+    query_lons = rng.uniform(-7, 2, 200)
+    nearest, distances = index.nearest(query_lats, query_lons, k=5)
+
+    # compare with a brute force search
+    all_distances = haversine(
+        query_lats[:, None], query_lons[:, None], lats[None, :], lons[None, :]
+    )
+    expected = np.argsort(all_distances, axis=1)[:, :5]
+    assert nearest.shape == (200, 5)
+    assert (index.ids[nearest] == expected).all()
+    assert np.allclose(
+        distances, np.take_along_axis(all_distances, expected, axis=1), atol=2
+    )
+
+
+def test_grid_index_max_distance():
+    index = GridIndex([51.0, 51.001, 52.0], [-3.0, -3.0, -3.0], ids=["a", "b", "c"])
+    nearest, distances = index.nearest([51.0], [-3.0], k=3, max_distance=1000)
+    assert list(index.ids[nearest[0][:2]]) == ["a", "b"]
+    assert nearest[0][2] == -1
+    assert np.isinf(distances[0][2])
+
+
+def test_grid_index_not_finite():
+    index = GridIndex([51.0, 52.0], [-3.0, -3.0], ids=["a", "b"])
+    nearest, distances = index.nearest(
+        [np.nan, 51.0, 0.0, 52.0], [0.0, -3.0, np.inf, -3.0], k=1
+    )
+    assert list(nearest[:, 0]) == [-1, 0, -1, 1]
+    assert np.isinf(distances[[0, 2], 0]).all()
+    assert distances[1, 0] == 0
+
+
+def test_grid_index_empty():
+    index = GridIndex([], [])
+    nearest, distances = index.nearest([51.0], [-3.0], k=2)
+    assert (nearest == -1).all()
+    assert np.isinf(distances).all()
+
+
+def test_grid_index_save_load(tmp_path):
+    rng = np.random.default_rng(1)
+    lats = rng.uniform(50, 58, 500)
+    lons = rng.uniform(-6, 1.5, 500)
+    ids = ["P%s" % i for i in range(500)]
+    index = GridIndex(lats, lons, ids=ids)
+    path = str(tmp_path / "postcodes.grid")
+    index.save(path)
+
+    for mmap in (True, False):
+        loaded = GridIndex.load(path, mmap=mmap)
+        assert len(loaded) == 500
+        assert loaded.bounds == index.bounds
+        assert isinstance(loaded.keys, np.memmap) == mmap
+        nearest, distances = loaded.nearest([51, 55], [-1, -3], k=3)
+        expected, expected_distances = index.nearest([51, 55], [-1, -3], k=3)
+        assert (loaded.ids[nearest] == index.ids[expected].astype(np.bytes_)).all()
+        assert np.allclose(distances, expected_distances)
+
+
+def test_grid_index_save_load_empty(tmp_path):
+    path = str(tmp_path / "empty.grid")
+    GridIndex([], [], ids=[]).save(path)
+    nearest, _ = GridIndex.load(path).nearest([51.0], [-3.0])
+    assert (nearest == -1).all()
+
+
+def test_polygon_index():
+    index = PolygonIndex(
+        ["A", "B", "C"],
+        [box(0, 50, 1, 51), box(1, 50, 2, 51), box(0, 50, 2, 52)],
+    )
+    assert len(index) == 3
+    assert index.memory > 0
+    assert index.build_time >= 0
+
+    results = index.containing([50.5, 50.5, 51.5, 53, 51], [0.5, 1.5, 1, 0, 1])
+    assert [sorted(r) for r in results] == [
+        ["A", "C"],
+        ["B", "C"],
+        ["C"],
+        [],
+        ["A", "B", "C"],
+    ]
+
+
+def test_polygon_index_empty():
+    index = PolygonIndex([], [])
+    assert index.containing([51], [0]) == [[]]
@@ -0,0 +1,143 @@
+import pytest
+
+from findthatpostcode.tiles import (
+    TILE_EXTENT,
+    encode_tile,
+    tile_bounds,
+    tile_features,
+    valid_tile,
+)
+
+SQUARE = {
+    "type": "Feature",
+    "properties": {"code": "E01000001", "name": "Square"},
+    "geometry": {
+        "type": "Polygon",
+        "coordinates": [[[100, 0], [101, 0], [101, 1], [100, 1], [100, 0]]],
+    },
+}
+
+
+def read_varint(data, position):
+    result = shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        result |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            return result, position
+
+
+def read_message(data):
+    """The fields in a protobuf message, as a list of (field, value)"""
+    fields = []
+    position = 0
+    while position < len(data):
+        key, position = read_varint(data, position)
+        field, wire_type = key >> 3, key & 0x7
+        if wire_type == 0:
+            value, position = read_varint(data, position)
+        elif wire_type == 1:
+            value = data[position : position + 8]
+            position += 8
+        elif wire_type == 2:
+            length, position = read_varint(data, position)
+            value = data[position : position + length]
+            position += length
+        else:
+            raise ValueError(wire_type)
+        fields.append((field, value))
+    return fields
+
+
+def read_packed(data):
+    values = []
+    position = 0
+    while position < len(data):
+        value, position = read_varint(data, position)
+        values.append(value)
+    return values
+
+
+def unzigzag(n):
+    return (n >> 1) ^ -(n & 1)
+
+
+def decode_rings(commands):
+    rings = []
+    x = y = 0
+    i = 0
+    while i < len(commands):
+        command, count = commands[i] & 0x7, commands[i] >> 3
+        i += 1
+        if command == 7:
+            continue
+        for _ in range(count):
+            x += unzigzag(commands[i])
+            y += unzigzag(commands[i + 1])
+            i += 2
+            if command == 1:
+                rings.append([])
+            rings[-1].append((x, y))
+    return rings
+
+
+def shoelace(ring):
+    return sum(
+        x1 * y2 - x2 * y1 for (x1, y1), (x2, y2) in zip(ring, ring[1:] + ring[:1])
+    )
+
+
+def test_tile_bounds():
+    assert tile_bounds(0, 0, 0) == pytest.approx([-180, -85.0511, 180, 85.0511])
+    assert tile_bounds(1, 1, 0) == pytest.approx([0, 0, 180, 85.0511])
+    assert valid_tile(1, 1, 1)
+    assert not valid_tile(1, 2, 0)
+    assert not valid_tile(-1, 0, 0)
+
+
+def test_tile_features():
+    features = tile_features([SQUARE], 8, 199, 127)
+    assert len(features) == 1
+    polygons, properties = features[0]
+    assert properties == {"code": "E01000001", "name": "Square"}
+    # the bottom edge of the square is on the equator, the bottom of the tile
+    minx, miny, maxx, maxy = polygons[0].bounds
+    assert maxy == TILE_EXTENT
+    assert 0 < minx < maxx < TILE_EXTENT
+
+    # tiles the feature doesn't reach are empty
+    assert tile_features([SQUARE], 8, 0, 0) == []
+
+
+def test_encode_tile():
+    tile = read_message(encode_tile({"lsoa21": tile_features([SQUARE], 8, 199, 127)}))
+    assert [f for f, _ in tile] == [3]
+
+    layer = read_message(tile[0][1])
+    fields = {}
+    for field, value in layer:
+        fields.setdefault(field, []).append(value)
+    assert fields[15] == [2]
+    assert fields[1] == [b"lsoa21"]
+    assert fields[5] == [TILE_EXTENT]
+    assert fields[3] == [b"code", b"name"]
+    values = [read_message(v)[0][1] for v in fields[4]]
+    assert values == [b"E01000001", b"Square"]
+
+    assert len(fields[2]) == 1
+    feature = dict(read_message(fields[2][0]))
+    assert read_packed(feature[2]) == [0, 0, 1, 1]
+    assert feature[3] == 3
+    rings = decode_rings(read_packed(feature[4]))
+    assert len(rings) == 1
+    assert len(rings[0]) == 4
+    # exterior rings have a positive area in tile coordinates
+    assert shoelace(rings[0]) > 0
+
+
+def test_encode_empty_tile():
+    layer = read_message(read_message(encode_tile({"lsoa21": []}))[0][1])
+    assert (2, b"") not in layer
+    assert [f for f, _ in layer] == [15, 1, 5]
@@ -2,4 +2,5 @@ flask import rgc
 flask import chd
 flask import msoanames
 flask import placenames
-flask import nspl
\ No newline at end of file
+flask import nspl
+flask import nearest_places
\ No newline at end of file